@@ -0,0 +1,173 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+## run python $NUPIC/scripts/profiling/knn_lsh_benchmark.py [numPatterns]
+
+"""
+Compares exact KNNClassifier inference with the approximate MinHash/LSH mode,
+reporting the recall@k of the approximate search and the time per inference
+for several numbers of bands, both after learning all patterns and when
+learning and inference alternate on each record.
+"""
+
+import sys
+import time
+
+import numpy
+
+from nupic.algorithms.knn_classifier import KNNClassifier
+
+
+def makePatterns(numPatterns, numBits, numActive, numClusters, noise, rng):
+  """
+  Makes clustered sparse patterns, so that patterns have near neighbors.
+
+  @param numPatterns number of patterns
+  @param numBits width of the patterns
+  @param numActive number of active bits per pattern
+  @param numClusters number of cluster centers
+  @param noise fraction of the active bits of a center that each pattern moves
+  @param rng numpy RandomState
+  """
+  centers = [rng.choice(numBits, numActive, replace=False)
+             for _ in xrange(numClusters)]
+  numMoved = int(noise * numActive)
+  patterns = []
+  for _ in xrange(numPatterns):
+    center = centers[rng.randint(numClusters)]
+    kept = rng.choice(center, numActive - numMoved, replace=False)
+    moved = rng.choice(numBits, numMoved, replace=False)
+    patterns.append(numpy.union1d(kept, moved))
+  return patterns
+
+
+def recallAtK(exactDist, approximateDist, k):
+  """
+  Fraction of the approximate k nearest neighbors that are at least as close
+  as the exact k-th nearest neighbor. Ties are counted as hits.
+  """
+  kthDistance = numpy.sort(exactDist)[k - 1]
+  found = numpy.argsort(approximateDist, kind="mergesort")[:k]
+  found = found[numpy.isfinite(approximateDist[found])]
+  return float((exactDist[found] <= kthDistance).sum()) / k
+
+
+def benchmarkLSH(numPatterns, numQueries=100, numBits=2048, numActive=40,
+                 k=10, rowsPerBand=4, bandCounts=(4, 8, 16, 32)):
+  """
+  Times exact and approximate inference and measures recall@k.
+
+  @returns list of (numBands, recall, seconds per inference) tuples, where
+           numBands is 0 for exact inference
+  """
+  rng = numpy.random.RandomState(42)
+  patterns = makePatterns(numPatterns, numBits, numActive,
+                          numClusters=numPatterns // 20, noise=0.3, rng=rng)
+
+  # Each query is a stored pattern with 4 of its bits moved.
+  queries = []
+  for _ in xrange(numQueries):
+    pattern = patterns[rng.randint(numPatterns)]
+    dense = numpy.zeros(numBits)
+    dense[rng.choice(pattern, len(pattern) - 4, replace=False)] = 1.0
+    dense[rng.choice(numBits, 4, replace=False)] = 1.0
+    queries.append(dense)
+
+  results = []
+  exactDistances = None
+  for numBands in (0,) + tuple(bandCounts):
+    knn = KNNClassifier(k=k, distanceMethod="pctOverlapOfInput",
+                        numLSHBands=numBands, numLSHRowsPerBand=rowsPerBand)
+    for i, pattern in enumerate(patterns):
+      knn.learn(pattern, i % 10, isSparse=numBits)
+
+    start = time.time()
+    distances = [knn.getDistances(query)[0] for query in queries]
+    elapsed = (time.time() - start) / numQueries
+
+    if exactDistances is None:
+      exactDistances = distances
+    recall = numpy.mean([recallAtK(exact, approximate, k)
+                         for exact, approximate
+                         in zip(exactDistances, distances)])
+    results.append((numBands, recall, elapsed))
+
+  return results
+
+
+def benchmarkInterleaved(numPatterns, numQueries=100, numBits=2048,
+                         numActive=40, k=10, rowsPerBand=4,
+                         bandCounts=(4, 8, 16, 32)):
+  """
+  Times inference in online use: after learning all but the last numQueries
+  patterns, each remaining pattern is learned right after a query with its
+  bits moved is inferred.
+
+  @returns list of (numBands, seconds per inference) tuples, where numBands is
+           0 for exact inference
+  """
+  rng = numpy.random.RandomState(42)
+  patterns = makePatterns(numPatterns, numBits, numActive,
+                          numClusters=numPatterns // 20, noise=0.3, rng=rng)
+  numLearned = numPatterns - numQueries
+
+  results = []
+  for numBands in (0,) + tuple(bandCounts):
+    knn = KNNClassifier(k=k, distanceMethod="pctOverlapOfInput",
+                        numLSHBands=numBands, numLSHRowsPerBand=rowsPerBand)
+    for i, pattern in enumerate(patterns[:numLearned]):
+      knn.learn(pattern, i % 10, isSparse=numBits)
+
+    elapsed = 0.0
+    for i in xrange(numLearned, numPatterns):
+      pattern = patterns[i]
+      dense = numpy.zeros(numBits)
+      dense[rng.choice(pattern, len(pattern) - 4, replace=False)] = 1.0
+      dense[rng.choice(numBits, 4, replace=False)] = 1.0
+
+      start = time.time()
+      knn.getDistances(dense)
+      elapsed += time.time() - start
+      knn.learn(pattern, i % 10, isSparse=numBits)
+
+    results.append((numBands, elapsed / numQueries))
+
+  return results
+
+
+
+if __name__ == "__main__":
+  patterns = 20000
+  # read params from command line
+  if len(sys.argv) == 2: # 1 arg + name
+    patterns = int(sys.argv[1])
+
+  k = 10
+  print "%8s %10s %12s" % ("bands", "recall@%d" % k, "infer (ms)")
+  for numBands, recall, elapsed in benchmarkLSH(patterns, k=k):
+    print "%8s %10.3f %12.3f" % (numBands if numBands else "exact", recall,
+                                 elapsed * 1000)
+
+  print
+  print "Learning between inferences"
+  print "%8s %12s" % ("bands", "infer (ms)")
+  for numBands, elapsed in benchmarkInterleaved(patterns, k=k):
+    print "%8s %12.3f" % (numBands if numBands else "exact", elapsed * 1000)
@@ -0,0 +1,103 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+## run python $NUPIC/scripts/profiling/sp_inhibition_benchmark.py [nRuns]
+
+"""
+Compares the time taken by global inhibition in the SpatialPooler when the
+winners are picked by sorting all the overlaps, and when they are picked with
+a partial sort.
+"""
+
+import sys
+import timeit
+
+import numpy
+
+from nupic.algorithms.spatial_pooler import SpatialPooler
+
+
+def sortedWinners(sp, overlaps, numActive):
+  """
+  Global inhibition as done for small column counts, using a stable sort of
+  all the overlaps.
+  """
+  sortedWinnerIndices = numpy.argsort(overlaps, kind='mergesort')
+  start = len(sortedWinnerIndices) - numActive
+  while start < len(sortedWinnerIndices):
+    if overlaps[sortedWinnerIndices[start]] >= sp.getStimulusThreshold():
+      break
+    start += 1
+  return sortedWinnerIndices[start:][::-1]
+
+
+def benchmarkInhibition(numColumns, nRuns, density=0.02):
+  """
+  Times both global inhibition implementations on random overlaps.
+
+  @param numColumns number of columns in the SP
+  @param nRuns number of inhibition rounds to time
+  @param density fraction of the columns that survive inhibition
+  """
+  sp = SpatialPooler(inputDimensions=[32],
+                     columnDimensions=[numColumns],
+                     potentialRadius=16,
+                     globalInhibition=True,
+                     stimulusThreshold=1,
+                     seed=42)
+  numActive = int(density * numColumns)
+  randomState = numpy.random.RandomState(42)
+
+  results = []
+  for integerOverlaps in (True, False):
+    # Integer overlaps (no boosting) contain many ties, boosted overlaps don't
+    overlaps = randomState.rand(numColumns) * 40
+    if integerOverlaps:
+      overlaps = overlaps.astype(int)
+    overlaps = overlaps.astype("float32")
+
+    assert (sortedWinners(sp, overlaps, numActive) ==
+            sp._selectGlobalWinners(overlaps, numActive)).all()
+
+    sortTime = timeit.timeit(
+      lambda: sortedWinners(sp, overlaps, numActive), number=nRuns)
+    selectTime = timeit.timeit(
+      lambda: sp._selectGlobalWinners(overlaps, numActive), number=nRuns)
+    results.append((integerOverlaps, sortTime, selectTime))
+
+  return results
+
+
+
+if __name__ == "__main__":
+  runs = 1000
+  # read params from command line
+  if len(sys.argv) == 2: # 1 arg + name
+    runs = int(sys.argv[1])
+
+  print "%8s %10s %14s %14s %8s" % ("columns", "overlaps", "sort (us)",
+                                     "select (us)", "speedup")
+  for columns in (2048, 16384):
+    for integerOverlaps, sortTime, selectTime in benchmarkInhibition(columns,
+                                                                     runs):
+      print "%8d %10s %14.1f %14.1f %7.1fx" % (
+        columns, "integer" if integerOverlaps else "boosted",
+        sortTime * 1e6 / runs, selectTime * 1e6 / runs, sortTime / selectTime)
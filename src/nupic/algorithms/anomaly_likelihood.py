@@ -123,6 +123,10 @@ from nupic.serializable import Serializable
 from nupic.utils import MovingAverage
 
 
+# Number of anomaly scores AnomalyLikelihood averages over
+_AVERAGING_WINDOW = 10
+
+
 class AnomalyLikelihood(Serializable):
   """
   Helper class for running anomaly likelihood computation. To use it simply
@@ -146,7 +150,8 @@ class AnomalyLikelihood(Serializable):
                learningPeriod=288,
                estimationSamples=100,
                historicWindowSize=8640,
-               reestimationPeriod=100):
+               reestimationPeriod=100,
+               incrementalEstimation=False):
     """
     NOTE: Anomaly likelihood scores are reported at a flat 0.5 for
     learningPeriod + estimationSamples iterations.
@@ -177,6 +182,12 @@ class AnomalyLikelihood(Serializable):
       performance hit. In general the system is not very sensitive to this
       number as long as it is small relative to the total number of records
       processed.
+
+    :param incrementalEstimation: (bool) If True, the statistics the Gaussian
+      is estimated from are updated as records enter and leave the sliding
+      window, so that every re-estimation takes constant time instead of a
+      pass over the window. The estimates are the same as the batch ones, up
+      to floating point rounding.
     """
     if historicWindowSize < estimationSamples:
       raise ValueError("estimationSamples exceeds historicWindowSize")
@@ -195,6 +206,10 @@ class AnomalyLikelihood(Serializable):
     self._probationaryPeriod = self._learningPeriod + estimationSamples
     self._reestimationPeriod = reestimationPeriod
 
+    self._incrementalEstimation = incrementalEstimation
+    if incrementalEstimation:
+      self._resetIncrementalStatistics()
+
 
   def __eq__(self, o):
     # pylint: disable=W0212
@@ -204,10 +219,18 @@ class AnomalyLikelihood(Serializable):
             self._distribution == o._distribution and
             self._probationaryPeriod == o._probationaryPeriod and
             self._learningPeriod == o._learningPeriod and
-            self._reestimationPeriod == o._reestimationPeriod)
+            self._reestimationPeriod == o._reestimationPeriod and
+            self._incrementalEstimation == o._incrementalEstimation)
     # pylint: enable=W0212
 
 
+  def __setstate__(self, state):
+    # Backward compatibility
+    if "_incrementalEstimation" not in state:
+      state["_incrementalEstimation"] = False
+    self.__dict__.update(state)
+
+
   def __str__(self):
     return ("AnomalyLikelihood: %s %s %s %s %s %s" % (
       self._iteration,
@@ -259,6 +282,9 @@ class AnomalyLikelihood(Serializable):
     :param proto: (Object) capnp proto object specified in
                           nupic.regions.AnomalyLikelihoodRegion.capnp
 
+    The statistics of the incremental estimation, if enabled, are rebuilt from
+    the historical scores.
+
     :returns: (Object) the deserialized AnomalyLikelihood object
     """
     # pylint: disable=W0212
@@ -294,6 +320,10 @@ class AnomalyLikelihood(Serializable):
     anomalyLikelihood._probationaryPeriod = proto.probationaryPeriod
     anomalyLikelihood._learningPeriod = proto.learningPeriod
     anomalyLikelihood._reestimationPeriod = proto.reestimationPeriod
+
+    anomalyLikelihood._incrementalEstimation = proto.incrementalEstimation
+    if anomalyLikelihood._incrementalEstimation:
+      anomalyLikelihood._resetIncrementalStatistics()
     # pylint: enable=W0212
 
     return anomalyLikelihood
@@ -341,6 +371,7 @@ class AnomalyLikelihood(Serializable):
     proto.learningPeriod = self._learningPeriod
     proto.reestimationPeriod = self._reestimationPeriod
     proto.historicWindowSize = self._historicalScores.maxlen
+    proto.incrementalEstimation = bool(self._incrementalEstimation)
 
 
   def anomalyProbability(self, value, anomalyScore, timestamp=None):
@@ -368,14 +399,17 @@ class AnomalyLikelihood(Serializable):
       if ( (self._distribution is None) or
            (self._iteration % self._reestimationPeriod == 0) ):
 
-        numSkipRecords = self._calcSkipRecords(
-          numIngested=self._iteration,
-          windowSize=self._historicalScores.maxlen,
-          learningPeriod=self._learningPeriod)
+        if self._incrementalEstimation:
+          self._distribution = self._estimateIncrementally()
+        else:
+          numSkipRecords = self._calcSkipRecords(
+            numIngested=self._iteration,
+            windowSize=self._historicalScores.maxlen,
+            learningPeriod=self._learningPeriod)
 
-        _, _, self._distribution = estimateAnomalyLikelihoods(
-          self._historicalScores,
-          skipRecords=numSkipRecords)
+          _, _, self._distribution = estimateAnomalyLikelihoods(
+            self._historicalScores,
+            skipRecords=numSkipRecords)
 
       likelihoods, _, self._distribution = updateAnomalyLikelihoods(
         [dataPoint],
@@ -384,12 +418,191 @@ class AnomalyLikelihood(Serializable):
       likelihood = 1.0 - likelihoods[0]
 
     # Before we exit update historical scores and iteration
-    self._historicalScores.append(dataPoint)
+    self._appendHistoricalScore(dataPoint, self._iteration)
     self._iteration += 1
 
     return likelihood
 
 
+  def _appendHistoricalScore(self, dataPoint, index):
+    """
+    Appends a record to the historical scores. With incremental estimation,
+    also updates the statistics with the records that enter and leave the
+    window.
+
+    :param dataPoint: (tuple) (timestamp, value, anomalyScore) record
+    :param index: (int) Number of records before this one
+    """
+    if self._incrementalEstimation:
+      windowSize = self._historicalScores.maxlen
+      if len(self._historicalScores) == windowSize:
+        self._updateStatistics(self._historicalScores[0],
+                               self._averagedScores[0],
+                               index - windowSize,
+                               add=False)
+
+      average, self._averagingValues, self._averagingTotal = (
+        MovingAverage.compute(self._averagingValues, self._averagingTotal,
+                              dataPoint[2], _AVERAGING_WINDOW))
+      self._averagedScores.append(average)
+      self._updateStatistics(dataPoint, average, index, add=True)
+
+    self._historicalScores.append(dataPoint)
+
+
+  def _updateStatistics(self, dataPoint, average, index, add):
+    """
+    Adds a record to, or removes it from, the statistics of the incremental
+    estimation.
+
+    :param dataPoint: (tuple) (timestamp, value, anomalyScore) record
+    :param average: (float) Moving average of the anomaly score at the record
+    :param index: (int) Number of records before this one
+    :param add: (bool) Whether the record enters or leaves the window
+    """
+    isNumber = isinstance(dataPoint[1], numbers.Number)
+    if not isNumber:
+      self._numNonNumericValues += 1 if add else -1
+
+    # Records of the learning period are skipped, see _calcSkipRecords
+    if index >= self._learningPeriod:
+      if add:
+        self._scoreStatistics.add(average)
+        if isNumber:
+          self._valueStatistics.add(dataPoint[1])
+      else:
+        self._scoreStatistics.remove(average)
+        if isNumber:
+          self._valueStatistics.remove(dataPoint[1])
+
+
+  def _resetIncrementalStatistics(self):
+    """
+    Rebuilds the statistics of the incremental estimation from the historical
+    scores.
+    """
+    records = list(self._historicalScores)
+    self._historicalScores.clear()
+    self._averagedScores = collections.deque(
+      maxlen=self._historicalScores.maxlen)
+    self._averagingValues = []
+    self._averagingTotal = 0.0
+    self._scoreStatistics = _SlidingStatistics()
+    self._valueStatistics = _SlidingStatistics()
+    self._numNonNumericValues = 0
+
+    firstIndex = self._iteration - len(records)
+    for i, record in enumerate(records):
+      self._appendHistoricalScore(record, firstIndex + i)
+
+
+  def _estimateIncrementally(self):
+    """
+    Computes the estimator params that estimateAnomalyLikelihoods returns for
+    the historical scores, in constant time.
+
+    :returns: (dict) The estimator params
+    """
+    numRecords = len(self._historicalScores)
+    windowStart = self._iteration - numRecords
+    sampleStart = max(self._learningPeriod, windowStart)
+
+    # estimateAnomalyLikelihoods averages the scores from the start of the
+    # window, so once the window has moved, its first averages are over fewer
+    # scores than the ones kept here.
+    windowAverages = {}
+    if windowStart > 0:
+      total = 0.0
+      for i in xrange(min(_AVERAGING_WINDOW - 1, numRecords)):
+        total += self._historicalScores[i][2]
+        windowAverages[i] = float(total) / (i + 1)
+
+    if sampleStart >= self._iteration:
+      distributionParams = nullDistribution()
+    else:
+      scoreStatistics = self._scoreStatistics
+      if windowAverages:
+        scoreStatistics = scoreStatistics.copy()
+        for i, average in windowAverages.iteritems():
+          if windowStart + i >= sampleStart:
+            scoreStatistics.remove(self._averagedScores[i])
+            scoreStatistics.add(average)
+      distributionParams = _normalDistribution(scoreStatistics.mean,
+                                               scoreStatistics.variance)
+
+      # Flat metric values, see estimateAnomalyLikelihoods
+      if (self._numNonNumericValues == 0 and
+          self._valueStatistics.variance < 1.5e-5):
+        distributionParams = nullDistribution()
+
+    lastIndices = xrange(max(0, numRecords - _AVERAGING_WINDOW), numRecords)
+    historicalValues = [self._historicalScores[i][2] for i in lastIndices]
+    historicalLikelihoods = [
+      tailProbability(windowAverages.get(i, self._averagedScores[i]),
+                      distributionParams)
+      for i in lastIndices]
+
+    return {
+      "distribution": distributionParams,
+      "movingAverage": {
+        "historicalValues": historicalValues,
+        "total": float(sum(historicalValues)),
+        "windowSize": _AVERAGING_WINDOW,
+      },
+      "historicalLikelihoods": historicalLikelihoods,
+    }
+
+
+
+class _SlidingStatistics(object):
+  """
+  Mean and variance of values that are added and removed one at a time, in
+  constant time. Keeps the sum of squared deviations from the mean rather
+  than the sum of squares, which loses precision when the variance is small
+  relative to the mean (Welford's algorithm, run backwards for removals).
+  """
+
+  def __init__(self):
+    self.count = 0
+    self.mean = 0.0
+    self._sumSquaredDeviations = 0.0
+
+
+  def add(self, value):
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self._sumSquaredDeviations += delta * (value - self.mean)
+
+
+  def remove(self, value):
+    self.count -= 1
+    if self.count == 0:
+      self.mean = 0.0
+      self._sumSquaredDeviations = 0.0
+      return
+
+    delta = value - self.mean
+    self.mean -= delta / self.count
+    self._sumSquaredDeviations -= delta * (value - self.mean)
+
+
+  @property
+  def variance(self):
+    """Population variance, like numpy.var."""
+    if self.count == 0:
+      return 0.0
+    return max(0.0, self._sumSquaredDeviations / self.count)
+
+
+  def copy(self):
+    statistics = _SlidingStatistics()
+    statistics.count = self.count
+    statistics.mean = self.mean
+    statistics._sumSquaredDeviations = self._sumSquaredDeviations
+    return statistics
+
+
 
 def estimateAnomalyLikelihoods(anomalyScores,
                                averagingWindow=10,
@@ -683,10 +896,23 @@ def estimateNormal(sampleData, performLowerBoundCheck=True):
   :returns: A dict containing the parameters of a normal distribution based on
       the ``sampleData``.
   """
+  return _normalDistribution(numpy.mean(sampleData), numpy.var(sampleData),
+                             performLowerBoundCheck)
+
+
+
+def _normalDistribution(mean, variance, performLowerBoundCheck=True):
+  """
+  :param mean: mean of the sample data
+  :param variance: variance of the sample data
+  :param performLowerBoundCheck: see :func:`estimateNormal`
+  :returns: A dict containing the parameters of a normal distribution with
+      this mean and variance.
+  """
   params = {
     "name": "normal",
-    "mean": numpy.mean(sampleData),
-    "variance": numpy.var(sampleData),
+    "mean": mean,
+    "variance": variance,
   }
 
   if performLowerBoundCheck:
@@ -19,10 +19,17 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+from array import array
 from bisect import bisect_left
 from collections import defaultdict
+import sys
+
+import numpy
 
 from nupic.serializable import Serializable
+from nupic.support.memory_usage import (FLOAT_BYTES, HASH_ENTRY_BYTES,
+                                        INT_BYTES, POINTER_BYTES, arrayBytes,
+                                        listBytes, withTotal)
 
 EPSILON = 0.00001 # constant error threshold to check equality of permanences to
                   # other floats
@@ -109,6 +116,16 @@ class CellData(object):
 
 
 
+# Sizes of the objects that make up Connections, without their contents.
+_SET_BYTES = sys.getsizeof(set())
+_CELL_BYTES = sys.getsizeof(CellData()) + sys.getsizeof([])
+_SEGMENT_BYTES = (sys.getsizeof(Segment(0, 0, long(0))) + _SET_BYTES +
+                  INT_BYTES)
+_SYNAPSE_BYTES = (sys.getsizeof(Synapse(None, 0, 0.0, long(0))) + INT_BYTES +
+                  FLOAT_BYTES + INT_BYTES)
+
+
+
 def binSearch(arr, val):
   """ 
   Function for running binary search on a sorted list.
@@ -140,6 +157,12 @@ class Connections(Serializable):
     self._synapsesForPresynapticCell = defaultdict(set)
     self._segmentForFlatIdx = []
 
+    # Cell and ordinal of every flatIdx, so that groups of segments can be
+    # sorted and mapped to cells without visiting the Segment objects. The
+    # cell of a free flatIdx is -1.
+    self._segmentCells = numpy.empty(0, dtype="int32")
+    self._segmentOrdinals = numpy.empty(0, dtype="int64")
+
     self._numSynapses = 0
     self._freeFlatIdxs = []
     self._nextFlatIdx = 0
@@ -224,6 +247,29 @@ class Connections(Serializable):
     return self._segmentForFlatIdx[flatIdx]
 
 
+  def cellsForSegmentFlatIdxs(self, flatIdxs):
+    """
+    Returns the cells of several segments at once.
+
+    :param flatIdxs: (numpy.ndarray) Flat indices of live segments
+    :returns: (numpy.ndarray) Cell of each segment, aligned with ``flatIdxs``
+    """
+    return self._segmentCells[flatIdxs]
+
+
+  def sortSegmentFlatIdxs(self, flatIdxs):
+    """
+    Sorts segment flat indices in the order given by
+    :meth:`segmentPositionSortKey`, i.e. by cell and then by age.
+
+    :param flatIdxs: (numpy.ndarray) Flat indices of live segments
+    :returns: (numpy.ndarray) The sorted flat indices
+    """
+    order = numpy.lexsort((self._segmentOrdinals[flatIdxs],
+                           self._segmentCells[flatIdxs]))
+    return flatIdxs[order]
+
+
   def segmentFlatListLength(self):
     """ 
     Get the needed length for a list to hold a value for every segment's 
@@ -260,6 +306,10 @@ class Connections(Serializable):
       flatIdx = self._nextFlatIdx
       self._segmentForFlatIdx.append(None)
       self._nextFlatIdx += 1
+      self._segmentCells = _growArray(self._segmentCells, self._nextFlatIdx,
+                                      fill=-1)
+      self._segmentOrdinals = _growArray(self._segmentOrdinals,
+                                         self._nextFlatIdx)
 
     ordinal = self._nextSegmentOrdinal
     self._nextSegmentOrdinal += 1
@@ -267,6 +317,8 @@ class Connections(Serializable):
     segment = Segment(cell, flatIdx, ordinal)
     cellData._segments.append(segment)
     self._segmentForFlatIdx[flatIdx] = segment
+    self._segmentCells[flatIdx] = cell
+    self._segmentOrdinals[flatIdx] = ordinal
 
     return segment
 
@@ -291,6 +343,7 @@ class Connections(Serializable):
     # garbage-collected.
     self._freeFlatIdxs.append(segment.flatIdx)
     self._segmentForFlatIdx[segment.flatIdx] = None
+    self._segmentCells[segment.flatIdx] = -1
 
 
   def createSynapse(self, segment, presynapticCell, permanence):
@@ -410,6 +463,78 @@ class Connections(Serializable):
     return self._numSynapses
 
 
+  def fragmentation(self):
+    """
+    Returns the fraction of flat indices that are not in use. See
+    :meth:`compact`.
+
+    :returns: (float) Fraction of unused flat indices, between 0 and 1.
+    """
+    if self._nextFlatIdx == 0:
+      return 0.0
+    return len(self._freeFlatIdxs) / float(self._nextFlatIdx)
+
+
+  def compact(self):
+    """
+    Renumbers the segments densely, in cell order, so that
+    :meth:`segmentFlatListLength` equals the number of segments and the
+    freed flat indices are released. Segment objects stay valid and have
+    their ``flatIdx`` updated. Ordinals are kept, so ordering by age is not
+    affected.
+
+    Any list indexed by flatIdx must be remapped with the returned mapping.
+    :meth:`~nupic.algorithms.temporal_memory.TemporalMemory.compact` does this
+    for the Temporal Memory's own lists.
+
+    :returns: (numpy.ndarray) New flatIdx for every old flatIdx, or -1 for
+              flat indices that were not in use.
+    """
+    newFlatIdxs = numpy.full(self._nextFlatIdx, -1, dtype="int64")
+    self._segmentForFlatIdx = []
+
+    for cellData in self._cells:
+      for segment in cellData._segments:
+        flatIdx = len(self._segmentForFlatIdx)
+        newFlatIdxs[segment.flatIdx] = flatIdx
+        segment.flatIdx = flatIdx
+        self._segmentForFlatIdx.append(segment)
+
+    self._segmentCells = numpy.array(
+      [segment.cell for segment in self._segmentForFlatIdx], dtype="int32")
+    self._segmentOrdinals = numpy.array(
+      [segment._ordinal for segment in self._segmentForFlatIdx],
+      dtype="int64")
+    self._freeFlatIdxs = []
+    self._nextFlatIdx = len(self._segmentForFlatIdx)
+
+    return newFlatIdxs
+
+
+  def getMemoryUsage(self):
+    """
+    Estimates the memory used by the segments and synapses, from their counts.
+
+    :returns: (dict) Estimated bytes for ``segments``, ``synapses``,
+              ``presynapticIndex`` and their ``total``.
+    """
+    numSegments = self._nextFlatIdx - len(self._freeFlatIdxs)
+    numCells = len(self._cells)
+
+    return withTotal({
+      "segments": (numCells * (_CELL_BYTES + POINTER_BYTES) +
+                   numSegments * (_SEGMENT_BYTES + POINTER_BYTES) +
+                   listBytes(self._segmentForFlatIdx) +
+                   listBytes(self._freeFlatIdxs, INT_BYTES) +
+                   arrayBytes(self._segmentCells, self._segmentOrdinals)),
+      "synapses": self._numSynapses * (_SYNAPSE_BYTES + HASH_ENTRY_BYTES),
+      "presynapticIndex": (
+        listBytes(self._synapsesForPresynapticCell) +
+        len(self._synapsesForPresynapticCell) * _SET_BYTES +
+        self._numSynapses * HASH_ENTRY_BYTES),
+    })
+
+
   def segmentPositionSortKey(self, segment):
     """ 
     Return a numeric key for sorting this segment. This can be used with the 
@@ -484,6 +609,13 @@ class Connections(Serializable):
 
           connections._numSynapses += 1
 
+    connections._segmentCells = numpy.array(
+      [segment.cell for segment in connections._segmentForFlatIdx],
+      dtype="int32")
+    connections._segmentOrdinals = numpy.array(
+      [segment._ordinal for segment in connections._segmentForFlatIdx],
+      dtype="int64")
+
     #pylint: enable=W0212
     return connections
 
@@ -556,3 +688,696 @@ class Connections(Serializable):
     :param other: (:class:`Connections`) Connections instance to compare to
     """
     return not self.__eq__(other)
+
+
+
+class ArraySegment(object):
+  """
+  Segment handle used by :class:`ArrayConnections`. It identifies a segment in
+  the same way as :class:`Segment`, but the segment's synapses are stored as
+  indices into the connections' synapse arrays.
+
+  :param connections: (:class:`ArrayConnections`) Owner of this segment.
+
+  :param cell: (int) Index of the cell that this segment is on.
+
+  :param flatIdx: (int) The segment's flattened list index.
+
+  :param ordinal: (long) Used to sort segments.
+  """
+
+  __slots__ = ["cell", "flatIdx", "_synapses", "_ordinal", "_connections"]
+
+  def __init__(self, connections, cell, flatIdx, ordinal):
+    self.cell = cell
+    self.flatIdx = flatIdx
+    self._synapses = array("i")
+    self._ordinal = ordinal
+    self._connections = connections
+
+
+  def __eq__(self, other):
+    """ Explicitly implement this for unit testing. Like :class:`Segment`, two
+    segments are equal when they are on the same cell and hold equal synapses.
+    """
+    ordinal = lambda x: x._ordinal
+    return (self.cell == other.cell and
+            (sorted(self._connections.synapsesForSegment(self), key=ordinal) ==
+             sorted(other._connections.synapsesForSegment(other), key=ordinal)))
+
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+
+
+class ArraySynapse(object):
+  """
+  Synapse handle used by :class:`ArrayConnections`. It is a view onto one entry
+  of the connections' synapse arrays, exposing the same attributes as
+  :class:`Synapse`.
+
+  :param connections: (:class:`ArrayConnections`) Owner of this synapse.
+
+  :param idx: (int) Index of the synapse in the synapse arrays.
+  """
+
+  __slots__ = ["_connections", "_idx"]
+
+  def __init__(self, connections, idx):
+    self._connections = connections
+    self._idx = idx
+
+
+  @property
+  def segment(self):
+    connections = self._connections
+    return connections._segmentForFlatIdx[
+      connections._synapseSegments[self._idx]]
+
+
+  @property
+  def presynapticCell(self):
+    return int(self._connections._presynapticCells[self._idx])
+
+
+  @property
+  def permanence(self):
+    return float(self._connections._permanences[self._idx])
+
+
+  @property
+  def _ordinal(self):
+    return long(self._connections._synapseOrdinals[self._idx])
+
+
+  def __eq__(self, other):
+    """ Views of the same connections are equal when they refer to the same
+    synapse. Otherwise compare like :class:`Synapse`, allowing floating point
+    differences for synapse permanence.
+    """
+    if self._connections is getattr(other, "_connections", None):
+      return self._idx == other._idx
+    return (self.segment.cell == other.segment.cell and
+            self.presynapticCell == other.presynapticCell and
+            abs(self.permanence - other.permanence) < EPSILON)
+
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+
+  def __hash__(self):
+    return hash(self._idx)
+
+
+
+_ARRAY_SEGMENT_BYTES = (sys.getsizeof(ArraySegment(None, 0, 0, long(0))) +
+                        sys.getsizeof(array("i")) + INT_BYTES)
+
+
+
+def _growArray(arr, minSize, fill=0):
+  """
+  Returns ``arr`` if it holds at least ``minSize`` elements, otherwise a copy
+  with at least double the capacity, padded with ``fill``.
+  """
+  if minSize <= arr.size:
+    return arr
+  grown = numpy.empty(max(minSize, 2 * arr.size), dtype=arr.dtype)
+  grown[:arr.size] = arr
+  grown[arr.size:] = fill
+  return grown
+
+
+
+def _rangeIndices(starts, counts):
+  """
+  Concatenates the ranges ``[starts[i], starts[i] + counts[i])``.
+
+  :param starts: (numpy.ndarray) Start of each range
+  :param counts: (numpy.ndarray) Length of each range
+  :returns: (numpy.ndarray) int64 indices of all ranges, in order
+  """
+  counts = counts.astype("int64")
+  offsets = numpy.cumsum(counts) - counts
+  return (numpy.repeat(starts - offsets, counts) +
+          numpy.arange(counts.sum(), dtype="int64"))
+
+
+
+class ArrayConnections(Connections):
+  """
+  Struct-of-arrays variant of :class:`Connections`, with the same public API.
+
+  Segments and synapses live in growable numpy arrays (segment cell, synapse
+  segment, presynaptic cell, permanence and ordinal) rather than one Python
+  object per synapse. Destroyed entries go on free-lists and are recycled.
+  This uses far less memory for large networks.
+
+  Synapses are also indexed by presynaptic cell: every presynaptic cell owns a
+  block of a flat array listing its synapses, with spare capacity so that
+  creating and destroying synapses updates the index in place. Blocks that
+  fill up move to the end of the array, and the array is repacked once more
+  than half of it is unused. :meth:`computeActivity` gathers the blocks of the
+  active cells and counts them with ``numpy.bincount``, so its cost is
+  proportional to the number of active synapses. Synapses returned by
+  this class are lightweight :class:`ArraySynapse` views, so they are only
+  valid until the synapse is destroyed.
+
+  Select it for a :class:`~nupic.algorithms.temporal_memory.TemporalMemory`
+  by overriding
+  :meth:`~nupic.algorithms.temporal_memory.TemporalMemory.connectionsFactory`.
+
+  :param numCells: (int) Number of cells in collection.
+  """
+
+  INITIAL_CAPACITY = 1024
+
+  def __init__(self, numCells):
+
+    # Save member variables
+    self.numCells = numCells
+
+    self._cells = [CellData() for _ in xrange(numCells)]
+    self._segmentForFlatIdx = []
+    self._segmentCells = numpy.full(self.INITIAL_CAPACITY, -1, dtype="int32")
+    self._segmentOrdinals = numpy.zeros(self.INITIAL_CAPACITY, dtype="int64")
+
+    self._freeFlatIdxs = []
+    self._nextFlatIdx = 0
+
+    # A synapse index whose segment is -1 is free.
+    self._synapseSegments = numpy.full(self.INITIAL_CAPACITY, -1,
+                                       dtype="int32")
+    self._presynapticCells = numpy.zeros(self.INITIAL_CAPACITY, dtype="int32")
+    self._permanences = numpy.zeros(self.INITIAL_CAPACITY, dtype="float64")
+    self._synapseOrdinals = numpy.zeros(self.INITIAL_CAPACITY, dtype="int64")
+
+    self._numSynapses = 0
+    self._freeSynapseIdxs = []
+    self._nextSynapseIdx = 0
+
+    # Presynaptic cell index. Presynaptic cells may lie outside this
+    # collection, e.g. external inputs, so the per-cell arrays grow as needed.
+    self._presynapticStarts = numpy.zeros(numCells, dtype="int64")
+    self._presynapticCounts = numpy.zeros(numCells, dtype="int32")
+    self._presynapticCapacities = numpy.zeros(numCells, dtype="int32")
+    self._presynapticSynapses = numpy.zeros(self.INITIAL_CAPACITY,
+                                            dtype="int32")
+    self._presynapticEnd = 0
+    self._presynapticSlots = numpy.zeros(self.INITIAL_CAPACITY, dtype="int64")
+
+    self._nextSynapseOrdinal = long(0)
+    self._nextSegmentOrdinal = long(0)
+
+
+  def synapsesForSegment(self, segment):
+    """
+    Returns the synapses on a segment.
+
+    :param segment: (:class:`ArraySegment`) Segment
+    :returns: (set) :class:`ArraySynapse` objects on the given segment.
+    """
+    return set(ArraySynapse(self, idx) for idx in segment._synapses)
+
+
+  def synapseIndicesForSegment(self, segment):
+    """
+    Returns the indices of a segment's synapses in the synapse arrays, in the
+    order the synapses were created.
+
+    :param segment: (:class:`ArraySegment`) Segment
+    :returns: (numpy.ndarray) Synapse indices
+    """
+    return numpy.frombuffer(segment._synapses, dtype="int32").copy()
+
+
+  def synapseData(self, idxs):
+    """
+    Returns the data of several synapses at once.
+
+    :param idxs: (numpy.ndarray) Synapse indices, e.g. from
+           :meth:`synapseIndicesForSegment`
+    :returns: (tuple) (``presynapticCells``, ``permanences``, ``ordinals``)
+              numpy arrays aligned with ``idxs``
+    """
+    return (self._presynapticCells[idxs],
+            self._permanences[idxs],
+            self._synapseOrdinals[idxs])
+
+
+  def synapsesForPresynapticCell(self, presynapticCell):
+    """
+    Returns the synapses for the source cell that they synapse on.
+
+    :param presynapticCell: (int) Source cell index
+
+    :returns: (set) :class:`ArraySynapse` objects
+    """
+    if presynapticCell >= self._presynapticCounts.size:
+      return set()
+    start = self._presynapticStarts[presynapticCell]
+    end = start + self._presynapticCounts[presynapticCell]
+    return set(ArraySynapse(self, idx)
+               for idx in self._presynapticSynapses[start:end])
+
+
+  def createSegment(self, cell):
+    """
+    Adds a new segment on a cell.
+
+    :param cell: (int) Cell index
+    :returns: (:class:`ArraySegment`) New segment
+    """
+    if len(self._freeFlatIdxs) > 0:
+      flatIdx = self._freeFlatIdxs.pop()
+    else:
+      flatIdx = self._nextFlatIdx
+      self._segmentForFlatIdx.append(None)
+      self._nextFlatIdx += 1
+      self._segmentCells = _growArray(self._segmentCells, self._nextFlatIdx,
+                                      fill=-1)
+      self._segmentOrdinals = _growArray(self._segmentOrdinals,
+                                         self._nextFlatIdx)
+
+    ordinal = self._nextSegmentOrdinal
+    self._nextSegmentOrdinal += 1
+
+    segment = ArraySegment(self, cell, flatIdx, ordinal)
+    self._cells[cell]._segments.append(segment)
+    self._segmentForFlatIdx[flatIdx] = segment
+    self._segmentCells[flatIdx] = cell
+    self._segmentOrdinals[flatIdx] = ordinal
+
+    return segment
+
+
+  def destroySegment(self, segment):
+    """
+    Destroys a segment.
+
+    :param segment: (:class:`ArraySegment`) representing the segment to be
+           destroyed.
+    """
+    idxs = self.synapseIndicesForSegment(segment)
+    for idx in idxs:
+      self._removeFromPresynapticIndex(idx)
+    self._synapseSegments[idxs] = -1
+    self._freeSynapseIdxs.extend(idxs.tolist())
+    self._numSynapses -= len(idxs)
+    del segment._synapses[:]
+
+    # Find the segment by identity; segments with equal synapses compare equal.
+    segments = self._cells[segment.cell]._segments
+    i = next(i for i, other in enumerate(segments) if other is segment)
+    del segments[i]
+
+    self._freeFlatIdxs.append(segment.flatIdx)
+    self._segmentForFlatIdx[segment.flatIdx] = None
+    self._segmentCells[segment.flatIdx] = -1
+
+
+  def createSynapse(self, segment, presynapticCell, permanence):
+    """
+    Creates a new synapse on a segment.
+
+    :param segment: (:class:`ArraySegment`) Segment object for synapse to be
+           synapsed to.
+    :param presynapticCell: (int) Source cell index.
+    :param permanence: (float) Initial permanence of synapse.
+    :returns: (:class:`ArraySynapse`) created synapse
+    """
+    if len(self._freeSynapseIdxs) > 0:
+      idx = self._freeSynapseIdxs.pop()
+    else:
+      idx = self._nextSynapseIdx
+      self._nextSynapseIdx += 1
+      if idx >= self._synapseSegments.size:
+        size = idx + 1
+        self._synapseSegments = _growArray(self._synapseSegments, size,
+                                           fill=-1)
+        self._presynapticCells = _growArray(self._presynapticCells, size)
+        self._permanences = _growArray(self._permanences, size)
+        self._synapseOrdinals = _growArray(self._synapseOrdinals, size)
+        self._presynapticSlots = _growArray(self._presynapticSlots, size)
+
+    self._synapseSegments[idx] = segment.flatIdx
+    self._presynapticCells[idx] = presynapticCell
+    self._permanences[idx] = permanence
+    self._synapseOrdinals[idx] = self._nextSynapseOrdinal
+    self._nextSynapseOrdinal += 1
+    segment._synapses.append(idx)
+    self._addToPresynapticIndex(presynapticCell, idx)
+
+    self._numSynapses += 1
+
+    return ArraySynapse(self, idx)
+
+
+  def _addToPresynapticIndex(self, presynapticCell, idx):
+    if presynapticCell >= self._presynapticCounts.size:
+      size = presynapticCell + 1
+      self._presynapticStarts = _growArray(self._presynapticStarts, size)
+      self._presynapticCounts = _growArray(self._presynapticCounts, size)
+      self._presynapticCapacities = _growArray(self._presynapticCapacities,
+                                               size)
+
+    count = self._presynapticCounts[presynapticCell]
+    if count == self._presynapticCapacities[presynapticCell]:
+      self._movePresynapticBlock(presynapticCell, max(2 * count, 4))
+
+    slot = self._presynapticStarts[presynapticCell] + count
+    self._presynapticSynapses[slot] = idx
+    self._presynapticSlots[idx] = slot
+    self._presynapticCounts[presynapticCell] += 1
+
+
+  def _removeFromPresynapticIndex(self, idx):
+    # Fill the hole with the last synapse in the cell's block.
+    presynapticCell = self._presynapticCells[idx]
+    slot = self._presynapticSlots[idx]
+    self._presynapticCounts[presynapticCell] -= 1
+    last = (self._presynapticStarts[presynapticCell] +
+            self._presynapticCounts[presynapticCell])
+    moved = self._presynapticSynapses[last]
+    self._presynapticSynapses[slot] = moved
+    self._presynapticSlots[moved] = slot
+
+
+  def _movePresynapticBlock(self, presynapticCell, capacity):
+    """
+    Moves a presynaptic cell's block to the end of the flat index with a new
+    capacity, repacking the index first if it is mostly unused.
+    """
+    end = self._presynapticEnd
+    if end + capacity > self._presynapticSynapses.size:
+      if 2 * self._presynapticCapacities.sum() < end:
+        self._repackPresynapticIndex()
+        end = self._presynapticEnd
+      self._presynapticSynapses = _growArray(self._presynapticSynapses,
+                                             end + capacity)
+
+    start = self._presynapticStarts[presynapticCell]
+    count = self._presynapticCounts[presynapticCell]
+    idxs = self._presynapticSynapses[start:start + count].copy()
+    self._presynapticSynapses[end:end + count] = idxs
+    self._presynapticSlots[idxs] = numpy.arange(end, end + count)
+
+    self._presynapticStarts[presynapticCell] = end
+    self._presynapticCapacities[presynapticCell] = capacity
+    self._presynapticEnd = end + capacity
+
+
+  def _repackPresynapticIndex(self):
+    capacities = self._presynapticCapacities
+    counts = self._presynapticCounts
+    starts = numpy.cumsum(capacities, dtype="int64") - capacities
+
+    src = _rangeIndices(self._presynapticStarts, counts)
+    dst = _rangeIndices(starts, counts)
+    idxs = self._presynapticSynapses[src]
+    self._presynapticSynapses[dst] = idxs
+    self._presynapticSlots[idxs] = dst
+
+    self._presynapticStarts = starts
+    self._presynapticEnd = int(capacities.sum())
+
+
+  def destroySynapse(self, synapse):
+    """
+    Destroys a synapse.
+
+    :param synapse: (:class:`ArraySynapse`) synapse to destroy
+    """
+    idx = synapse._idx
+    segment = synapse.segment
+    segment._synapses.remove(idx)
+    self._removeFromPresynapticIndex(idx)
+    self._synapseSegments[idx] = -1
+    self._freeSynapseIdxs.append(idx)
+
+    self._numSynapses -= 1
+
+
+  def updateSynapsePermanence(self, synapse, permanence):
+    """
+    Updates the permanence for a synapse.
+
+    :param synapse: (:class:`ArraySynapse`) to be updated.
+    :param permanence: (float) New permanence.
+    """
+    self._permanences[synapse._idx] = permanence
+
+
+  def updateSynapsePermanences(self, idxs, permanences):
+    """
+    Updates the permanences of several synapses at once.
+
+    :param idxs: (numpy.ndarray) Synapse indices
+    :param permanences: (numpy.ndarray) New permanences, aligned with ``idxs``
+    """
+    self._permanences[idxs] = permanences
+
+
+  def destroySynapses(self, idxs):
+    """
+    Destroys several synapses at once.
+
+    :param idxs: (numpy.ndarray) Synapse indices
+    """
+    for idx in idxs:
+      self.destroySynapse(ArraySynapse(self, int(idx)))
+
+
+  def computeActivity(self, activePresynapticCells, connectedPermanence):
+    """
+    Compute each segment's number of active synapses for a given input.
+    In the returned arrays, a segment's active synapse count is stored at index
+    ``segment.flatIdx``.
+
+    :param activePresynapticCells: (iter) Active cells.
+    :param connectedPermanence: (float) Permanence threshold for a synapse to be
+           considered connected
+
+    :returns: (tuple) (``numActiveConnectedSynapsesForSegment``
+                      [numpy.ndarray],
+                      ``numActivePotentialSynapsesForSegment``
+                      [numpy.ndarray])
+    """
+    activeCells = numpy.asarray(list(activePresynapticCells), dtype="int64")
+    activeCells = activeCells[activeCells < self._presynapticCounts.size]
+
+    activeSynapses = self._presynapticSynapses[
+      _rangeIndices(self._presynapticStarts[activeCells],
+                    self._presynapticCounts[activeCells])]
+    activeSegments = self._synapseSegments[activeSynapses]
+    connected = (self._permanences[activeSynapses] >
+                 connectedPermanence - EPSILON)
+
+    # bincount rejects a minlength of 0, so always count at least one bin.
+    numBins = self._nextFlatIdx
+    numActivePotentialSynapsesForSegment = numpy.bincount(
+      activeSegments, minlength=max(numBins, 1))[:numBins]
+    numActiveConnectedSynapsesForSegment = numpy.bincount(
+      activeSegments[connected], minlength=max(numBins, 1))[:numBins]
+
+    return (numActiveConnectedSynapsesForSegment,
+            numActivePotentialSynapsesForSegment)
+
+
+  def numSynapses(self, segment=None):
+    """
+    Returns the number of Synapses.
+
+    :param segment: (:class:`ArraySegment`) Optional parameter to get the
+           number of synapses on a segment.
+
+    :returns: (int) Number of synapses on all segments if segment is not
+              specified, or on a specified segment.
+    """
+    if segment is not None:
+      return len(segment._synapses)
+    return self._numSynapses
+
+
+  def fragmentation(self):
+    """
+    Returns the fraction of segment or synapse slots, whichever is larger,
+    that are not in use. See :meth:`compact`.
+
+    :returns: (float) Fraction of unused slots, between 0 and 1.
+    """
+    synapseFragmentation = 0.0
+    if self._nextSynapseIdx > 0:
+      synapseFragmentation = (len(self._freeSynapseIdxs) /
+                              float(self._nextSynapseIdx))
+    return max(super(ArrayConnections, self).fragmentation(),
+               synapseFragmentation)
+
+
+  def compact(self):
+    """
+    Renumbers segments and synapses densely and shrinks the arrays to fit.
+
+    Segments are ordered by cell and then by age. Synapses are ordered by
+    segment and then by age, so each segment's synapses are contiguous. The
+    presynaptic index is rebuilt without spare capacity, with each cell's
+    block in synapse order. Ordinals are kept.
+
+    Segment objects stay valid and have their ``flatIdx`` updated, but
+    :class:`ArraySynapse` views taken before compacting are invalidated.
+
+    :returns: (numpy.ndarray) New flatIdx for every old flatIdx, or -1 for
+              flat indices that were not in use.
+    """
+    oldSegmentCount = self._nextFlatIdx
+    liveSegments = numpy.flatnonzero(
+      self._segmentCells[:oldSegmentCount] >= 0)
+    liveSegments = self.sortSegmentFlatIdxs(liveSegments)
+    numSegments = len(liveSegments)
+
+    newFlatIdxs = numpy.full(oldSegmentCount, -1, dtype="int64")
+    newFlatIdxs[liveSegments] = numpy.arange(numSegments)
+
+    liveSynapses = numpy.flatnonzero(
+      self._synapseSegments[:self._nextSynapseIdx] >= 0)
+    synapseSegments = newFlatIdxs[self._synapseSegments[liveSynapses]]
+    order = numpy.lexsort((self._synapseOrdinals[liveSynapses],
+                           synapseSegments))
+    liveSynapses = liveSynapses[order]
+    synapseSegments = synapseSegments[order]
+    numSynapses = len(liveSynapses)
+
+    self._segmentCells = self._segmentCells[liveSegments]
+    self._segmentOrdinals = self._segmentOrdinals[liveSegments]
+    self._synapseSegments = synapseSegments.astype("int32")
+    self._presynapticCells = self._presynapticCells[liveSynapses]
+    self._permanences = self._permanences[liveSynapses]
+    self._synapseOrdinals = self._synapseOrdinals[liveSynapses]
+
+    segmentStarts = numpy.searchsorted(
+      synapseSegments, numpy.arange(numSegments + 1)).tolist()
+    oldSegmentForFlatIdx = self._segmentForFlatIdx
+    self._segmentForFlatIdx = []
+    for flatIdx, oldFlatIdx in enumerate(liveSegments.tolist()):
+      segment = oldSegmentForFlatIdx[oldFlatIdx]
+      segment.flatIdx = flatIdx
+      segment._synapses = array("i", xrange(segmentStarts[flatIdx],
+                                            segmentStarts[flatIdx + 1]))
+      self._segmentForFlatIdx.append(segment)
+
+    self._freeFlatIdxs = []
+    self._nextFlatIdx = numSegments
+    self._freeSynapseIdxs = []
+    self._nextSynapseIdx = numSynapses
+
+    # A stable sort keeps each presynaptic cell's block in synapse order.
+    counts = numpy.bincount(self._presynapticCells,
+                            minlength=self._presynapticCounts.size)
+    self._presynapticCounts = counts.astype("int32")
+    self._presynapticCapacities = counts.astype("int32")
+    self._presynapticStarts = numpy.cumsum(counts, dtype="int64") - counts
+    self._presynapticSynapses = numpy.argsort(
+      self._presynapticCells, kind="mergesort").astype("int32")
+    self._presynapticSlots = numpy.empty(numSynapses, dtype="int64")
+    self._presynapticSlots[self._presynapticSynapses] = numpy.arange(
+      numSynapses)
+    self._presynapticEnd = numSynapses
+
+    return newFlatIdxs
+
+
+  def getMemoryUsage(self):
+    """
+    Returns the memory used by the segment, synapse and presynaptic index
+    arrays, including their spare capacity, plus an estimate for the segment
+    objects.
+
+    :returns: (dict) Bytes for ``segments``, ``synapses``,
+              ``presynapticIndex`` and their ``total``.
+    """
+    numSegments = self._nextFlatIdx - len(self._freeFlatIdxs)
+    numCells = len(self._cells)
+
+    return withTotal({
+      "segments": (numCells * (_CELL_BYTES + POINTER_BYTES) +
+                   numSegments * (_ARRAY_SEGMENT_BYTES + POINTER_BYTES) +
+                   listBytes(self._segmentForFlatIdx) +
+                   listBytes(self._freeFlatIdxs, INT_BYTES) +
+                   arrayBytes(self._segmentCells, self._segmentOrdinals)),
+      "synapses": (self._numSynapses * array("i").itemsize +
+                   listBytes(self._freeSynapseIdxs, INT_BYTES) +
+                   arrayBytes(self._synapseSegments, self._presynapticCells,
+                              self._permanences, self._synapseOrdinals)),
+      "presynapticIndex": arrayBytes(self._presynapticStarts,
+                                     self._presynapticCounts,
+                                     self._presynapticCapacities,
+                                     self._presynapticSynapses,
+                                     self._presynapticSlots),
+    })
+
+
+  @classmethod
+  def read(cls, proto):
+    """
+    Reads deserialized data from proto object
+
+    :param proto: (DynamicStructBuilder) Proto object
+
+    :returns: (:class:`ArrayConnections`) instance
+    """
+    protoCells = proto.cells
+    connections = cls(len(protoCells))
+
+    for cellIdx, protoCell in enumerate(protoCells):
+      for protoSegment in protoCell.segments:
+        segment = connections.createSegment(cellIdx)
+        for protoSynapse in protoSegment.synapses:
+          connections.createSynapse(segment, protoSynapse.presynapticCell,
+                                    protoSynapse.permanence)
+
+    return connections
+
+
+  def write(self, proto):
+    """
+    Writes serialized data to proto object.
+
+    :param proto: (DynamicStructBuilder) Proto object
+    """
+    protoCells = proto.init('cells', self.numCells)
+
+    for i in xrange(self.numCells):
+      segments = self._cells[i]._segments
+      protoSegments = protoCells[i].init('segments', len(segments))
+
+      for j, segment in enumerate(segments):
+        # Synapse indices are kept in creation order.
+        idxs = self.synapseIndicesForSegment(segment)
+        protoSynapses = protoSegments[j].init('synapses', len(idxs))
+
+        for k, idx in enumerate(idxs):
+          protoSynapses[k].presynapticCell = int(self._presynapticCells[idx])
+          protoSynapses[k].permanence = float(self._permanences[idx])
+
+
+  def __eq__(self, other):
+    """ Equality operator for ArrayConnections instances.
+    Checks if two instances are functionally identical
+
+    :param other: (:class:`ArrayConnections`) instance to compare to
+    """
+    #pylint: disable=W0212
+    if self.numCells != other.numCells:
+      return False
+
+    if self._numSynapses != other._numSynapses:
+      return False
+
+    for i in xrange(self.numCells):
+      if self._cells[i]._segments != other._cells[i]._segments:
+        return False
+
+    #pylint: enable=W0212
+    return True
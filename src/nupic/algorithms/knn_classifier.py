@@ -21,10 +21,16 @@
 
 """This module implements a k nearest neighbor classifier."""
 
+from bisect import insort
+from collections import OrderedDict
+from itertools import chain, compress
+import multiprocessing
+
 import numpy
 
 from nupic.bindings.math import (NearestNeighbor, min_score_per_category)
 
+from nupic.algorithms.minhash_lsh import MinHashLSH
 from nupic.serializable import Serializable
 
 try:
@@ -40,6 +46,14 @@ if capnp:
 g_debugPrefix = "KNN"
 KNNCLASSIFIER_VERSION = 1
 
+# Largest number of values gathered at once by _overlapsWithRows
+_MAX_GATHERED_VALUES = 2 ** 24
+
+# Input patterns and stored patterns shared with the worker processes of
+# KNNClassifier.inferBatch. They are set before the workers are forked, so
+# the workers inherit them instead of receiving a pickled copy.
+_sharedBatch = None
+
 
 
 def _labeledInput(activeInputs, cellsPerCol=32):
@@ -71,6 +85,50 @@ def _labeledInput(activeInputs, cellsPerCol=32):
 
 
 
+def _overlapsWithRows(patterns, indptr, indices):
+  """
+  For each pattern and each row of a sparse matrix, sums the pattern at the
+  non-zero columns of the row. This is the product of the patterns with the
+  transpose of the binarized matrix.
+
+  :param patterns: (array) One dense pattern per row
+  :param indptr: (array) Start of each row in indices, plus the end of the
+         last row, as in a CSR matrix
+  :param indices: (array) Non-zero columns of all rows, as in a CSR matrix
+  :returns: (array) One row per pattern, one column per matrix row
+  """
+  overlaps = numpy.zeros((len(patterns), len(indptr) - 1))
+  nonEmpty = numpy.flatnonzero(indptr[1:] > indptr[:-1])
+  if len(nonEmpty) == 0:
+    return overlaps
+
+  # Empty rows have no columns to sum, so the sums of the non-empty ones can
+  # be taken in one pass. Only a bounded number of patterns are gathered at
+  # once.
+  step = max(1, _MAX_GATHERED_VALUES // len(indices))
+  for start in xrange(0, len(patterns), step):
+    stop = start + step
+    overlaps[start:stop, nonEmpty] = numpy.add.reduceat(
+      patterns[start:stop][:, indices], indptr[nonEmpty], axis=1)
+
+  return overlaps
+
+
+
+def _shardOverlaps(rows):
+  """
+  Worker of KNNClassifier.inferBatch.
+
+  :param rows: (tuple) First and last + 1 stored patterns of the shard
+  :returns: (array) Overlaps of the shared input patterns with the shard
+  """
+  start, stop = rows
+  patterns, indptr, indices = _sharedBatch
+  return _overlapsWithRows(patterns, indptr[start:stop + 1] - indptr[start],
+                           indices[indptr[start]:indptr[stop]])
+
+
+
 class KNNClassifier(Serializable):
   """
   This class implements NuPIC's k Nearest Neighbor Classifier. KNN is very
@@ -169,6 +227,60 @@ class KNNClassifier(Serializable):
       implies all vectors will be stored. A value of 0.1 implies only vectors
       with at least 10% sparsity will be stored
 
+  :param useInvertedIndex: (bool) If True and useSparseMemory is set, keep an
+      index from each input bit to the stored patterns that contain it. The
+      overlap distance methods then only visit the patterns that share a bit
+      with the input, instead of every stored pattern. The index roughly
+      doubles the memory used to store the patterns
+
+  :param numLSHBands: (int) If > 0 and useSparseMemory is set, inference is
+      approximate: only the stored patterns that share at least one band of
+      MinHash values with the input are candidates, and all other patterns
+      get a distance of infinity. The candidates' distances are exact. More
+      bands find more of the true nearest neighbors, at the cost of more
+      candidates. Only supported by the overlap distance methods. See
+      :class:`~nupic.algorithms.minhash_lsh.MinHashLSH`
+
+  :param numLSHRowsPerBand: (int) Number of MinHash values in each band.
+      More rows per band give fewer, more similar candidates
+
+  :param maxDeletedFraction: (float) Removed patterns are only marked as
+      deleted in memory, and are excluded from all results. Once more than
+      this fraction of the rows in memory are deleted, the memory is
+      compacted in one pass. A value of 0.0 compacts on every removal, which
+      makes every removal take time linear in the number of stored patterns
+
+  :param svdBatchSize: (int) If > 0, the SVD is learned incrementally instead
+      of all at once: the components and the mean are updated with every
+      svdBatchSize learned inputs, keeping the numSVDDims components with the
+      largest singular values. The memory this takes is bounded by
+      svdBatchSize and numSVDDims rather than by the number of stored
+      patterns, and numSVDSamples is ignored. Needs an integer numSVDDims of
+      at most svdBatchSize. Inference before the first numSVDDims inputs are
+      learned uses the unprojected patterns
+
+  :param lazySVDReprojection: (bool) With an incremental SVD, the stored
+      patterns are re-projected onto the components after each update. If
+      True, this is deferred until the stored patterns are next read, e.g. by
+      inference, so that several updates cost one re-projection. Patterns
+      learned in the meantime are projected onto the components the stored
+      patterns use
+
+  :param evictionPolicy: (string) How a fixed capacity KNN (see
+      maxStoredPatterns) makes room for a new pattern. None removes the
+      pattern with the oldest rowID. The other policies store the new pattern
+      in the place of an evicted one, in constant time, and also work with
+      dense memory:
+
+      - "lru": evicts the pattern that was least recently the nearest
+        neighbor of an input, during learning or inference
+      - "reservoir": keeps a uniform random sample of all the patterns
+        offered for storage. A new pattern either replaces a random stored
+        pattern or is dropped
+      - "quota": evicts the least recently matched pattern of the category
+        with the most stored patterns, so that every category keeps a fair
+        share of the capacity
+
   """
 
   def __init__(self, k=1,
@@ -189,7 +301,14 @@ class KNNClassifier(Serializable):
                      maxStoredPatterns=-1,
                      replaceDuplicates=False,
                      cellsPerCol=0,
-                     minSparsity=0.0):
+                     minSparsity=0.0,
+                     useInvertedIndex=False,
+                     numLSHBands=0,
+                     numLSHRowsPerBand=4,
+                     maxDeletedFraction=0.25,
+                     svdBatchSize=0,
+                     lazySVDReprojection=False,
+                     evictionPolicy=None):
 
     self.version = KNNCLASSIFIER_VERSION
 
@@ -213,11 +332,24 @@ class KNNClassifier(Serializable):
       self._adaptiveSVDDims = True
     else:
       self._adaptiveSVDDims = False
+    assert svdBatchSize <= 0 or (isinstance(numSVDDims, int) and
+                                 0 < numSVDDims <= svdBatchSize), (
+      "Incremental SVD needs an integer numSVDDims of at most svdBatchSize")
+    self.svdBatchSize = svdBatchSize
+    self.lazySVDReprojection = lazySVDReprojection
     self.verbosity = verbosity
     self.replaceDuplicates = replaceDuplicates
     self.cellsPerCol = cellsPerCol
     self.maxStoredPatterns = maxStoredPatterns
     self.minSparsity = minSparsity
+    self.useInvertedIndex = useInvertedIndex
+    assert numLSHBands <= 0 or distanceMethod != "norm", (
+      "Approximate inference is only supported by overlap distance methods")
+    self.numLSHBands = numLSHBands
+    self.numLSHRowsPerBand = numLSHRowsPerBand
+    self.maxDeletedFraction = maxDeletedFraction
+    assert evictionPolicy in (None, "lru", "reservoir", "quota")
+    self.evictionPolicy = evictionPolicy
     self.clear()
 
 
@@ -226,41 +358,135 @@ class KNNClassifier(Serializable):
     self._Memory = None
     self._numPatterns = 0
     self._M = None
-    self._categoryList = []
-    self._partitionIdList = []
+
+    # Sorted rows of the memory that hold removed patterns. Pattern indices
+    # skip these rows.
+    self._deletedRows = numpy.zeros(0, dtype=int)
+
+    # Category and partition id of each row of the memory in use. The rows of
+    # removed patterns keep their entries until the memory is compacted. See
+    # _categoryList and _partitionIdList for the values of each pattern.
+    self._rowCategories = []
+    self._rowPartitionIds = []
+
+    # Pattern indices of each partition id. None after patterns are removed,
+    # until it is next needed.
     self._partitionIdMap = {}
     self._finishedLearning = False
     self._iterationIdx = -1
 
     # Fixed capacity KNN
     if self.maxStoredPatterns > 0:
-      assert self.useSparseMemory, ("Fixed capacity KNN is implemented only "
-                                    "in the sparse memory mode")
+      assert self.useSparseMemory or self.evictionPolicy is not None, (
+        "Fixed capacity KNN is implemented only in the sparse memory mode, "
+        "unless an evictionPolicy is given")
       self.fixedCapacity = True
-      self._categoryRecencyList = []
+      self._rowRecencies = []
     else:
       self.fixedCapacity = False
 
+    # Used by the eviction policies. For each group of patterns that evict
+    # each other, the rows of the patterns from least to most recently
+    # matched, and the group of each row.
+    self._evictionOrder = {}
+    self._evictionGroups = {}
+    self._numOfferedPatterns = 0
+    self._evictionRandom = numpy.random.RandomState(42)
+
     # Cached value of the store prototype sizes
     self._protoSizes = None
 
+    # Cached (indptr, indices) of the stored patterns, used by inferBatch
+    self._protoCSR = None
+
+    # Maps each input bit to the sorted rows of the stored patterns that
+    # contain it. Only used with sparse memory.
+    if self.useInvertedIndex and self.useSparseMemory:
+      self._invertedIndex = {}
+    else:
+      self._invertedIndex = None
+
+    # Candidate search of the approximate inference mode
+    if self.numLSHBands > 0 and self.useSparseMemory:
+      self._lsh = MinHashLSH(self.numLSHBands, self.numLSHRowsPerBand)
+    else:
+      self._lsh = None
+
     # Used by PCA
     self._s = None
     self._vt = None
     self._nc = None
     self._mean = None
 
+    # Used by incremental PCA: the inputs of the current batch, the number of
+    # inputs the components were learned from, and the components and mean
+    # the stored patterns are projected onto, if not the current ones.
+    self._svdBatch = []
+    self._svdSamplesSeen = 0
+    self._memoryVt = None
+    self._memoryMean = None
+
     # Used by Network Builder
     self._specificIndexTraining = False
     self._nextTrainingIndices = None
 
 
+  @property
+  def _categoryList(self):
+    """
+    Category of each pattern, by pattern index. This is the stored list, which
+    may be modified in place, unless some rows are deleted.
+    """
+    return self._aliveValues(self._rowCategories)
+
+
+  @_categoryList.setter
+  def _categoryList(self, categoryList):
+    self.compactMemory()
+    self._rowCategories = list(categoryList)
+
+
+  @property
+  def _categoryRecencyList(self):
+    """
+    RowID of each pattern, by pattern index, with a fixed capacity. This is
+    the stored list, which may be modified in place, unless some rows are
+    deleted.
+    """
+    return self._aliveValues(self._rowRecencies)
+
+
+  @_categoryRecencyList.setter
+  def _categoryRecencyList(self, categoryRecencyList):
+    self.compactMemory()
+    self._rowRecencies = list(categoryRecencyList)
+
+
+  @property
+  def _partitionIdList(self):
+    """
+    Partition id of each pattern, by pattern index, or numpy.inf if it has
+    none. This is the stored list unless some rows are deleted.
+    """
+    return self._aliveValues(self._rowPartitionIds)
+
+
+  @_partitionIdList.setter
+  def _partitionIdList(self, partitionIdList):
+    self.compactMemory()
+    self._rowPartitionIds = list(partitionIdList)
+    self._partitionIdMap = None
+
+
   def _doubleMemoryNumRows(self):
 
     m = 2 * self._Memory.shape[0]
+    if self.fixedCapacity:
+      # Patterns beyond the capacity are not stored
+      m = max(min(m, self.maxStoredPatterns), self._Memory.shape[0] + 1)
     n = self._Memory.shape[1]
     self._Memory = numpy.resize(self._Memory,(m,n))
-    self._M = self._Memory[:self._numPatterns]
+    self._M = self._Memory[:self._numStoredRows()]
 
 
   def _sparsifyVector(self, inputPattern, doWinners=False):
@@ -269,8 +495,10 @@ class KNNClassifier(Serializable):
     if not self.relativeThreshold:
       inputPattern = inputPattern*(abs(inputPattern) > self.sparseThreshold)
     elif self.sparseThreshold > 0:
+      # The maximum of each pattern, if given a matrix of patterns
+      maxValue = abs(inputPattern).max(axis=-1, keepdims=True)
       inputPattern = inputPattern * \
-        (abs(inputPattern) > (self.sparseThreshold * abs(inputPattern).max()))
+        (abs(inputPattern) > (self.sparseThreshold * maxValue))
 
     # Do winner-take-all
     if doWinners:
@@ -297,26 +525,35 @@ class KNNClassifier(Serializable):
       - :meth:`~.KNNClassifier.KNNClassifier.closestTrainingPattern`
       - :meth:`~.KNNClassifier.KNNClassifier.closestOtherTrainingPattern`
     """
-    if idToCategorize not in self._categoryRecencyList:
+    categoryRecencyList = self._categoryRecencyList
+    if idToCategorize not in categoryRecencyList:
       return
 
-    recordIndex = self._categoryRecencyList.index(idToCategorize)
-    self._categoryList[recordIndex] = newCategory
+    recordIndex = categoryRecencyList.index(idToCategorize)
+    self._rowCategories[self._storedRow(recordIndex)] = newCategory
+    self._rebuildEvictionOrder()
 
 
   def removeIds(self, idsToRemove):
     """
-    There are two caveats. First, this is a potentially slow operation. Second,
-    pattern indices will shift if patterns before them are removed.
+    There are two caveats. First, this takes time linear in the number of
+    stored patterns. Second, pattern indices will shift if patterns before
+    them are removed.
 
     :param idsToRemove: A list of row indices to remove.
     """
-    # Form a list of all categories to remove
-    rowsToRemove = [k for k, rowID in enumerate(self._categoryRecencyList) \
-                    if rowID in idsToRemove]
+    if not self._rowRecencies:
+      return
 
-    # Remove rows from the classifier
-    self._removeRows(rowsToRemove)
+    # Find the rows of the patterns to remove, skipping deleted rows
+    matches = numpy.in1d(numpy.asarray(self._rowRecencies, dtype=int),
+                         numpy.fromiter(set(idsToRemove), dtype=int))
+    matches[self._deletedRows] = False
+    storedRows = numpy.flatnonzero(matches)
+
+    # Remove rows from the classifier, by pattern index
+    self._removeRows(
+      storedRows - numpy.searchsorted(self._deletedRows, storedRows))
 
 
   def removeCategory(self, categoryToRemove):
@@ -346,51 +583,151 @@ class KNNClassifier(Serializable):
 
   def _removeRows(self, rowsToRemove):
     """
-    A list of row indices to remove. There are two caveats. First, this is
-    a potentially slow operation. Second, pattern indices will shift if
+    A list of pattern indices to remove. Pattern indices will shift if
     patterns before them are removed.
-    """
-    # Form a numpy array of row indices to be removed
-    removalArray = numpy.array(rowsToRemove)
-
-    # Remove categories
-    self._categoryList = numpy.delete(numpy.array(self._categoryList),
-                                      removalArray).tolist()
-
-    if self.fixedCapacity:
-      self._categoryRecencyList = numpy.delete(
-        numpy.array(self._categoryRecencyList), removalArray).tolist()
-
-    # Remove the partition ID, if any for these rows and rebuild the id map.
-    for row in reversed(rowsToRemove):  # Go backwards
-      # Remove these patterns from partitionList
-      self._partitionIdList.pop(row)
-    self._rebuildPartitionIdMap(self._partitionIdList)
 
+    The patterns are only marked as deleted in memory, and their categories
+    and partition ids stay in the per-row lists, see :meth:`compactMemory`.
+    This takes time logarithmic in the number of stored patterns for each
+    removed pattern, and linear in the number of deleted rows.
+    """
+    storedRows = self._storedRow(numpy.asarray(rowsToRemove, dtype=int))
+    self._removeFromEvictionOrder(storedRows)
+    self._markRowsDeleted(storedRows)
 
-    # Remove actual patterns
-    if self.useSparseMemory:
-      # Delete backwards
-      for rowIndex in rowsToRemove[::-1]:
-        self._Memory.deleteRow(rowIndex)
-    else:
-      self._M = numpy.delete(self._M, removalArray, 0)
+    # Pattern indices after the removed patterns shift
+    self._partitionIdMap = None
 
     numRemoved = len(rowsToRemove)
+    self._numPatterns -= numRemoved
+    self._compactMemoryIfNeeded()
 
     # Sanity checks
-    numRowsExpected = self._numPatterns - numRemoved
+    numRowsExpected = self._numPatterns + len(self._deletedRows)
     if self.useSparseMemory:
       if self._Memory is not None:
         assert self._Memory.nRows() == numRowsExpected
     else:
       assert self._M.shape[0] == numRowsExpected
-    assert len(self._categoryList) == numRowsExpected
+    assert len(self._rowCategories) == numRowsExpected
 
-    self._numPatterns -= numRemoved
     return numRemoved
 
 
+  def compactMemory(self):
+    """
+    Removes the rows of the patterns marked as deleted from memory, in one
+    pass. Pattern indices do not change, since they already skip deleted
+    patterns.
+    """
+    if len(self._deletedRows) == 0:
+      return
+
+    alive = self._aliveMask()
+    if self.useSparseMemory:
+      deletedRows = self._deletedRows.tolist()
+      self._removeRowsFromIndexes(deletedRows)
+      self._Memory.deleteRows(deletedRows)
+    else:
+      self._Memory[:self._numPatterns] = self._M[alive]
+      self._M = self._Memory[:self._numPatterns]
+
+    self._rowCategories = list(compress(self._rowCategories, alive))
+    self._rowPartitionIds = list(compress(self._rowPartitionIds, alive))
+    if self.fixedCapacity:
+      self._rowRecencies = list(compress(self._rowRecencies, alive))
+    self._rebuildEvictionOrder(numpy.cumsum(alive) - 1)
+
+    self._deletedRows = numpy.zeros(0, dtype=int)
+    self._protoSizes = None
+    self._protoCSR = None
+
+
+  def _compactMemoryIfNeeded(self):
+    """
+    Compacts the memory if more than maxDeletedFraction of its rows are
+    deleted.
+    """
+    if len(self._deletedRows) > (self.maxDeletedFraction *
+                                 self._numStoredRows()):
+      self.compactMemory()
+
+
+  def _markRowsDeleted(self, storedRows):
+    """
+    Marks rows of the memory as deleted. Must be called before the patterns
+    in them are subtracted from _numPatterns.
+
+    :param storedRows: (array) Rows of the memory of the patterns to remove
+    """
+    self._deletedRows = numpy.union1d(self._deletedRows,
+                                      storedRows).astype(int)
+
+
+  def _numStoredRows(self):
+    """
+    :returns: (int) Number of rows of the memory in use, including the rows
+              of deleted patterns.
+    """
+    return self._numPatterns + len(self._deletedRows)
+
+
+  def _aliveMask(self):
+    """
+    :returns: (array) For each row of the memory in use, whether it holds a
+              pattern that is not deleted.
+    """
+    alive = numpy.ones(self._numStoredRows(), dtype=bool)
+    alive[self._deletedRows] = False
+    return alive
+
+
+  def _aliveValues(self, rowValues):
+    """
+    :param rowValues: (list) One value per row of the memory in use
+    :returns: (list) One value per pattern. This is rowValues itself if no
+              rows are deleted.
+    """
+    if len(self._deletedRows) == 0:
+      return rowValues
+    return list(compress(rowValues, self._aliveMask()))
+
+
+  def _storedRow(self, idx):
+    """
+    :param idx: (int or array) Pattern index, or array of pattern indices
+    :returns: (int or array) Row of the memory that holds each pattern.
+    """
+    if len(self._deletedRows) == 0:
+      return idx
+
+    # The number of patterns stored before each deleted row. A pattern comes
+    # after the deleted rows with at most idx patterns before them.
+    numBefore = self._deletedRows - numpy.arange(len(self._deletedRows))
+    rows = idx + numpy.searchsorted(numBefore, idx, side="right")
+    if numpy.isscalar(idx):
+      return int(rows)
+    return rows
+
+
+  def _patternIndex(self, row):
+    """
+    :param row: (int) Row of the memory that holds a pattern
+    :returns: (int) Index of the pattern.
+    """
+    return int(row - numpy.searchsorted(self._deletedRows, row))
+
+
+  def _skipDeletedRows(self, values):
+    """
+    :param values: (array) One value per row of the memory in use
+    :returns: (array) One value per pattern, without the deleted rows.
+    """
+    if len(self._deletedRows) == 0:
+      return values
+    return numpy.delete(values, self._deletedRows)
+
+
   def doIteration(self):
     """
     Utility method to increment the iteration index. Intended for models that
@@ -470,33 +807,61 @@ class KNNClassifier(Serializable):
       if self._Memory is None:
         # Initialize memory with 100 rows and numPatterns = 0
         inputWidth = len(inputPattern)
-        self._Memory = numpy.zeros((100,inputWidth))
+        numRows = 100
+        if self.fixedCapacity:
+          numRows = min(numRows, self.maxStoredPatterns)
+        self._Memory = numpy.zeros((numRows,inputWidth))
         self._numPatterns = 0
         self._M = self._Memory[:self._numPatterns]
 
       addRow = True
 
+      if self.svdBatchSize > 0:
+        self._svdBatch.append(inputPattern)
+
       if self._vt is not None:
-        # Compute projection
-        inputPattern = numpy.dot(self._vt, inputPattern - self._mean)
+        # Compute projection, onto the components the stored patterns use
+        if self._memoryVt is not None:
+          inputPattern = numpy.dot(self._memoryVt,
+                                   inputPattern - self._memoryMean)
+        else:
+          inputPattern = numpy.dot(self._vt, inputPattern - self._mean)
 
       if self.distThreshold > 0:
         # Check if input is too close to an existing input to be accepted
         dist = self._calcDistance(inputPattern)
         minDist = dist.min()
         addRow = (minDist >= self.distThreshold)
+        if not addRow:
+          self._touchPattern(dist.argmin())
+
+      if addRow and self.fixedCapacity and self.evictionPolicy is not None:
+        self._numOfferedPatterns += 1
+        if self._numPatterns >= self.maxStoredPatterns:
+          self._replaceEvictedPattern(inputPattern, 0, inputCategory,
+                                      partitionId, rowID)
+          addRow = False
 
       if addRow:
         self._protoSizes = None     # need to re-compute
-        if self._numPatterns == self._Memory.shape[0]:
+        self._protoCSR = None
+        if self._specificIndexTraining:
+          # Vector slots are pattern indices, so there must not be any
+          # deleted rows in between
+          self.compactMemory()
+
+        if self._numStoredRows() == self._Memory.shape[0]:
           # Double the size of the memory
           self._doubleMemoryNumRows()
 
         if not self._specificIndexTraining:
           # Normal learning - append the new input vector
-          self._Memory[self._numPatterns] = inputPattern
+          self._Memory[self._numStoredRows()] = inputPattern
           self._numPatterns += 1
-          self._categoryList.append(int(inputCategory))
+          self._rowCategories.append(int(inputCategory))
+          if self.fixedCapacity:
+            self._rowRecencies.append(rowID)
+            self._touchPattern(self._numPatterns - 1)
         else:
           # Specific index training mode - insert vector in specified slot
           vectorIndex = self._nextTrainingIndices.pop(0)
@@ -504,13 +869,13 @@ class KNNClassifier(Serializable):
             self._doubleMemoryNumRows()
           self._Memory[vectorIndex] = inputPattern
           self._numPatterns = max(self._numPatterns, vectorIndex + 1)
-          if vectorIndex >= len(self._categoryList):
-            self._categoryList += [-1] * (vectorIndex -
-                                          len(self._categoryList) + 1)
-          self._categoryList[vectorIndex] = int(inputCategory)
+          if vectorIndex >= len(self._rowCategories):
+            self._rowCategories += [-1] * (vectorIndex -
+                                           len(self._rowCategories) + 1)
+          self._rowCategories[vectorIndex] = int(inputCategory)
 
         # Set _M to the "active" part of _Memory
-        self._M = self._Memory[0:self._numPatterns]
+        self._M = self._Memory[0:self._numStoredRows()]
 
         self._addPartitionId(self._numPatterns-1, partitionId)
 
@@ -536,6 +901,9 @@ class KNNClassifier(Serializable):
       if self._Memory is None:
         self._Memory = NearestNeighbor(0, inputWidth)
 
+      if self.svdBatchSize > 0:
+        self._svdBatch.append(inputPattern)
+
       # Support SVD if it is on
       if self._vt is not None:
         inputPattern = numpy.dot(self._vt, inputPattern - self._mean)
@@ -557,7 +925,7 @@ class KNNClassifier(Serializable):
 
 
       # Don't learn entries that are too close to existing entries.
-      if self._Memory.nRows() > 0:
+      if self._numPatterns > 0:
         dist = None
         # if this vector is a perfect match for one we already learned, then
         #  replace the category - it may have changed with online learning on.
@@ -565,9 +933,11 @@ class KNNClassifier(Serializable):
           dist = self._calcDistance(thresholdedInput, distanceNorm=1)
           if dist.min() == 0:
             rowIdx = dist.argmin()
-            self._categoryList[rowIdx] = int(inputCategory)
+            storedRow = self._storedRow(rowIdx)
+            self._rowCategories[storedRow] = int(inputCategory)
             if self.fixedCapacity:
-              self._categoryRecencyList[rowIdx] = rowID
+              self._rowRecencies[storedRow] = rowID
+              self._touchPattern(rowIdx)
             addRow = False
 
         # Don't add this vector if it matches closely with another we already
@@ -580,7 +950,8 @@ class KNNClassifier(Serializable):
           if not addRow:
             if self.fixedCapacity:
               rowIdx = dist.argmin()
-              self._categoryRecencyList[rowIdx] = rowID
+              self._rowRecencies[self._storedRow(rowIdx)] = rowID
+              self._touchPattern(rowIdx)
 
 
       # If sparsity is too low, we do not want to add this vector
@@ -593,29 +964,43 @@ class KNNClassifier(Serializable):
         if sparsity < self.minSparsity:
           addRow = False
 
+      if addRow and self.fixedCapacity and self.evictionPolicy is not None:
+        self._numOfferedPatterns += 1
+        if self._numPatterns >= self.maxStoredPatterns:
+          if isSparse == 0:
+            self._replaceEvictedPattern(thresholdedInput, 0, inputCategory,
+                                        partitionId, rowID)
+          else:
+            self._replaceEvictedPattern(inputPattern, isSparse, inputCategory,
+                                        partitionId, rowID)
+          addRow = False
+
       # Add the new sparse vector to our storage
       if addRow:
         self._protoSizes = None     # need to re-compute
+        self._protoCSR = None
         if isSparse == 0:
           self._Memory.addRow(thresholdedInput)
         else:
           self._Memory.addRowNZ(inputPattern, [1]*len(inputPattern))
         self._numPatterns += 1
-        self._categoryList.append(int(inputCategory))
+        self._rowCategories.append(int(inputCategory))
         self._addPartitionId(self._numPatterns-1, partitionId)
+        self._addRowToIndexes(self._Memory.nRows()-1)
         if self.fixedCapacity:
-          self._categoryRecencyList.append(rowID)
+          self._rowRecencies.append(rowID)
+          self._touchPattern(self._numPatterns - 1)
           if self._numPatterns > self.maxStoredPatterns and \
             self.maxStoredPatterns > 0:
             leastRecentlyUsedPattern = numpy.argmin(self._categoryRecencyList)
-            self._Memory.deleteRow(leastRecentlyUsedPattern)
-            self._categoryList.pop(leastRecentlyUsedPattern)
-            self._categoryRecencyList.pop(leastRecentlyUsedPattern)
-            self._numPatterns -= 1
+            self._removeRows([leastRecentlyUsedPattern])
 
 
 
-    if self.numSVDDims is not None and self.numSVDSamples is not None \
+    if self.svdBatchSize > 0:
+      if len(self._svdBatch) >= self.svdBatchSize:
+        self._updateSVD()
+    elif self.numSVDDims is not None and self.numSVDSamples is not None \
           and self._numPatterns == self.numSVDSamples:
         self.computeSVD()
 
@@ -640,7 +1025,7 @@ class KNNClassifier(Serializable):
     """
     assert self.useSparseMemory, "Not implemented yet for dense storage"
 
-    overlaps = self._Memory.rightVecSumAtNZ(inputPattern)
+    overlaps = self._skipDeletedRows(self._calcOverlaps(inputPattern))
     return (overlaps, self._categoryList)
 
 
@@ -698,48 +1083,14 @@ class KNNClassifier(Serializable):
                         that category. All distances are between 0 and 1.0.
     """
 
-    # Calculate sparsity. If sparsity is too low, we do not want to run
-    # inference with this vector
-    sparsity = 0.0
-    if self.minSparsity > 0.0:
-      sparsity = ( float(len(inputPattern.nonzero()[0])) /
-                   len(inputPattern) )
-
-    if len(self._categoryList) == 0 or sparsity < self.minSparsity:
+    if self._canInfer(inputPattern):
+      dist = self._getDistances(inputPattern, partitionId=partitionId)
+      self._touchNearestPattern(dist)
+    else:
       # No categories learned yet; i.e. first inference w/ online learning or
       # insufficient sparsity
-      winner = None
-      inferenceResult = numpy.zeros(1)
-      dist = numpy.ones(1)
-      categoryDist = numpy.ones(1)
-
-    else:
-      maxCategoryIdx = max(self._categoryList)
-      inferenceResult = numpy.zeros(maxCategoryIdx+1)
-      dist = self._getDistances(inputPattern, partitionId=partitionId)
-      validVectorCount = len(self._categoryList) - self._categoryList.count(-1)
-
-      # Loop through the indices of the nearest neighbors.
-      if self.exact:
-        # Is there an exact match in the distances?
-        exactMatches = numpy.where(dist<0.00001)[0]
-        if len(exactMatches) > 0:
-          for i in exactMatches[:min(self.k, validVectorCount)]:
-            inferenceResult[self._categoryList[i]] += 1.0
-      else:
-        sorted = dist.argsort()
-        for j in sorted[:min(self.k, validVectorCount)]:
-          inferenceResult[self._categoryList[j]] += 1.0
-
-      # Prepare inference results.
-      if inferenceResult.any():
-        winner = inferenceResult.argmax()
-        inferenceResult /= inferenceResult.sum()
-      else:
-        winner = None
-      categoryDist = min_score_per_category(maxCategoryIdx,
-                                            self._categoryList, dist)
-      categoryDist.clip(0, 1.0, categoryDist)
+      dist = None
+    winner, inferenceResult, dist, categoryDist = self._inferFromDistances(dist)
 
     if self.verbosity >= 1:
       print "%s infer:" % (g_debugPrefix)
@@ -754,25 +1105,193 @@ class KNNClassifier(Serializable):
     return result
 
 
+  def inferBatch(self, patterns, partitionIds=None, numProcesses=None):
+    """Like :meth:`infer`, for many input patterns.
+
+    With sparse memory and one of the overlap distance methods, the overlaps
+    of all input patterns with all stored patterns are computed in one sparse
+    matrix product. Otherwise, this calls :meth:`infer` for each pattern.
+
+    :param patterns: (array) One dense input pattern per row.
+
+    :param partitionIds: (list) Optional partitionId for each pattern. See
+        :meth:`infer`.
+
+    :param numProcesses: (int) If greater than 1, the stored patterns are
+        split across this many worker processes, which compute the overlaps
+        with their share of the stored patterns. The workers are forked, so
+        they read the input and stored patterns from memory shared with this
+        process.
+
+    :returns: (list) For each pattern, the same 4-tuple as :meth:`infer`.
+    """
+    if partitionIds is None:
+      partitionIds = [None] * len(patterns)
+
+    if not self._finishedLearning:
+      self.finishLearning()
+      self._finishedLearning = True
+
+    if (not self.useSparseMemory or self.distanceMethod == "norm" or
+        self._lsh is not None or self._vt is not None or
+        self.verbosity >= 1 or self._numPatterns == 0):
+      return [self.infer(pattern, partitionId=partitionId)
+              for pattern, partitionId in zip(patterns, partitionIds)]
+
+    patterns = numpy.asarray(patterns)
+    sparsePatterns = self._sparsifyVector(patterns)
+    overlaps = self._calcBatchOverlaps(sparsePatterns, numProcesses)
+
+    if self._protoSizes is None:
+      self._protoSizes = self._Memory.rowSums()
+    protoSizes = self._skipDeletedRows(self._protoSizes)
+
+    results = []
+    for i in xrange(len(patterns)):
+      if not self._canInfer(patterns[i]):
+        results.append(self._inferFromDistances(None))
+        continue
+
+      dist = self._calcOverlapDistance(
+        overlaps[i].astype(self._protoSizes.dtype), sparsePatterns[i].sum(),
+        protoSizes)
+      dist = self._invalidateDistances(dist, partitionIds[i])
+      self._touchNearestPattern(dist)
+      results.append(self._inferFromDistances(dist))
+
+    return results
+
+
+  def _calcBatchOverlaps(self, patterns, numProcesses=None):
+    """
+    :param patterns: (array) One sparsified dense input pattern per row
+    :param numProcesses: (int) See :meth:`inferBatch`
+    :returns: (array) The overlaps of each pattern with each stored pattern,
+              one row per pattern
+    """
+    indptr, indices = self._getProtoCSR()
+    numRows = len(indptr) - 1
+
+    if numProcesses is None or numProcesses <= 1 or numRows < numProcesses:
+      overlaps = _overlapsWithRows(patterns, indptr, indices)
+    else:
+      global _sharedBatch
+      bounds = numpy.linspace(0, numRows, numProcesses + 1).astype(int)
+      _sharedBatch = (patterns, indptr, indices)
+      try:
+        pool = multiprocessing.Pool(numProcesses)
+        try:
+          shards = pool.map(_shardOverlaps, zip(bounds[:-1], bounds[1:]))
+        finally:
+          pool.close()
+          pool.join()
+      finally:
+        _sharedBatch = None
+      overlaps = numpy.hstack(shards)
+
+    if len(self._deletedRows):
+      overlaps = numpy.delete(overlaps, self._deletedRows, axis=1)
+    return overlaps
+
+
+  def _getProtoCSR(self):
+    """
+    :returns: (tuple) The (indptr, indices) of the non-zeros of the sparse
+              memory, as in a CSR matrix.
+    """
+    if self._protoCSR is None:
+      numRows = self._Memory.nRows()
+      rows = [self._Memory.rowNonZeros(row)[0] for row in xrange(numRows)]
+      indptr = numpy.zeros(numRows + 1, dtype="int64")
+      numpy.cumsum([len(nz) for nz in rows], out=indptr[1:])
+      if rows:
+        indices = numpy.concatenate(rows).astype("int64")
+      else:
+        indices = numpy.zeros(0, dtype="int64")
+      self._protoCSR = (indptr, indices)
+
+    return self._protoCSR
+
+
+  def _canInfer(self, inputPattern):
+    """
+    :param inputPattern: (array) Dense input pattern
+    :returns: (bool) False if no categories are learned yet, or if the input
+              is not sparse enough.
+    """
+    # Calculate sparsity. If sparsity is too low, we do not want to run
+    # inference with this vector
+    sparsity = 0.0
+    if self.minSparsity > 0.0:
+      sparsity = ( float(len(inputPattern.nonzero()[0])) /
+                   len(inputPattern) )
+
+    return self._numPatterns > 0 and sparsity >= self.minSparsity
+
+
+  def _inferFromDistances(self, dist):
+    """
+    :param dist: (array) Distance to each stored pattern, or None if
+           inference can't be run.
+    :returns: The 4-tuple returned by :meth:`infer`.
+    """
+    if dist is None:
+      winner = None
+      inferenceResult = numpy.zeros(1)
+      dist = numpy.ones(1)
+      categoryDist = numpy.ones(1)
+      return winner, inferenceResult, dist, categoryDist
+
+    categoryList = self._categoryList
+    maxCategoryIdx = max(categoryList)
+    inferenceResult = numpy.zeros(maxCategoryIdx+1)
+    validVectorCount = len(categoryList) - categoryList.count(-1)
+
+    # Loop through the indices of the nearest neighbors.
+    if self.exact:
+      # Is there an exact match in the distances?
+      exactMatches = numpy.where(dist<0.00001)[0]
+      if len(exactMatches) > 0:
+        for i in exactMatches[:min(self.k, validVectorCount)]:
+          inferenceResult[categoryList[i]] += 1.0
+    else:
+      sorted = dist.argsort()
+      for j in sorted[:min(self.k, validVectorCount)]:
+        inferenceResult[categoryList[j]] += 1.0
+
+    # Prepare inference results.
+    if inferenceResult.any():
+      winner = inferenceResult.argmax()
+      inferenceResult /= inferenceResult.sum()
+    else:
+      winner = None
+    categoryDist = min_score_per_category(maxCategoryIdx,
+                                          categoryList, dist)
+    categoryDist.clip(0, 1.0, categoryDist)
+
+    return winner, inferenceResult, dist, categoryDist
+
+
   def getClosest(self, inputPattern, topKCategories=3):
     """Returns the index of the pattern that is closest to inputPattern,
     the distances of all patterns to inputPattern, and the indices of the k
     closest categories.
     """
-    inferenceResult = numpy.zeros(max(self._categoryList)+1)
+    categoryList = self._categoryList
+    inferenceResult = numpy.zeros(max(categoryList)+1)
     dist = self._getDistances(inputPattern)
 
     sorted = dist.argsort()
 
-    validVectorCount = len(self._categoryList) - self._categoryList.count(-1)
+    validVectorCount = len(categoryList) - categoryList.count(-1)
     for j in sorted[:min(self.k, validVectorCount)]:
-      inferenceResult[self._categoryList[j]] += 1.0
+      inferenceResult[categoryList[j]] += 1.0
 
     winner = inferenceResult.argmax()
 
     topNCats = []
     for i in range(topKCategories):
-      topNCats.append((self._categoryList[sorted[i]], dist[sorted[i]] ))
+      topNCats.append((categoryList[sorted[i]], dist[sorted[i]] ))
 
     return winner, dist, topNCats
 
@@ -791,15 +1310,16 @@ class KNNClassifier(Serializable):
     dist = self._getDistances(inputPattern)
     sorted = dist.argsort()
 
+    categoryList = self._categoryList
     for patIdx in sorted:
-      patternCat = self._categoryList[patIdx]
+      patternCat = categoryList[patIdx]
 
       # If closest pattern belongs to desired category, return it
       if patternCat == cat:
         if self.useSparseMemory:
-          closestPattern = self._Memory.getRow(int(patIdx))
+          closestPattern = self._Memory.getRow(int(self._storedRow(patIdx)))
         else:
-          closestPattern = self._M[patIdx]
+          closestPattern = self._M[self._storedRow(patIdx)]
 
         return closestPattern
 
@@ -821,15 +1341,16 @@ class KNNClassifier(Serializable):
     """
     dist = self._getDistances(inputPattern)
     sorted = dist.argsort()
+    categoryList = self._categoryList
     for patIdx in sorted:
-      patternCat = self._categoryList[patIdx]
+      patternCat = categoryList[patIdx]
 
       # If closest pattern does not belong to specified category, return it
       if patternCat != cat:
         if self.useSparseMemory:
-          closestPattern = self._Memory.getRow(int(patIdx))
+          closestPattern = self._Memory.getRow(int(self._storedRow(patIdx)))
         else:
-          closestPattern = self._M[patIdx]
+          closestPattern = self._M[self._storedRow(patIdx)]
 
         return closestPattern
 
@@ -853,6 +1374,8 @@ class KNNClassifier(Serializable):
     if cat is not None:
       assert idx is None
       idx = self._categoryList.index(cat)
+    idx = self._storedRow(idx)
+    self._reprojectMemory()
 
     if not self.useSparseMemory:
       pattern = self._Memory[idx]
@@ -880,7 +1403,7 @@ class KNNClassifier(Serializable):
     """
     if (i < 0) or (i >= self._numPatterns):
       raise RuntimeError("index out of bounds")
-    partitionId = self._partitionIdList[i]
+    partitionId = self._rowPartitionIds[self._storedRow(i)]
     if partitionId == numpy.inf:
       return None
     else:
@@ -898,14 +1421,14 @@ class KNNClassifier(Serializable):
     """
     :returns: the number of unique partition Ids stored.
     """
-    return len(self._partitionIdMap)
+    return len(self._getPartitionIdMap())
 
 
   def getPartitionIdKeys(self):
     """
     :returns: a list containing unique (non-None) partition Ids (just the keys)
     """
-    return self._partitionIdMap.keys()
+    return self._getPartitionIdMap().keys()
 
 
   def getPatternIndicesWithPartitionId(self, partitionId):
@@ -913,7 +1436,17 @@ class KNNClassifier(Serializable):
     :returns: a list of pattern indices corresponding to this partitionId.
         Return an empty list if there are none.
     """
-    return self._partitionIdMap.get(partitionId, [])
+    return self._getPartitionIdMap().get(partitionId, [])
+
+
+  def _getPartitionIdMap(self):
+    """
+    :returns: (dict) The pattern indices of each partition id, rebuilt first
+              if patterns were removed since it was last needed.
+    """
+    if self._partitionIdMap is None:
+      self._rebuildPartitionIdMap(self._partitionIdList)
+    return self._partitionIdMap
 
 
   def _addPartitionId(self, index, partitionId=None):
@@ -921,12 +1454,13 @@ class KNNClassifier(Serializable):
     Adds partition id for pattern index
     """
     if partitionId is None:
-      self._partitionIdList.append(numpy.inf)
+      self._rowPartitionIds.append(numpy.inf)
     else:
-      self._partitionIdList.append(partitionId)
-      indices = self._partitionIdMap.get(partitionId, [])
-      indices.append(index)
-      self._partitionIdMap[partitionId] = indices
+      self._rowPartitionIds.append(partitionId)
+      if self._partitionIdMap is not None:
+        indices = self._partitionIdMap.get(partitionId, [])
+        indices.append(index)
+        self._partitionIdMap[partitionId] = indices
 
 
   def _rebuildPartitionIdMap(self, partitionIdList):
@@ -940,6 +1474,347 @@ class KNNClassifier(Serializable):
       self._partitionIdMap[partitionId] = indices
 
 
+  def _setPartitionId(self, row, partitionId=None):
+    """
+    Changes the partition id of the pattern in a row of the memory
+    """
+    if self._partitionIdMap is not None:
+      index = self._patternIndex(row)
+      indices = self._partitionIdMap.get(self._rowPartitionIds[row])
+      if indices is not None and index in indices:
+        indices.remove(index)
+        if not indices:
+          del self._partitionIdMap[self._rowPartitionIds[row]]
+      if partitionId is not None:
+        self._partitionIdMap.setdefault(partitionId, []).append(index)
+
+    if partitionId is None:
+      self._rowPartitionIds[row] = numpy.inf
+    else:
+      self._rowPartitionIds[row] = partitionId
+
+
+  def _touchPattern(self, idx):
+    """
+    Makes a pattern the most recently matched one of its group, for the "lru"
+    and "quota" eviction policies. The patterns of a group evict each other:
+    all patterns with "lru", and the patterns of one category with "quota".
+
+    :param idx: (int) Pattern index
+    """
+    if not self.fixedCapacity or self.evictionPolicy not in ("lru", "quota"):
+      return
+    self._touchRow(int(self._storedRow(idx)))
+
+
+  def _touchRow(self, row):
+    """
+    Like :meth:`_touchPattern`, for the pattern in a row of the memory. The
+    eviction order refers to patterns by row, since rows only move when the
+    memory is compacted.
+
+    :param row: (int) Row of the memory
+    """
+    self._removeFromEvictionOrder([row])
+
+    if self.evictionPolicy == "quota":
+      group = self._rowCategories[row]
+    else:
+      group = None
+    self._evictionOrder.setdefault(group, OrderedDict())[row] = None
+    self._evictionGroups[row] = group
+
+
+  def _touchNearestPattern(self, dist):
+    """
+    Makes the nearest stored pattern the most recently matched one, for the
+    eviction policies.
+
+    :param dist: (array) Distance to each stored pattern
+    """
+    if len(dist) == 0:
+      return
+    nearest = dist.argmin()
+    if numpy.isfinite(dist[nearest]):
+      self._touchPattern(nearest)
+
+
+  def _removeFromEvictionOrder(self, rows):
+    """
+    :param rows: (list) Rows of the memory of patterns that no longer take
+           part in the eviction order
+    """
+    for row in rows:
+      row = int(row)
+      if row not in self._evictionGroups:
+        continue
+      group = self._evictionGroups.pop(row)
+      del self._evictionOrder[group][row]
+      if not self._evictionOrder[group]:
+        del self._evictionOrder[group]
+
+
+  def _rebuildEvictionOrder(self, newRows=None):
+    """
+    Rebuilds the eviction order after patterns change category or move to
+    other rows, keeping the order of the patterns.
+
+    :param newRows: (array) New row of each row of the memory, if they moved
+    """
+    if not self._evictionGroups:
+      return
+
+    evictionOrder = self._evictionOrder
+    self._evictionOrder = {}
+    self._evictionGroups = {}
+    for rows in evictionOrder.values():
+      for row in rows:
+        if newRows is not None:
+          row = int(newRows[row])
+        self._touchRow(row)
+
+
+  def _chooseEvictedRow(self):
+    """
+    :returns: (int) Row of the memory of the pattern to evict to make room for
+              a new pattern, or None if the new pattern is dropped instead.
+    """
+    if self.evictionPolicy == "reservoir":
+      # Keeps each of the offered patterns with the same probability
+      slot = self._evictionRandom.randint(self._numOfferedPatterns)
+      if slot < self._numPatterns:
+        return int(self._storedRow(slot))
+      return None
+
+    if self.evictionPolicy == "quota":
+      group = max(self._evictionOrder,
+                  key=lambda group: len(self._evictionOrder[group]))
+    else:
+      group = None
+    return next(iter(self._evictionOrder[group]))
+
+
+  def _replaceEvictedPattern(self, inputPattern, isSparse, inputCategory,
+                             partitionId, rowID):
+    """
+    Stores a new pattern in the place of the pattern the eviction policy
+    evicts, if any.
+
+    :param inputPattern: (array) The pattern, in the form stored in memory
+    :param isSparse: (int) If > 0, inputPattern holds the indices of the
+           non-zero bits
+    """
+    row = self._chooseEvictedRow()
+    if row is None:
+      return
+
+    if not self.useSparseMemory:
+      self._Memory[row] = inputPattern
+      self._protoSizes = None
+    else:
+      oldBits, _ = self._Memory.rowNonZeros(row)
+      if isSparse > 0:
+        self._Memory.setRowFromSparse(row, inputPattern,
+                                      [1]*len(inputPattern))
+        protoSize = len(inputPattern)
+      else:
+        self._Memory.setRowFromDense(row, inputPattern)
+        protoSize = inputPattern.sum()
+      if self._protoSizes is not None:
+        self._protoSizes[row] = protoSize
+      self._replaceRowInIndexes(row, oldBits)
+    self._protoCSR = None
+
+    self._rowCategories[row] = int(inputCategory)
+    self._rowRecencies[row] = rowID
+    self._setPartitionId(row, partitionId)
+    self._touchRow(row)
+
+
+  def _addRowToIndexes(self, row):
+    """
+    Adds the bits of a stored pattern to the inverted index and to the
+    approximate search, if they are used.
+
+    :param row: (int) Row of the pattern in the sparse memory
+    """
+    if self._invertedIndex is None and self._lsh is None:
+      return
+
+    nz, _ = self._Memory.rowNonZeros(row)
+    if self._invertedIndex is not None:
+      for bit in nz:
+        self._invertedIndex.setdefault(int(bit), []).append(row)
+    if self._lsh is not None:
+      self._lsh.add(nz)
+
+
+  def _replaceRowInIndexes(self, row, oldBits):
+    """
+    Updates the inverted index and the approximate search, if they are used,
+    after the pattern in a row was replaced.
+
+    :param row: (int) Row of the pattern in the sparse memory
+    :param oldBits: (list) Non-zero bits of the replaced pattern
+    """
+    if self._invertedIndex is None and self._lsh is None:
+      return
+
+    row = int(row)
+    bits, _ = self._Memory.rowNonZeros(row)
+    if self._invertedIndex is not None:
+      for bit in oldBits:
+        rows = self._invertedIndex[int(bit)]
+        rows.remove(row)
+        if not rows:
+          del self._invertedIndex[int(bit)]
+      for bit in bits:
+        insort(self._invertedIndex.setdefault(int(bit), []), row)
+    if self._lsh is not None:
+      self._lsh.replaceRow(row, oldBits, bits)
+
+
+  def _removeRowsFromIndexes(self, rowsToRemove):
+    """
+    Removes rows from the inverted index and the approximate search, and
+    shifts the rows after them, the same way the rows of the sparse memory
+    shift. Must be called before the rows are deleted from the memory.
+
+    :param rowsToRemove: (list) Rows of the patterns to remove
+    """
+    if self._lsh is not None:
+      self._lsh.removeRows(rowsToRemove)
+    if self._invertedIndex is None:
+      return
+
+    keep = numpy.ones(self._Memory.nRows(), dtype=bool)
+    keep[numpy.asarray(rowsToRemove, dtype=int)] = False
+    newRows = numpy.cumsum(keep) - 1
+    newRows[~keep] = -1
+
+    for bit, rows in self._invertedIndex.items():
+      rows = newRows[rows]
+      rows = rows[rows >= 0]
+      if len(rows):
+        self._invertedIndex[bit] = rows.tolist()
+      else:
+        del self._invertedIndex[bit]
+
+
+  def _rebuildIndexes(self):
+    """
+    Rebuilds the inverted index and the approximate search, if they are used,
+    from the sparse memory.
+    """
+    if self._invertedIndex is not None:
+      self._invertedIndex = {}
+    if self._lsh is not None:
+      self._lsh = MinHashLSH(self.numLSHBands, self.numLSHRowsPerBand)
+
+    if self._Memory is not None and (self._invertedIndex is not None or
+                                     self._lsh is not None):
+      for row in xrange(self._Memory.nRows()):
+        self._addRowToIndexes(row)
+
+
+  def _calcOverlaps(self, inputPattern):
+    """
+    For each stored pattern, sum the input at the non-zero bits of the pattern.
+    This is the overlap for binary inputs.
+
+    :param inputPattern: (array) Dense input pattern
+    :returns: (array) One overlap per stored pattern
+    """
+    if self._invertedIndex is None or self._Memory.nRows() == 0:
+      return self._Memory.rightVecSumAtNZ(inputPattern)
+
+    # Only the rows of the input's non-zero bits are visited. Every other
+    # stored pattern has an overlap of 0.
+    inputPattern = numpy.asarray(inputPattern)
+    bits = numpy.flatnonzero(inputPattern)
+    rowLists = [self._invertedIndex.get(bit, []) for bit in bits]
+    counts = [len(rows) for rows in rowLists]
+    rows = numpy.fromiter(chain.from_iterable(rowLists), dtype=int,
+                          count=sum(counts))
+    overlaps = numpy.bincount(rows,
+                              weights=numpy.repeat(inputPattern[bits], counts),
+                              minlength=self._Memory.nRows())
+
+    if self._protoSizes is None:
+      self._protoSizes = self._Memory.rowSums()
+    return overlaps.astype(self._protoSizes.dtype)
+
+
+  def _calcOverlapDistance(self, overlapsWithProtos, inputPatternSum,
+                           protoSizes):
+    """Convert overlaps with stored patterns to distances, using one of the
+    overlap distance methods.
+
+    :param overlapsWithProtos: (array) Overlap with each pattern. Modified.
+    :param inputPatternSum: (float) Sum of the input pattern
+    :param protoSizes: (array) Sum of each pattern
+    :returns: (array) Distance to each pattern
+    """
+    if self.distanceMethod == "rawOverlap":
+      dist = inputPatternSum - overlapsWithProtos
+    elif self.distanceMethod == "pctOverlapOfInput":
+      dist = inputPatternSum - overlapsWithProtos
+      if inputPatternSum > 0:
+        dist /= inputPatternSum
+    elif self.distanceMethod == "pctOverlapOfProto":
+      overlapsWithProtos /= protoSizes
+      dist = 1.0 - overlapsWithProtos
+    elif self.distanceMethod == "pctOverlapOfLarger":
+      maxVal = numpy.maximum(protoSizes, inputPatternSum)
+      if maxVal.all() > 0:
+        overlapsWithProtos /= maxVal
+      dist = 1.0 - overlapsWithProtos
+    else:
+      raise RuntimeError("Unimplemented distance method %s" %
+        self.distanceMethod)
+
+    return dist
+
+
+  def _calcApproximateDistance(self, inputPattern):
+    """Calculate the distances from inputPattern to the stored patterns that
+    share a band of MinHash values with it. All other patterns get a distance
+    of infinity. If no stored pattern shares a band with inputPattern, the
+    exact distances to all stored patterns are calculated instead.
+
+    :param inputPattern The pattern from which distances are calculated
+    """
+    candidates = self._lsh.query(numpy.flatnonzero(inputPattern))
+    if len(self._deletedRows) > 0:
+      candidates = numpy.setdiff1d(candidates, self._deletedRows)
+    if len(candidates) == 0:
+      return self._calcDistance(inputPattern)
+
+    if self._protoSizes is None:
+      self._protoSizes = self._Memory.rowSums()
+
+    # Only the candidate rows are read, since a cached CSR form of the whole
+    # memory would be rebuilt after every learned pattern. Their overlaps with
+    # the input are then summed in one pass.
+    candidateBits = [self._Memory.rowNonZeros(int(row))[0]
+                     for row in candidates]
+    lengths = numpy.array([len(bits) for bits in candidateBits], dtype="int64")
+    if lengths.sum() > 0:
+      columns = numpy.concatenate(candidateBits).astype("int64")
+    else:
+      columns = numpy.zeros(0, dtype="int64")
+    overlapsWithProtos = numpy.bincount(
+      numpy.repeat(numpy.arange(len(candidates)), lengths),
+      weights=inputPattern[columns],
+      minlength=len(candidates)).astype(self._protoSizes.dtype)
+
+    dist = numpy.empty(self._Memory.nRows())
+    dist.fill(numpy.inf)
+    dist[candidates] = self._calcOverlapDistance(
+      overlapsWithProtos, inputPattern.sum(), self._protoSizes[candidates])
+    return self._skipDeletedRows(dist)
+
+
   def _calcDistance(self, inputPattern, distanceNorm=None):
     """Calculate the distances from inputPattern to all stored patterns. All
     distances are between 0.0 and 1.0
@@ -956,37 +1831,23 @@ class KNNClassifier(Serializable):
     if self.useSparseMemory:
       if self._protoSizes is None:
         self._protoSizes = self._Memory.rowSums()
-      overlapsWithProtos = self._Memory.rightVecSumAtNZ(inputPattern)
-      inputPatternSum = inputPattern.sum()
-
-      if self.distanceMethod == "rawOverlap":
-        dist = inputPattern.sum() - overlapsWithProtos
-      elif self.distanceMethod == "pctOverlapOfInput":
-        dist = inputPatternSum - overlapsWithProtos
-        if inputPatternSum > 0:
-          dist /= inputPatternSum
-      elif self.distanceMethod == "pctOverlapOfProto":
-        overlapsWithProtos /= self._protoSizes
-        dist = 1.0 - overlapsWithProtos
-      elif self.distanceMethod == "pctOverlapOfLarger":
-        maxVal = numpy.maximum(self._protoSizes, inputPatternSum)
-        if maxVal.all() > 0:
-          overlapsWithProtos /= maxVal
-        dist = 1.0 - overlapsWithProtos
-      elif self.distanceMethod == "norm":
-        dist = self._Memory.vecLpDist(self.distanceNorm, inputPattern)
+
+      if self.distanceMethod == "norm":
+        dist = self._skipDeletedRows(
+          self._Memory.vecLpDist(self.distanceNorm, inputPattern))
         distMax = dist.max()
         if distMax > 0:
           dist /= distMax
       else:
-        raise RuntimeError("Unimplemented distance method %s" %
-          self.distanceMethod)
+        dist = self._calcOverlapDistance(
+          self._skipDeletedRows(self._calcOverlaps(inputPattern)),
+          inputPattern.sum(), self._skipDeletedRows(self._protoSizes))
 
     # Dense memory
     else:
       if self.distanceMethod == "norm":
         dist = numpy.power(numpy.abs(self._M - inputPattern), self.distanceNorm)
-        dist = dist.sum(1)
+        dist = self._skipDeletedRows(dist.sum(1))
         dist = numpy.power(dist, 1.0/self.distanceNorm)
         dist /= dist.max()
       else:
@@ -1009,19 +1870,36 @@ class KNNClassifier(Serializable):
       self._finishedLearning = True
 
     if self._vt is not None and len(self._vt) > 0:
+      self._reprojectMemory()
       inputPattern = numpy.dot(self._vt, inputPattern - self._mean)
 
     sparseInput = self._sparsifyVector(inputPattern)
 
     # Compute distances
-    dist = self._calcDistance(sparseInput)
+    if self._lsh is not None:
+      dist = self._calcApproximateDistance(sparseInput)
+    else:
+      dist = self._calcDistance(sparseInput)
+
+    return self._invalidateDistances(dist, partitionId)
+
+
+  def _invalidateDistances(self, dist, partitionId=None):
+    """Set the distances of the stored patterns that must be ignored to
+    infinity.
+
+    :param dist The distances to all stored patterns. Modified.
+
+    :param partitionId If provided, ignore all training vectors with this
+        partitionId.
+    """
     # Invalidate results where category is -1
     if self._specificIndexTraining:
       dist[numpy.array(self._categoryList) == -1] = numpy.inf
 
     # Ignore vectors with this partition id by setting their distances to inf
     if partitionId is not None:
-      dist[self._partitionIdMap.get(partitionId, [])] = numpy.inf
+      dist[self._getPartitionIdMap().get(partitionId, [])] = numpy.inf
 
     return dist
 
@@ -1031,7 +1909,12 @@ class KNNClassifier(Serializable):
     Used for batch scenarios.  This method needs to be called between learning
     and inference.
     """
-    if self.numSVDDims is not None and self._vt is None:
+    if self.svdBatchSize > 0:
+      # The first batch sets the components, so a partial one is only used if
+      # it has at least numSVDDims inputs. Until then, inputs stay buffered.
+      if self._vt is None and len(self._svdBatch) >= self.numSVDDims:
+        self._updateSVD()
+    elif self.numSVDDims is not None and self._vt is None:
       self.computeSVD()
 
 
@@ -1065,6 +1948,7 @@ class KNNClassifier(Serializable):
     if numSVDSamples is None:
       numSVDSamples = self._numPatterns
 
+    self.compactMemory()
     if not self.useSparseMemory:
       self._a = self._Memory[:self._numPatterns]
     else:
@@ -1080,6 +1964,85 @@ class KNNClassifier(Serializable):
     return self._s
 
 
+  def _updateSVD(self):
+    """
+    Updates the SVD components and mean with the inputs of the current batch,
+    without revisiting earlier inputs (incremental PCA). The first batch sets
+    the components and projects the stored patterns, like :meth:`computeSVD`.
+    """
+    batch = numpy.array(self._svdBatch, dtype=numpy.float64)
+    self._svdBatch = []
+    batchMean = batch.mean(axis=0)
+    batch -= batchMean
+
+    if self._vt is None:
+      _, self._s, self._vt = numpy.linalg.svd(batch, full_matrices=False)
+      self._mean = batchMean
+      self._svdSamplesSeen = len(batch)
+
+      # The stored patterns are the ones learned from this batch
+      self.compactMemory()
+      if self.useSparseMemory:
+        self._a = self._Memory.toDense()[:self._numPatterns]
+      else:
+        self._a = self._Memory[:self._numPatterns]
+      self._a = self._a - self._mean
+      self._finalizeSVD()
+      return
+
+    # Stack the current components, scaled by their singular values, with the
+    # centered batch and a row that accounts for the shift of the mean. The
+    # SVD of this small matrix gives the components of all inputs so far.
+    numSeen = self._svdSamplesSeen
+    numNew = len(batch)
+    numTotal = numSeen + numNew
+    mean = self._mean + (batchMean - self._mean) * (float(numNew) / numTotal)
+    meanCorrection = (numpy.sqrt(float(numSeen) * numNew / numTotal) *
+                      (self._mean - batchMean))
+    numDims = len(self._vt)
+    stacked = numpy.vstack((self._s[:numDims, numpy.newaxis] * self._vt,
+                            batch, meanCorrection))
+    _, s, vt = numpy.linalg.svd(stacked, full_matrices=False)
+
+    if self._memoryVt is None:
+      self._memoryVt = self._vt
+      self._memoryMean = self._mean
+    self._s = s[:numDims]
+    self._vt = vt[:numDims]
+    self._mean = mean
+    self._svdSamplesSeen = numTotal
+
+    if not self.lazySVDReprojection:
+      self._reprojectMemory()
+
+
+  def _reprojectMemory(self):
+    """
+    Re-projects the stored patterns onto the current SVD components, if they
+    are projected onto older ones. The stored patterns are mapped from the old
+    components to the new ones, without the inputs they came from.
+    """
+    if self._memoryVt is None:
+      return
+
+    self._M[:] = self._reprojectedPatterns()
+    self._memoryVt = None
+    self._memoryMean = None
+
+
+  def _reprojectedPatterns(self):
+    """
+    :returns: (array) The stored patterns projected onto the current SVD
+              components, without changing the stored patterns.
+    """
+    if self._memoryVt is None:
+      return self._M
+
+    transform = numpy.dot(self._vt, self._memoryVt.T)
+    offset = numpy.dot(self._vt, self._memoryMean - self._mean)
+    return numpy.dot(self._M, transform.T) + offset
+
+
   def getAdaptiveSVDDims(self, singularValues, fractionOfMax=0.001):
     """
     Compute the number of eigenvectors (singularValues) to keep.
@@ -1133,6 +2096,8 @@ class KNNClassifier(Serializable):
     self._Memory = numpy.zeros((self._numPatterns,self.numSVDDims))
     self._M = self._Memory
     self.useSparseMemory = False
+    self._invertedIndex = None
+    self._lsh = None
 
     for i in range(self._numPatterns):
       self._Memory[i] = numpy.dot(self._vt, self._a[i])
@@ -1150,12 +2115,13 @@ class KNNClassifier(Serializable):
         would change all vectors of category 0 to be category 2, category 1 to
         0, and category 2 to 1
     """
-    categoryArray = numpy.array(self._categoryList)
+    categoryArray = numpy.array(self._rowCategories)
     newCategoryArray = numpy.zeros(categoryArray.shape[0])
     newCategoryArray.fill(-1)
     for i in xrange(len(mapping)):
       newCategoryArray[categoryArray==i] = mapping[i]
-    self._categoryList = list(newCategoryArray)
+    self._rowCategories = list(newCategoryArray)
+    self._rebuildEvictionOrder()
 
 
   def setCategoryOfVectors(self, vectorIndices, categoryIndices):
@@ -1182,8 +2148,9 @@ class KNNClassifier(Serializable):
 
       # Out-of-bounds is not an error, because the KNN may not have seen the
       # vector yet
-      if vectorIndex < len(self._categoryList):
-        self._categoryList[vectorIndex] = categoryIndex
+      if vectorIndex < self._numPatterns:
+        self._rowCategories[self._storedRow(vectorIndex)] = categoryIndex
+    self._rebuildEvictionOrder()
 
   @staticmethod
   def getSchema():
@@ -1192,6 +2159,16 @@ class KNNClassifier(Serializable):
 
   @classmethod
   def read(cls, proto):
+    """
+    Read state from proto object.
+
+    The inverted index and the approximate search are rebuilt from the stored
+    patterns. The random state used by the "reservoir" eviction policy is not
+    serialized.
+
+    :param proto: (KNNClassifierProto) the proto to read from.
+    :returns: (KNNClassifier) the deserialized classifier.
+    """
     if proto.version != KNNCLASSIFIER_VERSION:
       raise RuntimeError("Invalid KNNClassifier Version")
 
@@ -1217,6 +2194,13 @@ class KNNClassifier(Serializable):
     knn.replaceDuplicates = proto.replaceDuplicates
     knn.cellsPerCol = proto.cellsPerCol
     knn.minSparsity = proto.minSparsity
+    knn.useInvertedIndex = proto.useInvertedIndex
+    knn.numLSHBands = proto.numLSHBands
+    knn.numLSHRowsPerBand = proto.numLSHRowsPerBand
+    knn.maxDeletedFraction = proto.maxDeletedFraction
+    knn.svdBatchSize = proto.svdBatchSize
+    knn.lazySVDReprojection = proto.lazySVDReprojection
+    knn.evictionPolicy = proto.evictionPolicy or None
 
     if knn.numSVDDims == "adaptive":
       knn._adaptiveSVDDims = True
@@ -1232,18 +2216,24 @@ class KNNClassifier(Serializable):
       elif which == "nearestNeighbor":
         knn._Memory = NearestNeighbor()
         knn._Memory.read(proto.memory.nearestNeighbor)
+        knn._rebuildIndexes()
 
     knn._numPatterns = proto.numPatterns
+    knn._deletedRows = numpy.array(proto.deletedRows, dtype=int)
 
-    if proto.m is not None:
+    if isinstance(knn._Memory, numpy.ndarray):
+      # The stored patterns are a view of the rows of the memory in use, so
+      # that patterns written into the memory show up in them
+      knn._M = knn._Memory[:knn._numStoredRows()]
+    elif proto.m is not None:
       knn._M = numpy.array(proto.m, dtype=numpy.float64)
 
     if proto.categoryList is not None:
-      knn._categoryList = list(proto.categoryList)
+      knn._rowCategories = list(proto.categoryList)
 
     if proto.partitionIdList is not None:
-      knn._partitionIdList = list(proto.partitionIdList)
-      knn._rebuildPartitionIdMap(knn._partitionIdList)
+      knn._rowPartitionIds = list(proto.partitionIdList)
+      knn._partitionIdMap = None
 
     knn._iterationIdx = proto.iterationIdx
     knn._finishedLearning = proto.finishedLearning
@@ -1257,10 +2247,38 @@ class KNNClassifier(Serializable):
     if proto.mean is not None:
       knn._mean = numpy.array(proto.mean, dtype=numpy.float32)
 
+    knn._svdSamplesSeen = proto.svdSamplesSeen
+    if knn._vt is not None and knn._svdSamplesSeen == 0:
+      # Written before the number of inputs seen by the SVD was serialized
+      knn._svdSamplesSeen = knn._numPatterns
+    knn._svdBatch = [numpy.array(inputPattern, dtype=numpy.float64)
+                     for inputPattern in proto.svdBatch]
+
+    if knn.fixedCapacity:
+      knn._rowRecencies = list(proto.categoryRecencyList)
+    knn._numOfferedPatterns = max(proto.numOfferedPatterns, knn._numPatterns)
+
+    if knn.evictionPolicy in ("lru", "quota"):
+      evictionOrder = list(proto.evictionOrder)
+      if not evictionOrder:
+        # Written without the eviction order, start from the stored order
+        evictionOrder = knn._storedRow(numpy.arange(knn._numPatterns)).tolist()
+      for row in evictionOrder:
+        knn._touchRow(int(row))
+
     return knn
 
 
   def write(self, proto):
+    # Writing does not change this instance: the deleted rows are written
+    # along with the memory, and patterns that are still to be re-projected
+    # are written the way they would be after re-projecting them.
+    memory = self._Memory
+    storedPatterns = self._M
+    if self._memoryVt is not None:
+      storedPatterns = self._reprojectedPatterns()
+      memory = memory.copy()
+      memory[:len(storedPatterns)] = storedPatterns
 
     proto.version = self.version
     proto.k = self.k
@@ -1279,25 +2297,35 @@ class KNNClassifier(Serializable):
     proto.replaceDuplicates = bool(self.replaceDuplicates)
     proto.cellsPerCol = self.cellsPerCol
     proto.minSparsity = self.minSparsity
+    proto.useInvertedIndex = bool(self.useInvertedIndex)
+    proto.numLSHBands = self.numLSHBands
+    proto.numLSHRowsPerBand = self.numLSHRowsPerBand
+    proto.maxDeletedFraction = self.maxDeletedFraction
+    proto.svdBatchSize = self.svdBatchSize
+    proto.lazySVDReprojection = bool(self.lazySVDReprojection)
+    proto.evictionPolicy = self.evictionPolicy or ""
 
     # Write private state
-    if self._Memory is not None:
-      if isinstance(self._Memory, numpy.ndarray):
-        proto.memory.ndarray = self._Memory.tolist()
+    if memory is not None:
+      if isinstance(memory, numpy.ndarray):
+        proto.memory.ndarray = memory.tolist()
       else:
         proto.memory.init("nearestNeighbor")
-        self._Memory.write(proto.memory.nearestNeighbor)
+        memory.write(proto.memory.nearestNeighbor)
 
     proto.numPatterns = self._numPatterns
+    proto.deletedRows = self._deletedRows.tolist()
 
-    if self._M is not None:
-      proto.m = self._M.tolist()
+    if storedPatterns is not None:
+      proto.m = storedPatterns.tolist()
 
-    if self._categoryList is not None:
-      proto.categoryList = self._categoryList
-
-    if self._partitionIdList is not None:
-      proto.partitionIdList = self._partitionIdList
+    proto.categoryList = self._rowCategories
+    proto.partitionIdList = self._rowPartitionIds
+    if self.fixedCapacity:
+      proto.categoryRecencyList = [int(rowID) for rowID in self._rowRecencies]
+    proto.evictionOrder = [int(row) for rows in self._evictionOrder.values()
+                           for row in rows]
+    proto.numOfferedPatterns = self._numOfferedPatterns
 
     proto.finishedLearning = bool(self._finishedLearning)
     proto.iterationIdx = self._iterationIdx
@@ -1311,6 +2339,10 @@ class KNNClassifier(Serializable):
     if self._mean is not None:
       proto.mean = self._mean.tolist()
 
+    proto.svdSamplesSeen = self._svdSamplesSeen
+    proto.svdBatch = [numpy.asarray(inputPattern, dtype=numpy.float64).tolist()
+                      for inputPattern in self._svdBatch]
+
 
   def __getstate__(self):
     """Return serializable state.
@@ -1338,11 +2370,65 @@ class KNNClassifier(Serializable):
     if "minSparsity" not in state:
       state["minSparsity"] = 0.0
 
+    if "useInvertedIndex" not in state:
+      state["useInvertedIndex"] = False
+      state["_invertedIndex"] = None
+
+    if "numLSHBands" not in state:
+      state["numLSHBands"] = 0
+      state["numLSHRowsPerBand"] = 4
+      state["_lsh"] = None
+
+    if "maxDeletedFraction" not in state:
+      state["maxDeletedFraction"] = 0.0
+      state["_deletedRows"] = []
+
+    patternIndexedEviction = False
+    if "_rowCategories" not in state:
+      # The categories, rowIDs and partition ids, and the eviction order, were
+      # kept by pattern index instead of by row of the memory.
+      deletedRows = state["_deletedRows"]
+      patternIndexedEviction = len(deletedRows) > 0
+      state["_deletedRows"] = numpy.asarray(deletedRows, dtype=int)
+      for oldKey, key in (("_categoryList", "_rowCategories"),
+                          ("_categoryRecencyList", "_rowRecencies"),
+                          ("_partitionIdList", "_rowPartitionIds")):
+        if oldKey in state:
+          values = list(state.pop(oldKey))
+          for row in deletedRows:
+            values.insert(row, -1)
+          state[key] = values
+
+    if "_protoCSR" not in state:
+      state["_protoCSR"] = None
+
+    if "svdBatchSize" not in state:
+      state["svdBatchSize"] = 0
+      state["lazySVDReprojection"] = False
+      state["_svdBatch"] = []
+      state["_svdSamplesSeen"] = 0
+      state["_memoryVt"] = None
+      state["_memoryMean"] = None
+
+    if "evictionPolicy" not in state:
+      state["evictionPolicy"] = None
+      state["_evictionOrder"] = {}
+      state["_evictionGroups"] = {}
+      state["_numOfferedPatterns"] = 0
+      state["_evictionRandom"] = numpy.random.RandomState(42)
+
     self.__dict__.update(state)
 
+    # Pickling stores the view of the memory as a separate array
+    if isinstance(self._Memory, numpy.ndarray):
+      self._M = self._Memory[:self._numStoredRows()]
+
     # Backward compatibility
     if "_partitionIdMap" not in state:
       self._rebuildPartitionIdMap(self._partitionIdList)
+    if patternIndexedEviction:
+      self._rebuildEvictionOrder(
+        self._storedRow(numpy.arange(self._numPatterns)))
 
     # Set to new version
     self.version = KNNCLASSIFIER_VERSION
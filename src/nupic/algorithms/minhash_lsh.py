@@ -0,0 +1,169 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Locality sensitive hashing of sparse binary patterns, used by the approximate
+mode of :class:`~nupic.algorithms.knn_classifier.KNNClassifier`.
+"""
+
+from bisect import insort
+from itertools import chain
+
+import numpy
+
+
+# Largest Mersenne prime that fits in 32 bits. The MinHash functions are
+# (a * bit + b) mod _PRIME.
+_PRIME = 2 ** 31 - 1
+
+
+
+class MinHashLSH(object):
+  """
+  Finds stored patterns that probably share many bits with a query pattern.
+
+  Each pattern, given as the indices of its active bits, is summarized by
+  ``numBands * rowsPerBand`` MinHash values. Two patterns with Jaccard
+  similarity ``s`` get the same MinHash value with probability ``s``, and
+  share all the values of at least one band with probability
+  ``1 - (1 - s ** rowsPerBand) ** numBands``. The stored patterns that share a
+  band with the query are its candidates.
+
+  More bands find more of the similar patterns, at the cost of more hashing and
+  more candidates. More rows per band make the candidates more similar to the
+  query, at the cost of missing more of the similar patterns.
+
+  Rows are numbered in the order the patterns are added and are renumbered by
+  :meth:`removeRows`, the same way as the rows of a sparse matrix.
+
+  :param numBands: (int) Number of bands.
+  :param rowsPerBand: (int) Number of MinHash values in each band.
+  :param seed: (int) Seed for the hash functions.
+  """
+
+  def __init__(self, numBands, rowsPerBand, seed=42):
+    if numBands <= 0 or rowsPerBand <= 0:
+      raise ValueError("Need at least one band and one row per band")
+
+    self.numBands = numBands
+    self.rowsPerBand = rowsPerBand
+    self.numRows = 0
+
+    randomState = numpy.random.RandomState(seed)
+    numHashes = numBands * rowsPerBand
+    self._a = randomState.randint(1, _PRIME, size=numHashes).astype("int64")
+    self._b = randomState.randint(0, _PRIME, size=numHashes).astype("int64")
+
+    # One dict per band, from the band's MinHash values to the sorted rows of
+    # the patterns that have them.
+    self._buckets = [{} for _ in xrange(numBands)]
+
+
+  def signature(self, bits):
+    """
+    :param bits: (list) Indices of the active bits of a pattern
+    :returns: (array) The MinHash values of the pattern, all equal to the
+              prime modulus for an empty pattern.
+    """
+    bits = numpy.asarray(bits, dtype="int64")
+    if len(bits) == 0:
+      return numpy.repeat(numpy.int64(_PRIME), len(self._a))
+
+    hashes = (self._a[:, numpy.newaxis] * bits +
+              self._b[:, numpy.newaxis]) % _PRIME
+    return hashes.min(axis=1)
+
+
+  def add(self, bits):
+    """
+    Stores a pattern as the next row.
+
+    :param bits: (list) Indices of the active bits of the pattern
+    :returns: (int) Row of the pattern
+    """
+    row = self.numRows
+    for buckets, key in zip(self._buckets, self._bandKeys(bits)):
+      buckets.setdefault(key, []).append(row)
+    self.numRows += 1
+    return row
+
+
+  def query(self, bits):
+    """
+    :param bits: (list) Indices of the active bits of the query pattern
+    :returns: (array) Sorted rows of the stored patterns that share at least
+              one band with the query.
+    """
+    rowLists = [buckets.get(key, [])
+                for buckets, key in zip(self._buckets, self._bandKeys(bits))]
+    return numpy.unique(numpy.fromiter(chain.from_iterable(rowLists),
+                                       dtype="int64"))
+
+
+  def replaceRow(self, row, oldBits, bits):
+    """
+    Replaces the pattern stored in a row, without renumbering any rows.
+
+    :param row: (int) Row of the pattern
+    :param oldBits: (list) Indices of the active bits of the stored pattern
+    :param bits: (list) Indices of the active bits of the new pattern
+    """
+    for buckets, key in zip(self._buckets, self._bandKeys(oldBits)):
+      rows = buckets[key]
+      rows.remove(row)
+      if not rows:
+        del buckets[key]
+    for buckets, key in zip(self._buckets, self._bandKeys(bits)):
+      insort(buckets.setdefault(key, []), row)
+
+
+  def removeRows(self, rowsToRemove):
+    """
+    Removes patterns and shifts the rows after them down.
+
+    :param rowsToRemove: (list) Rows of the patterns to remove
+    """
+    keep = numpy.ones(self.numRows, dtype=bool)
+    keep[numpy.asarray(rowsToRemove, dtype="int64")] = False
+    newRows = numpy.cumsum(keep) - 1
+    newRows[~keep] = -1
+
+    for buckets in self._buckets:
+      for key, rows in buckets.items():
+        rows = newRows[rows]
+        rows = rows[rows >= 0]
+        if len(rows):
+          buckets[key] = rows.tolist()
+        else:
+          del buckets[key]
+
+    self.numRows = int(keep.sum())
+
+
+  def _bandKeys(self, bits):
+    """
+    :param bits: (list) Indices of the active bits of a pattern
+    :returns: (list) One hashable key per band.
+    """
+    signature = self.signature(bits)
+    return [signature[i * self.rowsPerBand:(i + 1) * self.rowsPerBand]
+            .tostring()
+            for i in xrange(self.numBands)]
@@ -31,6 +31,8 @@ from collections import deque
 import numpy
 
 from nupic.serializable import Serializable
+from nupic.support.memory_usage import (FLOAT_BYTES, INT_BYTES, arrayBytes,
+                                        listBytes, withTotal)
 
 try:
   import capnp
@@ -143,11 +145,15 @@ class SDRClassifier(Serializable):
     # each bucket index during inference
     self._maxBucketIdx = 0
 
-    # The connection weight matrix
+    # The connection weight matrix of each step. These are views of the
+    # logical (maxInputIdx + 1) x (maxBucketIdx + 1) region of the matching
+    # buffers, which are over-allocated so that they rarely need to grow.
+    self._weightBuffers = dict()
     self._weightMatrix = dict()
     for step in self.steps:
-      self._weightMatrix[step] = numpy.zeros(shape=(self._maxInputIdx+1,
-                                                    self._maxBucketIdx+1))
+      self._weightBuffers[step] = numpy.zeros(shape=(self._maxInputIdx+1,
+                                                     self._maxBucketIdx+1))
+      self._weightMatrix[step] = self._weightBuffers[step][:, :]
 
     # This keeps track of the actual value to use for each bucket index. We
     # start with 1 bucket, no actual value so that the first infer has something
@@ -227,11 +233,7 @@ class SDRClassifier(Serializable):
     # Update maxInputIdx and augment weight matrix with zero padding
     if max(patternNZ) > self._maxInputIdx:
       newMaxInputIdx = max(patternNZ)
-      for nSteps in self.steps:
-        self._weightMatrix[nSteps] = numpy.concatenate((
-          self._weightMatrix[nSteps],
-          numpy.zeros(shape=(newMaxInputIdx-self._maxInputIdx,
-                             self._maxBucketIdx+1))), axis=0)
+      self._growWeightMatrix(newMaxInputIdx, self._maxBucketIdx)
       self._maxInputIdx = int(newMaxInputIdx)
 
     # Get classification info
@@ -264,12 +266,7 @@ class SDRClassifier(Serializable):
 
         # Update maxBucketIndex and augment weight matrix with zero padding
         if bucketIdx > self._maxBucketIdx:
-          for nSteps in self.steps:
-            self._weightMatrix[nSteps] = numpy.concatenate((
-              self._weightMatrix[nSteps],
-              numpy.zeros(shape=(self._maxInputIdx+1,
-                                 bucketIdx-self._maxBucketIdx))), axis=1)
-
+          self._growWeightMatrix(self._maxInputIdx, bucketIdx)
           self._maxBucketIdx = int(bucketIdx)
 
         # Update rolling average of actual values if it's a scalar. If it's
@@ -289,13 +286,17 @@ class SDRClassifier(Serializable):
           else:
             self._actualValues[bucketIdx] = actValue
 
-      for (learnRecordNum, learnPatternNZ) in self._patternNZHistory:
-        error = self._calculateError(recordNum, bucketIdxList)
+      # Each history entry has its own number of steps, so updating the
+      # weights of one entry never changes the error of another.
+      error = self._calculateError(recordNum, bucketIdxList)
 
+      for (learnRecordNum, learnPatternNZ) in self._patternNZHistory:
         nSteps = recordNum - learnRecordNum
         if nSteps in self.steps:
-          for bit in learnPatternNZ:
-            self._weightMatrix[nSteps][bit, :] += self.alpha * error[nSteps]
+          # Unbuffered, so that a bit that occurs twice is updated twice.
+          numpy.add.at(self._weightMatrix[nSteps],
+                       numpy.asarray(learnPatternNZ, dtype="int64"),
+                       self.alpha * error[nSteps])
 
     # ------------------------------------------------------------------------
     # Verbose print
@@ -379,6 +380,96 @@ class SDRClassifier(Serializable):
     return predictDist
 
 
+  def inferBatch(self, patternsNZ, topK=None):
+    """
+    Return the inference values of many input samples at once. Like
+    :meth:`infer`, this does not learn.
+
+    :param patternsNZ: The active indices of each sample, either as a list of
+           lists or as a CSR matrix, e.g. a ``scipy.sparse.csr_matrix`` with
+           one row per sample. Only the ``indptr`` and ``indices`` of a CSR
+           matrix are used.
+    :param topK: (int) If given, only return the ``topK`` most likely buckets
+           of each sample.
+
+    :returns: (dict) One entry for each step in ``self.steps``, plus
+              ``actualValues`` like :meth:`infer`. Without ``topK``, the value
+              of a step is an array with one row per sample, holding the
+              likelihood of each bucket. With ``topK``, it is a tuple
+              (``bucketIdx``, ``likelihood``) of two such arrays with ``topK``
+              columns, sorted from most to least likely.
+    """
+    if topK is not None and topK < 1:
+      raise ValueError("topK must be at least 1")
+
+    if hasattr(patternsNZ, "indptr"):
+      starts = numpy.asarray(patternsNZ.indptr, dtype="int64")
+      bits = numpy.asarray(patternsNZ.indices, dtype="int64")
+    else:
+      lengths = numpy.fromiter((len(p) for p in patternsNZ), dtype="int64",
+                               count=len(patternsNZ))
+      starts = numpy.zeros(len(lengths) + 1, dtype="int64")
+      numpy.cumsum(lengths, out=starts[1:])
+      bits = numpy.fromiter((bit for p in patternsNZ for bit in p),
+                            dtype="int64", count=starts[-1])
+
+    # Empty samples contribute no bits, so the sums of the non-empty ones can
+    # be taken in one pass. Empty samples keep an activation of zero.
+    nonEmpty = numpy.flatnonzero(starts[1:] > starts[:-1])
+    numBuckets = self._maxBucketIdx + 1
+    actValues = [x if x is not None else 0 for x in self._actualValues]
+    retval = {"actualValues": actValues}
+
+    for nSteps in self.steps:
+      activation = numpy.zeros((len(starts) - 1, numBuckets))
+      if len(nonEmpty):
+        activation[nonEmpty] = numpy.add.reduceat(
+          self._weightMatrix[nSteps][bits], starts[nonEmpty], axis=0)
+
+      # softmax normalization, shifted by the largest activation of each
+      # sample so that exp() cannot overflow
+      activation -= activation.max(axis=1)[:, numpy.newaxis]
+      predictDist = numpy.exp(activation)
+      predictDist /= predictDist.sum(axis=1)[:, numpy.newaxis]
+
+      if topK is None:
+        retval[nSteps] = predictDist
+        continue
+
+      # Select the top buckets without sorting all of them, then sort those.
+      rows = numpy.arange(len(predictDist))[:, numpy.newaxis]
+      if topK < numBuckets:
+        bucketIdx = numpy.argpartition(-predictDist, topK - 1,
+                                       axis=1)[:, :topK]
+      else:
+        bucketIdx = numpy.tile(numpy.arange(numBuckets),
+                               (len(predictDist), 1))
+      order = numpy.argsort(-predictDist[rows, bucketIdx], axis=1,
+                            kind="mergesort")
+      bucketIdx = bucketIdx[rows, order]
+      retval[nSteps] = (bucketIdx, predictDist[rows, bucketIdx])
+
+    return retval
+
+
+  def getMemoryUsage(self):
+    """
+    Estimates the memory used by this classifier.
+
+    :returns: (dict) Estimated bytes for ``weights`` (the weight matrix of
+              every step), ``patternHistory``, ``actualValues`` and their
+              ``total``.
+    """
+    return withTotal({
+      "weights": arrayBytes(*self._weightBuffers.values()),
+      "patternHistory": (
+        listBytes(self._patternNZHistory) +
+        sum(listBytes(patternNZ, INT_BYTES)
+            for _, patternNZ in self._patternNZHistory)),
+      "actualValues": listBytes(self._actualValues, FLOAT_BYTES),
+    })
+
+
   @classmethod
   def getSchema(cls):
     return SdrClassifierProto
@@ -405,12 +496,15 @@ class SDRClassifier(Serializable):
     classifier._maxBucketIdx = proto.maxBucketIdx
     classifier._maxInputIdx = proto.maxInputIdx
 
+    classifier._weightBuffers = {}
     classifier._weightMatrix = {}
     weightMatrixProto = proto.weightMatrix
     for i in xrange(len(weightMatrixProto)):
-      classifier._weightMatrix[weightMatrixProto[i].steps] = numpy.reshape(
+      step = weightMatrixProto[i].steps
+      classifier._weightBuffers[step] = numpy.reshape(
         weightMatrixProto[i].weight, newshape=(classifier._maxInputIdx+1,
                                                classifier._maxBucketIdx+1))
+      classifier._weightMatrix[step] = classifier._weightBuffers[step][:, :]
 
     classifier._actualValues = []
     for actValue in proto.actualValues:
@@ -474,6 +568,60 @@ class SDRClassifier(Serializable):
     proto.verbosity = self.verbosity
 
 
+  def __getstate__(self):
+    # Only save the logical region of the weight buffers, in the same format
+    # as before they were over-allocated.
+    state = self.__dict__.copy()
+    del state["_weightBuffers"]
+    state["_weightMatrix"] = dict((step, weights.copy())
+                                  for step, weights
+                                  in self._weightMatrix.iteritems())
+    return state
+
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self._weightBuffers = self._weightMatrix
+    self._weightMatrix = dict((step, weights[:, :])
+                              for step, weights
+                              in self._weightBuffers.iteritems())
+
+
+  def _growWeightMatrix(self, maxInputIdx, maxBucketIdx):
+    """
+    Grows the weight matrix of every step to (maxInputIdx + 1) x
+    (maxBucketIdx + 1), padding it with zeros.
+
+    A buffer that is too small is replaced by one with at least double the
+    rows or columns that overflow, so that a stream of growing input or
+    bucket indices copies each weight an amortized constant number of times.
+    The buffers are only written through the logical views, so the spare
+    capacity is still all zeros when a view is extended over it.
+
+    :param maxInputIdx: (int) New largest input index
+    :param maxBucketIdx: (int) New largest bucket index
+    """
+    numRows = maxInputIdx + 1
+    numColumns = maxBucketIdx + 1
+
+    for step in self.steps:
+      weights = self._weightMatrix[step]
+      buffer_ = self._weightBuffers[step]
+      capacityRows, capacityColumns = buffer_.shape
+
+      if numRows > capacityRows or numColumns > capacityColumns:
+        if numRows > capacityRows:
+          capacityRows = max(numRows, 2 * capacityRows)
+        if numColumns > capacityColumns:
+          capacityColumns = max(numColumns, 2 * capacityColumns)
+
+        buffer_ = numpy.zeros(shape=(capacityRows, capacityColumns))
+        buffer_[:weights.shape[0], :weights.shape[1]] = weights
+        self._weightBuffers[step] = buffer_
+
+      self._weightMatrix[step] = buffer_[:numRows, :numColumns]
+
+
   def _calculateError(self, recordNum, bucketIdxList):
     """
     Calculate error signal
@@ -19,6 +19,8 @@
 # http://numenta.org/licenses/
 # ----------------------------------------------------------------------
 
+import json
+
 try:
   import capnp
 except ImportError:
@@ -34,13 +36,29 @@ if capnp:
 
 from nupic.math import topology
 from nupic.serializable import Serializable
+from nupic.support.memory_usage import (ARRAY_OBJECT_BYTES, arrayBytes,
+                                        listBytes, sparseMatrixBytes,
+                                        withTotal)
 
 realDType = GetNTAReal()
 uintType = "uint32"
 
-VERSION = 3
+VERSION = 4
 PERMANENCE_EPSILON = 0.000001
 
+# Number of steps between a permanence of 0 and 1 when permanences are stored
+# compactly, as 8-bit fixed point values.
+COMPACT_PERMANENCE_STEPS = 255
+
+# Identifies the files written by SpatialPooler.writeSnapshot, and the version
+# of their layout.
+SNAPSHOT_MAGIC = "NuPICSPS"
+SNAPSHOT_VERSION = 1
+
+# Minimum number of columns for which global inhibition selects the winners
+# with a partial sort instead of sorting the overlaps of all the columns.
+SELECTION_INHIBITION_MIN_COLUMNS = 1024
+
 
 
 class InvalidSPParamValueError(ValueError):
@@ -96,7 +114,429 @@ class BinaryCorticalColumns(_SparseMatrixCorticalColumnAdapter,
 
 
 
-class SpatialPooler(Serializable):
+class CompactCorticalColumns(object):
+  """ Compact alternative to CorticalColumns for permanence values. Each
+  column only stores the permanences of the input bits in its potential pool,
+  in the order of the pool's indices, as 8-bit fixed point values with a step
+  of 1 / COMPACT_PERMANENCE_STEPS. The input bit indices are not stored again
+  since they are given by the potential pools matrix, so a permanence takes a
+  single byte instead of the index and float value stored by CorticalColumns.
+
+  Permanences are rounded to the nearest step when they are stored, and values
+  set outside of a column's potential pool are dropped.
+  """
+
+  def __init__(self, potentialPools):
+    """
+    :param potentialPools: (BinaryCorticalColumns) the potential pools of the
+                           columns, which must be kept up to date by the owner.
+    """
+    self._potentialPools = potentialPools
+    self._numInputs = potentialPools.nCols()
+    self._values = [numpy.zeros(0, dtype=numpy.uint8)
+                    for _ in xrange(potentialPools.nRows())]
+
+
+  @staticmethod
+  def quantize(perm):
+    """
+    Rounds permanence values to the nearest value that can be stored.
+
+    :param perm: (numpy array) permanence values, rounded in place.
+    """
+    numpy.clip(perm, 0.0, 1.0, out=perm)
+    perm *= COMPACT_PERMANENCE_STEPS
+    numpy.floor(perm + 0.5, out=perm)
+    perm /= COMPACT_PERMANENCE_STEPS
+
+
+  def __getitem__(self, columnIndex):
+    """ Returns the dense permanence values of a column."""
+    perm = numpy.zeros(self._numInputs, dtype=realDType)
+    values = self._values[columnIndex]
+    perm[self._potentialPools.getRowSparse(columnIndex)] = (
+      values.astype(realDType) / COMPACT_PERMANENCE_STEPS)
+    return perm
+
+
+  def getRow(self, columnIndex):
+    """ Same as __getitem__, for compatibility with CorticalColumns."""
+    return self[columnIndex]
+
+
+  def update(self, columnIndex, vector):
+    """ Stores the dense permanence values of a column."""
+    potential = self._potentialPools.getRowSparse(columnIndex)
+    values = numpy.clip(numpy.asarray(vector)[potential], 0.0, 1.0)
+    self._values[columnIndex] = numpy.floor(
+      values * COMPACT_PERMANENCE_STEPS + 0.5).astype(numpy.uint8)
+
+
+  def nbytes(self):
+    """ Returns the estimated size of the stored permanences in bytes."""
+    return (self._potentialPools.nNonZeros() +
+            listBytes(self._values, ARRAY_OBJECT_BYTES))
+
+
+  def nRows(self):
+    return len(self._values)
+
+
+  def nCols(self):
+    return self._numInputs
+
+
+  def toDense(self):
+    return numpy.array([self[columnIndex]
+                        for columnIndex in xrange(self.nRows())],
+                       dtype=realDType).reshape(self.nRows(), self._numInputs)
+
+
+  def write(self, proto):
+    """
+    Writes the permanences to a SparseMatrixProto, in the same format as
+    CorticalColumns.
+    """
+    permanences = CorticalColumns(self.nRows(), self._numInputs)
+    for columnIndex in xrange(self.nRows()):
+      permanences.update(columnIndex, self[columnIndex])
+    permanences.write(proto)
+
+
+  def read(self, proto):
+    """
+    Reads the permanences from a SparseMatrixProto, rounding them to the
+    nearest value that can be stored.
+    """
+    permanences = CorticalColumns(self.nRows(), self._numInputs)
+    permanences.read(proto)
+    for columnIndex in xrange(self.nRows()):
+      self.update(columnIndex, permanences[columnIndex])
+
+
+
+class _ColumnSelection(object):
+  """
+  Overlap and inhibition methods shared by :class:`SpatialPooler` and
+  :class:`SpatialPoolerSnapshot`, so that both select the same active
+  columns. Subclasses provide '_numInputs', '_numColumns',
+  '_columnDimensions', '_inhibitionRadius', '_globalInhibition',
+  '_localAreaDensity', '_numActiveColumnsPerInhArea', '_stimulusThreshold',
+  '_wrapAround', '_columnNeighborhoods', '_columnNeighborhoodsKey' and
+  '_getConnectedColumnsByInput'.
+  """
+
+  def _getBatchActiveInputs(self, inputMatrix):
+    """
+    Converts a batch of inputs into the coordinates of its active bits.
+
+    Parameters:
+    ----------------------------
+    :param inputMatrix: See :meth:`computeBatch`.
+
+    @returns (tuple) the record index and the input index of every active bit,
+             sorted by record, and the number of records in the batch.
+    """
+    if isinstance(inputMatrix, numpy.ndarray):
+      if inputMatrix.ndim != 2 or inputMatrix.shape[1] != self._numInputs:
+        raise ValueError(
+          "Input matrix dimensions don't match. Expecting (N, %s) but got %s" %
+          (self._numInputs, inputMatrix.shape))
+      rowIndices, inputIndices = numpy.nonzero(inputMatrix)
+      return rowIndices, inputIndices, inputMatrix.shape[0]
+
+    activeInputs = [numpy.asarray(indices, dtype=numpy.int64).reshape(-1)
+                    for indices in inputMatrix]
+    numRecords = len(activeInputs)
+    lengths = numpy.array([indices.size for indices in activeInputs],
+                          dtype=numpy.int64)
+    rowIndices = numpy.repeat(numpy.arange(numRecords), lengths)
+    if numRecords > 0:
+      inputIndices = numpy.concatenate(activeInputs)
+    else:
+      inputIndices = numpy.zeros(0, dtype=numpy.int64)
+
+    if inputIndices.size and (inputIndices.min() < 0 or
+                              inputIndices.max() >= self._numInputs):
+      raise ValueError("Active input indices must be in the range [0, %s)" %
+                       self._numInputs)
+
+    return rowIndices, inputIndices, numRecords
+
+
+  def _calculateOverlapBatch(self, rowIndices, inputIndices, numRecords):
+    """
+    Determines the overlaps of every column with a batch of input vectors.
+    The connected synapses are indexed by input bit, so that each active input
+    bit contributes the columns it is connected to. All the records are then
+    counted together by offsetting each column by its record's position in
+    the output.
+
+    Parameters:
+    ----------------------------
+    :param rowIndices: The record index of every active input bit.
+    :param inputIndices: The input index of every active input bit.
+    :param numRecords: The number of records in the batch.
+
+    @returns (numpy.ndarray) An array with one row of overlaps per record.
+    """
+    inputOffsets, connectedColumns = self._getConnectedColumnsByInput()
+
+    starts = inputOffsets[inputIndices]
+    lengths = inputOffsets[inputIndices + 1] - starts
+    total = lengths.sum()
+    positions = (numpy.arange(total) -
+                 numpy.repeat(numpy.cumsum(lengths) - lengths - starts,
+                              lengths))
+    flatColumns = (numpy.repeat(rowIndices, lengths) * self._numColumns +
+                   connectedColumns[positions])
+
+    overlaps = numpy.bincount(flatColumns,
+                              minlength=numRecords * self._numColumns)
+    return overlaps.astype(realDType).reshape(numRecords, self._numColumns)
+
+
+  def _inhibitColumns(self, overlaps):
+    """
+    Performs inhibition. This method calculates the necessary values needed to
+    actually perform inhibition and then delegates the task of picking the
+    active columns to helper functions.
+
+    Parameters:
+    ----------------------------
+    :param overlaps: an array containing the overlap score for each  column.
+                    The overlap score for a column is defined as the number
+                    of synapses in a "connected state" (connected synapses)
+                    that are connected to input bits which are turned on.
+    """
+    density = self._getInhibitionDensity()
+
+    if self._globalInhibition or \
+      self._inhibitionRadius > max(self._columnDimensions):
+      return self._inhibitColumnsGlobal(overlaps, density)
+    else:
+      return self._inhibitColumnsLocal(overlaps, density)
+
+
+  def _getInhibitionDensity(self):
+    """
+    Determines the fraction of columns that should be selected in the
+    inhibition phase. This can be specified by either setting the
+    'numActiveColumnsPerInhArea' parameter or the 'localAreaDensity' parameter
+    when initializing the class.
+    """
+    if (self._localAreaDensity > 0):
+      density = self._localAreaDensity
+    else:
+      inhibitionArea = ((2*self._inhibitionRadius + 1)
+                                    ** self._columnDimensions.size)
+      inhibitionArea = min(self._numColumns, inhibitionArea)
+      density = float(self._numActiveColumnsPerInhArea) / inhibitionArea
+      density = min(density, 0.5)
+    return density
+
+
+  def _inhibitColumnsGlobal(self, overlaps, density):
+    """
+    Perform global inhibition. Performing global inhibition entails picking the
+    top 'numActive' columns with the highest overlap score in the entire
+    region. At most half of the columns in a local neighborhood are allowed to
+    be active. Columns with an overlap score below the 'stimulusThreshold' are
+    always inhibited.
+
+    :param overlaps: an array containing the overlap score for each  column.
+                    The overlap score for a column is defined as the number
+                    of synapses in a "connected state" (connected synapses)
+                    that are connected to input bits which are turned on.
+    :param density: The fraction of columns to survive inhibition.
+    @return list with indices of the winning columns
+    """
+    #calculate num active per inhibition area
+    numActive = int(density * self._numColumns)
+
+    if self._numColumns >= SELECTION_INHIBITION_MIN_COLUMNS:
+      return self._selectGlobalWinners(overlaps, numActive)
+
+    # Calculate winners using stable sort algorithm (mergesort)
+    # for compatibility with C++
+    sortedWinnerIndices = numpy.argsort(overlaps, kind='mergesort')
+
+    # Enforce the stimulus threshold
+    start = len(sortedWinnerIndices) - numActive
+    while start < len(sortedWinnerIndices):
+      i = sortedWinnerIndices[start]
+      if overlaps[i] >= self._stimulusThreshold:
+        break
+      else:
+        start += 1
+
+    return sortedWinnerIndices[start:][::-1]
+
+
+  def _selectGlobalWinners(self, overlaps, numActive):
+    """
+    Picks the same winners, in the same order, as sorting all the overlaps
+    with a stable sort in '_inhibitColumnsGlobal', but only sorts the
+    'numActive' best columns. The overlap of the weakest winner is found with
+    a linear time selection. All the columns with a bigger overlap win, and
+    the remaining places go to the columns tied with the weakest winner that
+    have the highest indices, as the stable sort would have placed them last.
+
+    :param overlaps: an array containing the overlap score for each  column.
+    :param numActive: The number of columns to survive inhibition.
+    @return list with indices of the winning columns
+    """
+    if numActive <= 0:
+      return numpy.zeros(0, dtype=numpy.int64)
+
+    kth = self._numColumns - numActive
+    weakestOverlap = overlaps[numpy.argpartition(overlaps, kth)[kth]]
+    bigger = numpy.flatnonzero(overlaps > weakestOverlap)
+    tied = numpy.flatnonzero(overlaps == weakestOverlap)
+    winners = numpy.concatenate(
+      (bigger, tied[tied.size - (numActive - bigger.size):]))
+
+    # Order by decreasing overlap, breaking ties by decreasing index
+    winners = winners[numpy.lexsort((winners, overlaps[winners]))[::-1]]
+
+    # Enforce the stimulus threshold
+    return winners[overlaps[winners] >= self._stimulusThreshold]
+
+
+  def _inhibitColumnsGlobalBatch(self, overlaps, density):
+    """
+    Performs global inhibition on every row of a matrix of overlaps. The
+    winners of each row are the same as those picked by
+    '_inhibitColumnsGlobal' for that row on its own.
+
+    :param overlaps: an array with one row of overlap scores per record.
+    :param density: The fraction of columns to survive inhibition.
+    @return (tuple) the row index and the column index of every winner
+    """
+    numActive = int(density * self._numColumns)
+    rows = numpy.arange(overlaps.shape[0])[:, numpy.newaxis]
+
+    sortedWinnerIndices = numpy.argsort(overlaps, axis=1, kind='mergesort')
+    winners = sortedWinnerIndices[:, self._numColumns - numActive:]
+
+    # The candidates are in ascending order of overlap, so the ones below the
+    # stimulus threshold are exactly the ones skipped by the per-record path.
+    aboveThreshold = overlaps[rows, winners] >= self._stimulusThreshold
+    rows = numpy.broadcast_to(rows, winners.shape)
+    return rows[aboveThreshold], winners[aboveThreshold]
+
+
+  def _inhibitColumnsLocal(self, overlaps, density):
+    """
+    Performs local inhibition. Local inhibition is performed on a column by
+    column basis. Each column observes the overlaps of its neighbors and is
+    selected if its overlap score is within the top 'numActive' in its local
+    neighborhood. At most half of the columns in a local neighborhood are
+    allowed to be active. Columns with an overlap score below the
+    'stimulusThreshold' are always inhibited.
+
+    :param overlaps: an array containing the overlap score for each  column.
+                    The overlap score for a column is defined as the number
+                    of synapses in a "connected state" (connected synapses)
+                    that are connected to input bits which are turned on.
+    :param density: The fraction of columns to survive inhibition. This
+                    value is only an intended target. Since the surviving
+                    columns are picked in a local fashion, the exact fraction
+                    of surviving columns is likely to vary.
+    @return list with indices of the winning columns
+    """
+
+    neighborhoods, neighborhoodSizes = self._getColumnNeighborhoods()
+    columns = numpy.arange(self._numColumns)
+
+    # Pad the overlaps with a value that is never bigger than nor tied with
+    # any overlap, so that the padding of the neighborhoods can be ignored.
+    paddedOverlaps = numpy.empty(self._numColumns + 1, dtype=overlaps.dtype)
+    paddedOverlaps[:-1] = overlaps
+    paddedOverlaps[-1] = -numpy.inf
+    neighborhoodOverlaps = paddedOverlaps[neighborhoods]
+    centerOverlaps = overlaps[:, numpy.newaxis]
+
+    numBigger = (neighborhoodOverlaps > centerOverlaps).sum(axis=1)
+    numActive = (0.5 + density * neighborhoodSizes).astype(int)
+
+    # When there is a tie, favor neighbors that are already selected as
+    # active. Columns are selected in order, so only the tied neighbors with a
+    # lower index can have been selected when a column is considered.
+    earlierTies = ((neighborhoodOverlaps == centerOverlaps) &
+                   (neighborhoods < columns[:, numpy.newaxis]))
+    numEarlierTies = earlierTies.sum(axis=1)
+
+    candidates = ((overlaps >= self._stimulusThreshold) &
+                  (numBigger < numActive))
+    activeArray = candidates & (numBigger + numEarlierTies < numActive)
+
+    # The remaining candidates only win if enough of their earlier tied
+    # neighbors lost, so they are decided one by one in column order.
+    for column in numpy.flatnonzero(candidates & ~activeArray):
+      tiedNeighbors = neighborhoods[column][earlierTies[column]]
+      numTiesLost = numpy.count_nonzero(activeArray[tiedNeighbors])
+      if numBigger[column] + numTiesLost < numActive[column]:
+        activeArray[column] = True
+
+    return activeArray.nonzero()[0]
+
+
+  def _getColumnNeighborhood(self, centerColumn):
+    """
+    Gets a neighborhood of columns.
+
+    Simply calls topology.neighborhood or topology.wrappingNeighborhood
+
+    A subclass can insert different topology behavior by overriding this method.
+
+    :param centerColumn (int)
+    The center of the neighborhood.
+
+    @returns (1D numpy array of integers)
+    The columns in the neighborhood.
+    """
+    if self._wrapAround:
+      return topology.wrappingNeighborhood(centerColumn,
+                                           self._inhibitionRadius,
+                                           self._columnDimensions)
+
+    else:
+      return topology.neighborhood(centerColumn,
+                                   self._inhibitionRadius,
+                                   self._columnDimensions)
+
+
+  def _getColumnNeighborhoods(self):
+    """
+    Gets the neighborhoods of all columns, as returned by
+    '_getColumnNeighborhood'. The neighborhoods are cached and only rebuilt
+    when the inhibition radius or the column topology change.
+
+    @returns (tuple) a 2D numpy array whose row i holds the neighborhood of
+             column i, padded with the out-of-range index numColumns, and a 1D
+             numpy array with the size of each neighborhood.
+    """
+    key = (self._inhibitionRadius, self._wrapAround,
+           tuple(self._columnDimensions))
+    if self._columnNeighborhoodsKey != key:
+      neighborhoods = [self._getColumnNeighborhood(column)
+                       for column in xrange(self._numColumns)]
+      sizes = numpy.array([neighborhood.size
+                           for neighborhood in neighborhoods])
+      matrix = numpy.empty((self._numColumns, sizes.max()), dtype=uintType)
+      matrix.fill(self._numColumns)
+      matrix[numpy.arange(sizes.max()) < sizes[:, numpy.newaxis]] = (
+        numpy.concatenate(neighborhoods))
+
+      self._columnNeighborhoods = (matrix, sizes)
+      self._columnNeighborhoodsKey = key
+
+    return self._columnNeighborhoods
+
+
+
+class SpatialPooler(Serializable, _ColumnSelection):
   """
   This class implements the spatial pooler. It is in charge of handling the
   relationships between the columns of a region and the inputs bits. The
@@ -229,6 +669,19 @@ class SpatialPooler(Serializable):
       Determines if inputs at the beginning and end of an input dimension should
       be considered neighbors when mapping columns to inputs. Default ``True``.
 
+  :param compactPermanences: (bool)
+      If true, permanences are stored as 8-bit fixed point values with a step
+      of 1/255 (see :class:`CompactCorticalColumns`), which takes at least 4
+      times less memory than the default sparse float matrix. This changes
+      learning: every permanence is rounded to the nearest multiple of 1/255
+      after each update, so each increment or decrement effectively moves a
+      permanence by a whole number of steps. The defaults of
+      ``synPermActiveInc`` and ``synPermInactiveDec`` become 13 and 2 steps
+      (0.051 and 0.0078), and changes smaller than half a step are rejected
+      since they would never modify a permanence. For the same reason
+      ``synPermConnected`` must be at least 5 steps, as a tenth of it is the
+      increment of columns below ``stimulusThreshold``. Default ``False``.
+
   """
 
   def __init__(self,
@@ -248,7 +701,8 @@ class SpatialPooler(Serializable):
                boostStrength=0.0,
                seed=-1,
                spVerbosity=0,
-               wrapAround=True
+               wrapAround=True,
+               compactPermanences=False
                ):
     if (numActiveColumnsPerInhArea == 0 and
         (localAreaDensity == 0 or localAreaDensity > 0.5)):
@@ -274,6 +728,21 @@ class SpatialPooler(Serializable):
     if boostStrength < 0.0:
       raise InvalidSPParamValueError("boostStrength must be >= 0.0")
 
+    if compactPermanences:
+      minChange = 0.5 / COMPACT_PERMANENCE_STEPS
+      for name, change in (("synPermActiveInc", synPermActiveInc),
+                           ("synPermInactiveDec", synPermInactiveDec)):
+        if 0 < change < minChange:
+          raise InvalidSPParamValueError(
+            "{} ({}) must be 0 or at least {} with compact permanences"
+            .format(name, repr(change), repr(minChange)))
+      # Columns below the stimulus threshold are raised by a tenth of
+      # synPermConnected at a time until enough of their synapses connect
+      if synPermConnected / 10.0 < minChange:
+        raise InvalidSPParamValueError(
+          "synPermConnected ({}) must be at least {} with compact permanences"
+          .format(repr(synPermConnected), repr(10 * minChange)))
+
     self._seed(seed)
 
     self._numInputs = int(numInputs)
@@ -295,11 +764,13 @@ class SpatialPooler(Serializable):
     self._boostStrength = boostStrength
     self._spVerbosity = spVerbosity
     self._wrapAround = wrapAround
+    self._compactPermanences = compactPermanences
     self._synPermMin = 0.0
     self._synPermMax = 1.0
     self._synPermTrimThreshold = synPermActiveInc / 2.0
     self._overlaps = numpy.zeros(self._numColumns, dtype=realDType)
     self._boostedOverlaps = numpy.zeros(self._numColumns, dtype=realDType)
+    self._sparseInputBuffer = numpy.zeros(self._numInputs, dtype=realDType)
 
     if self._synPermTrimThreshold >= self._synPermConnected:
       raise InvalidSPParamValueError(
@@ -335,8 +806,12 @@ class SpatialPooler(Serializable):
     # as an optimization to improve computation time of alforithms that
     # require iterating over the data  structure. This permanence matrix is
     # only allowed to have non-zero elements where the potential pool is
-    # non-zero.
-    self._permanences = CorticalColumns(numColumns, numInputs)
+    # non-zero. With compact permanences, CompactCorticalColumns stores them
+    # as 8-bit values aligned with the potential pools instead.
+    if compactPermanences:
+      self._permanences = CompactCorticalColumns(self._potentialPools)
+    else:
+      self._permanences = CorticalColumns(numColumns, numInputs)
 
     # Initialize a tiny random tie breaker. This is used to determine winning
     # columns where the overlaps are identical.
@@ -382,6 +857,12 @@ class SpatialPooler(Serializable):
     self._inhibitionRadius = 0
     self._updateInhibitionRadius()
 
+    # The neighborhood of every column, stored as a padded index matrix (see
+    # '_getColumnNeighborhoods'). It only depends on the inhibition radius and
+    # the column topology, so it is cached and rebuilt when these change.
+    self._columnNeighborhoods = None
+    self._columnNeighborhoodsKey = None
+
     if self._spVerbosity > 0:
       self.printParameters()
 
@@ -428,6 +909,13 @@ class SpatialPooler(Serializable):
     self._potentialRadius = potentialRadius
 
 
+  def getCompactPermanences(self):
+    """
+    :returns: (bool) whether permanences are stored as 8-bit values.
+    """
+    return self._compactPermanences
+
+
   def getPotentialPct(self):
     """
     :returns: (float) the potential percent
@@ -815,7 +1303,13 @@ class SpatialPooler(Serializable):
       "value of stimulusThreshold that is too large relative " +
       "to the input size.")
 
-    self._potentialPools.replace(columnIndex, potentialSparse)
+    if self._compactPermanences:
+      # Compact permanences are aligned with the potential pool
+      perm = self._permanences[columnIndex]
+      self._potentialPools.replace(columnIndex, potentialSparse)
+      self._permanences.update(columnIndex, perm)
+    else:
+      self._potentialPools.replace(columnIndex, potentialSparse)
 
 
   def getPermanence(self, columnIndex, permanence):
@@ -874,6 +1368,41 @@ class SpatialPooler(Serializable):
     return self._boostedOverlaps
 
 
+  def getMemoryUsage(self):
+    """
+    Estimates the memory used by this spatial pooler, from the sizes of its
+    arrays and the number of non-zeros of its sparse matrices.
+
+    :returns: (dict) Estimated bytes for ``potentialPools``, ``permanences``,
+              ``connectedSynapses``, ``dutyCycles``, ``columnState``
+              (overlaps, boost factors and other per-column arrays),
+              ``neighborhoods`` (the cached column neighborhoods used by
+              local inhibition) and their ``total``.
+    """
+    if isinstance(self._permanences, CompactCorticalColumns):
+      permanences = self._permanences.nbytes()
+    else:
+      permanences = sparseMatrixBytes(self._permanences)
+
+    neighborhoods = 0
+    if self._columnNeighborhoods is not None:
+      neighborhoods = arrayBytes(*self._columnNeighborhoods)
+
+    return withTotal({
+      "potentialPools": sparseMatrixBytes(self._potentialPools, valueBytes=0),
+      "permanences": permanences,
+      "connectedSynapses": sparseMatrixBytes(self._connectedSynapses,
+                                             valueBytes=0),
+      "dutyCycles": arrayBytes(self._overlapDutyCycles,
+                               self._activeDutyCycles,
+                               self._minOverlapDutyCycles),
+      "columnState": arrayBytes(self._overlaps, self._boostedOverlaps,
+                                self._boostFactors, self._connectedCounts,
+                                self._tieBreaker, self._sparseInputBuffer),
+      "neighborhoods": neighborhoods,
+    })
+
+
   def compute(self, inputVector, learn, activeArray):
     """
     This is the primary public method of the SpatialPooler class. This
@@ -934,6 +1463,103 @@ class SpatialPooler(Serializable):
     activeArray[activeColumns] = 1
 
 
+  def computeSparse(self, activeInputs, learn, activeArray):
+    """
+    Variant of :meth:`compute` that takes the indices of the active input bits
+    instead of a dense input vector. The overlaps and the learning updates are
+    computed directly from these indices, which avoids building a dense input
+    vector for every record when the input is sparse.
+
+    :param activeInputs: A sequence with the indices of the input bits that
+        are turned on.
+    :param learn: A boolean value indicating whether learning should be
+        performed. See :meth:`compute`.
+    :param activeArray: An array whose size is equal to the number of columns.
+        Before the function returns this array will be populated with 1's at
+        the indices of the active columns, and 0's everywhere else.
+    """
+    activeInputs = numpy.asarray(activeInputs, dtype=numpy.int64).reshape(-1)
+    if activeInputs.size and (activeInputs.min() < 0 or
+                              activeInputs.max() >= self._numInputs):
+      raise ValueError("Active input indices must be in the range [0, %s)" %
+                       self._numInputs)
+    activeInputs = activeInputs.astype(uintType)
+
+    self._updateBookeepingVars(learn)
+    self._overlaps = self._calculateOverlapSparse(activeInputs)
+
+    # Apply boosting when learning is on
+    if learn:
+      self._boostedOverlaps = self._boostFactors * self._overlaps
+    else:
+      self._boostedOverlaps = self._overlaps
+
+    # Apply inhibition to determine the winning columns
+    activeColumns = self._inhibitColumns(self._boostedOverlaps)
+
+    if learn:
+      self._adaptSynapsesSparse(activeInputs, activeColumns)
+      self._updateDutyCycles(self._overlaps, activeColumns)
+      self._bumpUpWeakColumns()
+      self._updateBoostFactors()
+      if self._isUpdateRound():
+        self._updateInhibitionRadius()
+        self._updateMinDutyCycles()
+
+    activeArray.fill(0)
+    activeArray[activeColumns] = 1
+
+
+  def computeBatch(self, inputMatrix, learn=False):
+    """
+    Computes the active columns for a batch of input vectors. This is
+    equivalent to calling :meth:`compute` once per record, but when learning
+    is off the overlaps of all records are computed in a single sparse
+    product and global inhibition is applied to all records at once.
+
+    :param inputMatrix: Either a numpy array of 0's and 1's with one row per
+        record and one column per input bit, or a list containing, for each
+        record, the indices of its active input bits.
+    :param learn: A boolean value indicating whether learning should be
+        performed. Learning updates the state of the spatial pooler after every
+        record, so when it is enabled the records are fed one by one through
+        :meth:`computeSparse`.
+    :returns: (numpy.ndarray) An array with one row per record and one column
+        per cortical column, populated with 1's at the indices of the active
+        columns and 0's everywhere else.
+    """
+    rowIndices, inputIndices, numRecords = self._getBatchActiveInputs(
+      inputMatrix)
+    activeMatrix = numpy.zeros((numRecords, self._numColumns), dtype=uintType)
+
+    if learn:
+      bounds = numpy.searchsorted(rowIndices, numpy.arange(numRecords + 1))
+      for row in xrange(numRecords):
+        self.computeSparse(inputIndices[bounds[row]:bounds[row + 1]], True,
+                           activeMatrix[row])
+      return activeMatrix
+
+    self._iterationNum += numRecords
+    overlaps = self._calculateOverlapBatch(rowIndices, inputIndices,
+                                           numRecords)
+
+    density = self._getInhibitionDensity()
+    if self._globalInhibition or \
+      self._inhibitionRadius > max(self._columnDimensions):
+      rows, activeColumns = self._inhibitColumnsGlobalBatch(overlaps, density)
+      activeMatrix[rows, activeColumns] = 1
+    else:
+      for row in xrange(numRecords):
+        activeColumns = self._inhibitColumnsLocal(overlaps[row], density)
+        activeMatrix[row, activeColumns] = 1
+
+    if numRecords > 0:
+      self._overlaps = overlaps[-1]
+      self._boostedOverlaps = self._overlaps
+
+    return activeMatrix
+
+
   def stripUnlearnedColumns(self, activeArray):
     """
     Removes the set of columns who have never been active from the set of
@@ -983,14 +1609,12 @@ class SpatialPooler(Serializable):
     _updateMinDutyCyclesGlobal, here the values can be quite different for
     different columns.
     """
-    for column in xrange(self._numColumns):
-      neighborhood = self._getColumnNeighborhood(column)
-
-      maxActiveDuty = self._activeDutyCycles[neighborhood].max()
-      maxOverlapDuty = self._overlapDutyCycles[neighborhood].max()
+    maxOverlapDuty = self._reduceColumnNeighborhoods(self._overlapDutyCycles,
+                                                     numpy.max)
 
-      self._minOverlapDutyCycles[column] = (maxOverlapDuty *
-                                            self._minPctOverlapDutyCycles)
+    # Multiply in double precision, as the per-column scalars used to be
+    self._minOverlapDutyCycles[:] = (maxOverlapDuty.astype(numpy.float64) *
+                                     self._minPctOverlapDutyCycles)
 
 
   def _updateDutyCycles(self, overlaps, activeColumns):
@@ -1164,13 +1788,29 @@ class SpatialPooler(Serializable):
                     survived inhibition.
     """
     inputIndices = numpy.where(inputVector > 0)[0]
-    permChanges = numpy.zeros(self._numInputs, dtype=realDType)
-    permChanges.fill(-1 * self._synPermInactiveDec)
-    permChanges[inputIndices] = self._synPermActiveInc
+    self._adaptSynapsesSparse(inputIndices, activeColumns)
+
+
+  def _adaptSynapsesSparse(self, inputIndices, activeColumns):
+    """
+    Same as '_adaptSynapses', but the input is given as the indices of the
+    input bits that are turned on.
+
+    Parameters:
+    ----------------------------
+    :param inputIndices:
+                    An array containing the indices of the active input bits.
+    :param activeColumns:
+                    An array containing the indices of the columns that
+                    survived inhibition.
+    """
     for columnIndex in activeColumns:
       perm = self._permanences[columnIndex]
-      maskPotential = numpy.where(self._potentialPools[columnIndex] > 0)[0]
-      perm[maskPotential] += permChanges[maskPotential]
+      maskPotential = self._potentialPools[columnIndex] > 0
+      activePotential = inputIndices[maskPotential[inputIndices]]
+      maskPotential[inputIndices] = False
+      perm[maskPotential] -= self._synPermInactiveDec
+      perm[activePotential] += self._synPermActiveInc
       self._updatePermanencesForColumn(perm, columnIndex, raisePerm=True)
 
 
@@ -1184,7 +1824,10 @@ class SpatialPooler(Serializable):
     weakColumns = numpy.where(self._overlapDutyCycles
                                 < self._minOverlapDutyCycles)[0]
     for columnIndex in weakColumns:
-      perm = self._permanences[columnIndex].astype(realDType)
+      # Compact permanences are already returned as a new realDType array
+      perm = self._permanences[columnIndex]
+      if not self._compactPermanences:
+        perm = perm.astype(realDType)
       maskPotential = numpy.where(self._potentialPools[columnIndex] > 0)[0]
       perm[maskPotential] += self._synPermBelowStimulusInc
       self._updatePermanencesForColumn(perm, columnIndex, raisePerm=False)
@@ -1216,6 +1859,9 @@ class SpatialPooler(Serializable):
 
     numpy.clip(perm, self._synPermMin, self._synPermMax, out=perm)
     while True:
+      if self._compactPermanences:
+        # Count the connections that remain once the permanences are stored
+        CompactCorticalColumns.quantize(perm)
       numConnected = numpy.nonzero(
         perm > self._synPermConnected - PERMANENCE_EPSILON)[0].size
 
@@ -1254,6 +1900,10 @@ class SpatialPooler(Serializable):
     maskPotential = numpy.where(self._potentialPools[columnIndex] > 0)[0]
     if raisePerm:
       self._raisePermanenceToThreshold(perm, maskPotential)
+    if self._compactPermanences:
+      # Trim and connect the values as they will be stored
+      perm = numpy.array(perm, dtype=realDType)
+      CompactCorticalColumns.quantize(perm)
     perm[perm < self._synPermTrimThreshold] = 0
     numpy.clip(perm, self._synPermMin, self._synPermMax, out=perm)
     newConnected = numpy.where(perm >=
@@ -1500,10 +2150,8 @@ class SpatialPooler(Serializable):
     # Determine the target activation level for each column
     # The targetDensity is the average activeDutyCycles of the neighboring
     # columns of each column.
-    targetDensity = numpy.zeros(self._numColumns, dtype=realDType)
-    for i in xrange(self._numColumns):
-      maskNeighbors = self._getColumnNeighborhood(i)
-      targetDensity[i] = numpy.mean(self._activeDutyCycles[maskNeighbors])
+    targetDensity = self._reduceColumnNeighborhoods(
+      self._activeDutyCycles, numpy.mean).astype(realDType)
 
     self._boostFactors = numpy.exp(
       (targetDensity - self._activeDutyCycles) * self._boostStrength)
@@ -1545,116 +2193,51 @@ class SpatialPooler(Serializable):
     return overlaps
 
 
-  def _calculateOverlapPct(self, overlaps):
-    return overlaps.astype(realDType) / self._connectedCounts
-
-
-  def _inhibitColumns(self, overlaps):
+  def _calculateOverlapSparse(self, activeInputs):
     """
-    Performs inhibition. This method calculates the necessary values needed to
-    actually perform inhibition and then delegates the task of picking the
-    active columns to helper functions.
+    Same as '_calculateOverlap', but the input is given as the indices
+    of the input bits that are turned on. The active bits are written into a
+    preallocated input buffer, which is cleared again afterwards, so that no
+    dense input vector has to be built for every record.
 
     Parameters:
     ----------------------------
-    :param overlaps: an array containing the overlap score for each  column.
-                    The overlap score for a column is defined as the number
-                    of synapses in a "connected state" (connected synapses)
-                    that are connected to input bits which are turned on.
+    :param activeInputs: a numpy array with the indices of the active input
+                    bits.
     """
-    # determine how many columns should be selected in the inhibition phase.
-    # This can be specified by either setting the 'numActiveColumnsPerInhArea'
-    # parameter or the 'localAreaDensity' parameter when initializing the class
-    if (self._localAreaDensity > 0):
-      density = self._localAreaDensity
-    else:
-      inhibitionArea = ((2*self._inhibitionRadius + 1)
-                                    ** self._columnDimensions.size)
-      inhibitionArea = min(self._numColumns, inhibitionArea)
-      density = float(self._numActiveColumnsPerInhArea) / inhibitionArea
-      density = min(density, 0.5)
-
-    if self._globalInhibition or \
-      self._inhibitionRadius > max(self._columnDimensions):
-      return self._inhibitColumnsGlobal(overlaps, density)
-    else:
-      return self._inhibitColumnsLocal(overlaps, density)
+    overlaps = numpy.zeros(self._numColumns, dtype=realDType)
+    self._sparseInputBuffer[activeInputs] = 1
+    try:
+      self._connectedSynapses.rightVecSumAtNZ_fast(self._sparseInputBuffer,
+                                                   overlaps)
+    finally:
+      self._sparseInputBuffer[activeInputs] = 0
+    return overlaps
 
 
-  def _inhibitColumnsGlobal(self, overlaps, density):
+  def _getConnectedColumnsByInput(self):
     """
-    Perform global inhibition. Performing global inhibition entails picking the
-    top 'numActive' columns with the highest overlap score in the entire
-    region. At most half of the columns in a local neighborhood are allowed to
-    be active. Columns with an overlap score below the 'stimulusThreshold' are
-    always inhibited.
+    Builds an index from each input bit to the columns connected to it, i.e.
+    the transpose of 'self._connectedSynapses' in compressed sparse form.
 
-    :param overlaps: an array containing the overlap score for each  column.
-                    The overlap score for a column is defined as the number
-                    of synapses in a "connected state" (connected synapses)
-                    that are connected to input bits which are turned on.
-    :param density: The fraction of columns to survive inhibition.
-    @return list with indices of the winning columns
+    @returns (tuple) 'offsets' and 'columns' arrays, such that the columns
+             connected to input bit i are columns[offsets[i]:offsets[i+1]].
     """
-    #calculate num active per inhibition area
-    numActive = int(density * self._numColumns)
-
-    # Calculate winners using stable sort algorithm (mergesort)
-    # for compatibility with C++
-    sortedWinnerIndices = numpy.argsort(overlaps, kind='mergesort')
-
-    # Enforce the stimulus threshold
-    start = len(sortedWinnerIndices) - numActive
-    while start < len(sortedWinnerIndices):
-      i = sortedWinnerIndices[start]
-      if overlaps[i] >= self._stimulusThreshold:
-        break
-      else:
-        start += 1
+    counts = self._connectedSynapses.nNonZerosPerRow().astype(numpy.int64)
+    connectedInputs = numpy.concatenate(
+      [self._connectedSynapses.getRowSparse(columnIndex)
+       for columnIndex in xrange(self._numColumns)]).astype(numpy.int64)
+    connectedColumns = numpy.repeat(numpy.arange(self._numColumns), counts)
 
-    return sortedWinnerIndices[start:][::-1]
+    order = numpy.argsort(connectedInputs, kind="mergesort")
+    offsets = numpy.zeros(self._numInputs + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(connectedInputs, minlength=self._numInputs),
+                 out=offsets[1:])
+    return offsets, connectedColumns[order]
 
 
-  def _inhibitColumnsLocal(self, overlaps, density):
-    """
-    Performs local inhibition. Local inhibition is performed on a column by
-    column basis. Each column observes the overlaps of its neighbors and is
-    selected if its overlap score is within the top 'numActive' in its local
-    neighborhood. At most half of the columns in a local neighborhood are
-    allowed to be active. Columns with an overlap score below the
-    'stimulusThreshold' are always inhibited.
-
-    :param overlaps: an array containing the overlap score for each  column.
-                    The overlap score for a column is defined as the number
-                    of synapses in a "connected state" (connected synapses)
-                    that are connected to input bits which are turned on.
-    :param density: The fraction of columns to survive inhibition. This
-                    value is only an intended target. Since the surviving
-                    columns are picked in a local fashion, the exact fraction
-                    of surviving columns is likely to vary.
-    @return list with indices of the winning columns
-    """
-
-    activeArray = numpy.zeros(self._numColumns, dtype="bool")
-
-    for column, overlap in enumerate(overlaps):
-      if overlap >= self._stimulusThreshold:
-        neighborhood = self._getColumnNeighborhood(column)
-        neighborhoodOverlaps = overlaps[neighborhood]
-
-        numBigger = numpy.count_nonzero(neighborhoodOverlaps > overlap)
-
-        # When there is a tie, favor neighbors that are already selected as
-        # active.
-        ties = numpy.where(neighborhoodOverlaps == overlap)
-        tiedNeighbors = neighborhood[ties]
-        numTiesLost = numpy.count_nonzero(activeArray[tiedNeighbors])
-
-        numActive = int(0.5 + density * len(neighborhood))
-        if numBigger + numTiesLost < numActive:
-          activeArray[column] = True
-
-    return activeArray.nonzero()[0]
+  def _calculateOverlapPct(self, overlaps):
+    return overlaps.astype(realDType) / self._connectedCounts
 
 
   def _isUpdateRound(self):
@@ -1665,30 +2248,26 @@ class SpatialPooler(Serializable):
     return (self._iterationNum % self._updatePeriod) == 0
 
 
-  def _getColumnNeighborhood(self, centerColumn):
+  def _reduceColumnNeighborhoods(self, values, reduction):
     """
-    Gets a neighborhood of columns.
-
-    Simply calls topology.neighborhood or topology.wrappingNeighborhood
+    Applies a reduction to the values of every column's neighborhood.
+    Neighborhoods of the same size are reduced together along the rows of a
+    matrix, each one in the order given by '_getColumnNeighborhood', so the
+    result is identical to reducing each neighborhood on its own.
 
-    A subclass can insert different topology behavior by overriding this method.
+    :param values: (numpy array) a value for each column.
+    :param reduction: a numpy reduction accepting an 'axis' argument, such as
+                      numpy.max or numpy.mean.
 
-    :param centerColumn (int)
-    The center of the neighborhood.
-
-    @returns (1D numpy array of integers)
-    The columns in the neighborhood.
+    @returns (numpy array) the reduced value for each column.
     """
-    if self._wrapAround:
-      return topology.wrappingNeighborhood(centerColumn,
-                                           self._inhibitionRadius,
-                                           self._columnDimensions)
-
-    else:
-      return topology.neighborhood(centerColumn,
-                                   self._inhibitionRadius,
-                                   self._columnDimensions)
-
+    neighborhoods, sizes = self._getColumnNeighborhoods()
+    result = numpy.empty(self._numColumns, dtype=values.dtype)
+    for size in numpy.unique(sizes):
+      columns = numpy.flatnonzero(sizes == size)
+      result[columns] = reduction(values[neighborhoods[columns, :size]],
+                                  axis=1)
+    return result
 
 
   def _getInputNeighborhood(self, centerInput):
@@ -1739,11 +2318,31 @@ class SpatialPooler(Serializable):
       state['_overlaps'] = numpy.zeros(self._numColumns, dtype=realDType)
       state['_boostedOverlaps'] = numpy.zeros(self._numColumns, dtype=realDType)
 
+    if state['_version'] < 4:
+      # the cached column neighborhoods, the sparse input buffer and compact
+      # permanences were added in version 4
+      state['_compactPermanences'] = False
+      state['_columnNeighborhoods'] = None
+      state['_columnNeighborhoodsKey'] = None
+      state['_sparseInputBuffer'] = numpy.zeros(state['_numInputs'],
+                                                dtype=realDType)
+
     # update version property to current SP version
     state['_version'] = VERSION
     self.__dict__.update(state)
 
 
+  def __getstate__(self):
+    """
+    Return serializable state, leaving out the cached column neighborhoods,
+    which are rebuilt on demand.
+    """
+    state = self.__dict__.copy()
+    state['_columnNeighborhoods'] = None
+    state['_columnNeighborhoodsKey'] = None
+    return state
+
+
   @classmethod
   def getSchema(cls):
     return SpatialPoolerProto
@@ -1813,7 +2412,21 @@ class SpatialPooler(Serializable):
 
 
   @classmethod
-  def read(cls, proto):
+  def read(cls, proto, compactPermanences=False):
+    """
+    Reads a SpatialPooler from a SpatialPoolerProto.
+
+    Permanences are always serialized at full precision in the standard
+    SparseMatrixProto format, and SpatialPoolerProto has no field for the
+    storage mode, so it is chosen when reading. Readers that only pass the
+    proto, such as :meth:`readFromFile`, get the default float storage even if
+    the written instance used compact permanences. :class:`SPRegion` stores
+    the mode in its own proto and passes it here.
+
+    :param proto: (SpatialPoolerProto) the proto to read from.
+    :param compactPermanences: (bool) whether to store the permanences as
+           8-bit values. See the SpatialPooler constructor.
+    """
     numInputs = int(proto.numInputs)
     numColumns = int(proto.numColumns)
 
@@ -1840,6 +2453,7 @@ class SpatialPooler(Serializable):
     instance._dutyCyclePeriod = proto.dutyCyclePeriod
     instance._boostStrength = proto.boostStrength
     instance._wrapAround = proto.wrapAround
+    instance._compactPermanences = compactPermanences
     instance._spVerbosity = proto.spVerbosity
 
     instance._synPermMin = proto.synPermMin
@@ -1849,9 +2463,13 @@ class SpatialPooler(Serializable):
     # TODO: These two overlaps attributes aren't currently saved.
     instance._overlaps = numpy.zeros(numColumns, dtype=realDType)
     instance._boostedOverlaps = numpy.zeros(numColumns, dtype=realDType)
+    instance._sparseInputBuffer = numpy.zeros(numInputs, dtype=realDType)
 
     instance._updatePeriod = proto.updatePeriod
 
+    instance._columnNeighborhoods = None
+    instance._columnNeighborhoodsKey = None
+
     instance._version = VERSION
     instance._iterationNum = proto.iterationNum
     instance._iterationLearnNum = proto.iterationLearnNum
@@ -1860,7 +2478,10 @@ class SpatialPooler(Serializable):
     instance._potentialPools.resize(numColumns, numInputs)
     instance._potentialPools.read(proto.potentialPools)
 
-    instance._permanences = CorticalColumns(numColumns, numInputs)
+    if compactPermanences:
+      instance._permanences = CompactCorticalColumns(instance._potentialPools)
+    else:
+      instance._permanences = CorticalColumns(numColumns, numInputs)
     instance._permanences.read(proto.permanences)
     # Initialize ephemerals and make sure they get updated
     instance._connectedCounts = numpy.zeros(numColumns, dtype=realDType)
@@ -1884,6 +2505,46 @@ class SpatialPooler(Serializable):
     return instance
 
 
+  def writeSnapshot(self, path):
+    """
+    Compiles the spatial pooler into a read-only inference snapshot, which can
+    be loaded with :class:`SpatialPoolerSnapshot`. The snapshot only contains
+    the connected synapses, indexed by input bit, and the parameters needed
+    for inhibition, so that it is much smaller than the full learning state.
+
+    The file starts with SNAPSHOT_MAGIC and the length of a JSON header with
+    the parameters. The header is padded to a multiple of 64 bytes and
+    followed by two little-endian arrays: the offsets of each input bit's
+    synapses ('numInputs' + 1 int64 values) and the columns each input bit is
+    connected to ('numConnected' uint32 values).
+
+    :param path: (string) the path of the file to write.
+    """
+    inputOffsets, connectedColumns = self._getConnectedColumnsByInput()
+    header = json.dumps({
+      "version": SNAPSHOT_VERSION,
+      "numInputs": self._numInputs,
+      "numColumns": self._numColumns,
+      "numConnected": int(connectedColumns.size),
+      "columnDimensions": [int(dim) for dim in self._columnDimensions],
+      "inhibitionRadius": int(self._inhibitionRadius),
+      "globalInhibition": bool(self._globalInhibition),
+      "localAreaDensity": float(self._localAreaDensity),
+      "numActiveColumnsPerInhArea": int(self._numActiveColumnsPerInhArea),
+      "stimulusThreshold": float(self._stimulusThreshold),
+      "wrapAround": bool(self._wrapAround),
+    })
+    headerSize = len(SNAPSHOT_MAGIC) + 8 + len(header)
+    header += " " * (-headerSize % 64)
+
+    with open(path, "wb") as f:
+      f.write(SNAPSHOT_MAGIC)
+      f.write(numpy.array([len(header)], dtype="<u8").tostring())
+      f.write(header)
+      f.write(inputOffsets.astype("<i8").tostring())
+      f.write(connectedColumns.astype("<u4").tostring())
+
+
   def printParameters(self):
     """
     Useful for debugging.
@@ -1905,3 +2566,155 @@ class SpatialPooler(Serializable):
     print "boostStrength              = ", self.getBoostStrength()
     print "spVerbosity                = ", self.getSpVerbosity()
     print "version                    = ", self._version
+
+
+
+class SpatialPoolerSnapshot(_ColumnSelection):
+  """
+  Read-only inference snapshot of a trained spatial pooler, written by
+  :meth:`SpatialPooler.writeSnapshot`. The connected synapses are memory
+  mapped from the snapshot file, so processes that load the same snapshot
+  share them through the page cache.
+
+  The active columns are bit-exact with those of the original spatial pooler
+  when computed with learning off. The inhibition methods are shared with
+  :class:`SpatialPooler` to guarantee it, which means that a snapshot always
+  uses the default column topology.
+
+  .. code-block:: python
+
+     sp.writeSnapshot("sp.snapshot")
+     ...
+     snapshot = SpatialPoolerSnapshot("sp.snapshot")
+     snapshot.compute(inputVector, False, activeArray)
+
+  :param path: (string) the path of a file written by
+      :meth:`SpatialPooler.writeSnapshot`.
+  """
+
+  def __init__(self, path):
+    with open(path, "rb") as f:
+      magic = f.read(len(SNAPSHOT_MAGIC))
+      if magic != SNAPSHOT_MAGIC:
+        raise ValueError("%s is not a spatial pooler snapshot" % path)
+      headerSize = int(numpy.fromstring(f.read(8), dtype="<u8")[0])
+      header = json.loads(f.read(headerSize))
+
+    if header["version"] != SNAPSHOT_VERSION:
+      raise ValueError("Unsupported spatial pooler snapshot version %s" %
+                       header["version"])
+
+    self._numInputs = header["numInputs"]
+    self._numColumns = header["numColumns"]
+    self._columnDimensions = numpy.array(header["columnDimensions"])
+    self._inhibitionRadius = header["inhibitionRadius"]
+    self._globalInhibition = header["globalInhibition"]
+    self._localAreaDensity = header["localAreaDensity"]
+    self._numActiveColumnsPerInhArea = header["numActiveColumnsPerInhArea"]
+    self._stimulusThreshold = header["stimulusThreshold"]
+    self._wrapAround = header["wrapAround"]
+    self._columnNeighborhoods = None
+    self._columnNeighborhoodsKey = None
+
+    offset = len(SNAPSHOT_MAGIC) + 8 + headerSize
+    self._inputOffsets = numpy.memmap(path, dtype="<i8", mode="r",
+                                      offset=offset,
+                                      shape=(self._numInputs + 1,))
+    offset += self._inputOffsets.nbytes
+    self._connectedColumns = numpy.memmap(path, dtype="<u4", mode="r",
+                                          offset=offset,
+                                          shape=(header["numConnected"],))
+
+
+  def getNumColumns(self):
+    """
+    :returns: (int) the total number of columns
+    """
+    return self._numColumns
+
+
+  def getNumInputs(self):
+    """
+    :returns: (int) the total number of inputs.
+    """
+    return self._numInputs
+
+
+  def compute(self, inputVector, learn, activeArray):
+    """
+    Same as :meth:`SpatialPooler.compute` with learning off.
+
+    :param inputVector: A numpy array of 0's and 1's that comprises the input
+        to the spatial pooler.
+    :param learn: Must be False, since a snapshot cannot learn.
+    :param activeArray: An array whose size is equal to the number of columns.
+        Before the function returns this array will be populated with 1's at
+        the indices of the active columns, and 0's everywhere else.
+    """
+    if not isinstance(inputVector, numpy.ndarray):
+      raise TypeError("Input vector must be a numpy array, not %s" %
+                      str(type(inputVector)))
+
+    if inputVector.size != self._numInputs:
+      raise ValueError(
+          "Input vector dimensions don't match. Expecting %s but got %s" % (
+              inputVector.size, self._numInputs))
+
+    self.computeSparse(numpy.flatnonzero(inputVector), learn, activeArray)
+
+
+  def computeSparse(self, activeInputs, learn, activeArray):
+    """
+    Same as :meth:`SpatialPooler.computeSparse` with learning off.
+
+    :param activeInputs: A sequence with the indices of the input bits that
+        are turned on.
+    :param learn: Must be False, since a snapshot cannot learn.
+    :param activeArray: An array whose size is equal to the number of columns.
+    """
+    if learn:
+      raise ValueError("A spatial pooler snapshot cannot learn")
+
+    activeArray[:] = self.computeBatch([activeInputs])[0]
+
+
+  def computeBatch(self, inputMatrix, learn=False):
+    """
+    Same as :meth:`SpatialPooler.computeBatch` with learning off.
+
+    :param inputMatrix: Either a numpy array of 0's and 1's with one row per
+        record, or a list containing the indices of the active input bits of
+        each record.
+    :param learn: Must be False, since a snapshot cannot learn.
+    :returns: (numpy.ndarray) An array with one row per record and one column
+        per cortical column, populated with 1's at the active columns.
+    """
+    if learn:
+      raise ValueError("A spatial pooler snapshot cannot learn")
+
+    rowIndices, inputIndices, numRecords = self._getBatchActiveInputs(
+      inputMatrix)
+    overlaps = self._calculateOverlapBatch(rowIndices, inputIndices,
+                                           numRecords)
+
+    activeMatrix = numpy.zeros((numRecords, self._numColumns), dtype=uintType)
+    density = self._getInhibitionDensity()
+    if self._globalInhibition or \
+      self._inhibitionRadius > max(self._columnDimensions):
+      rows, activeColumns = self._inhibitColumnsGlobalBatch(overlaps, density)
+      activeMatrix[rows, activeColumns] = 1
+    else:
+      for row in xrange(numRecords):
+        activeColumns = self._inhibitColumnsLocal(overlaps[row], density)
+        activeMatrix[row, activeColumns] = 1
+
+    return activeMatrix
+
+
+  def _getConnectedColumnsByInput(self):
+    """
+    @returns (tuple) the memory mapped 'offsets' and 'columns' arrays, such
+             that the columns connected to input bit i are
+             columns[offsets[i]:offsets[i+1]].
+    """
+    return self._inputOffsets, self._connectedColumns
@@ -25,12 +25,14 @@ Temporal Memory implementation in Python. See
 """
 
 from collections import defaultdict
+import numpy
 from nupic.bindings.math import Random
 from operator import mul
 
-from nupic.algorithms.connections import Connections, binSearch
+from nupic.algorithms.connections import (ArrayConnections, Connections,
+                                          binSearch)
 from nupic.serializable import Serializable
-from nupic.support.group_by import groupby2
+from nupic.support.memory_usage import INT_BYTES, listBytes, withTotal
 
 EPSILON = 0.00001 # constant error threshold to check equality of permanences to
                   # other floats
@@ -88,6 +90,11 @@ class TemporalMemory(Serializable):
   :param maxSynapsesPerSegment: (int) The maximum number of synapses per 
          segment. Default value ``255``.
 
+  :param compactionThreshold: (float) If set, :meth:`compact` is called during
+         learning whenever the connections'
+         :meth:`~nupic.algorithms.connections.Connections.fragmentation`
+         exceeds this value. Default value ``None``.
+
   """
 
   def __init__(self,
@@ -104,6 +111,7 @@ class TemporalMemory(Serializable):
                maxSegmentsPerCell=255,
                maxSynapsesPerSegment=255,
                seed=42,
+               compactionThreshold=None,
                **kwargs):
     # Error checking
     if not len(columnDimensions):
@@ -131,6 +139,7 @@ class TemporalMemory(Serializable):
     self.predictedSegmentDecrement = predictedSegmentDecrement
     self.maxSegmentsPerCell = maxSegmentsPerCell
     self.maxSynapsesPerSegment = maxSynapsesPerSegment
+    self.compactionThreshold = compactionThreshold
 
     # Initialize member variables
     self.connections = self.connectionsFactory(self.numberOfCells())
@@ -140,12 +149,19 @@ class TemporalMemory(Serializable):
     self.activeSegments = []
     self.matchingSegments = []
 
-    self.numActiveConnectedSynapsesForSegment = []
-    self.numActivePotentialSynapsesForSegment = []
+    # Active synapse counts per segment, indexed by the segment's flatIdx. Both
+    # are numpy integer arrays, replaced on every call to activateDendrites.
+    self.numActiveConnectedSynapsesForSegment = numpy.zeros(0, dtype=int)
+    self.numActivePotentialSynapsesForSegment = numpy.zeros(0, dtype=int)
 
     self.iteration = 0
     self.lastUsedIterationForSegment = []
 
+    # Columns of the active and matching segments, as computed by
+    # activateDendrites, paired with the segment list they belong to.
+    self._activeSegmentColumns = None
+    self._matchingSegmentColumns = None
+
 
 
   @staticmethod
@@ -158,7 +174,9 @@ class TemporalMemory(Serializable):
     :class:`~nupic.algorithms.connections.Connections` implementation.
 
     See :class:`~nupic.algorithms.connections.Connections` for constructor 
-    signature and usage.
+    signature and usage. For large networks, returning an
+    :class:`~nupic.algorithms.connections.ArrayConnections` instance here
+    stores segments and synapses in numpy arrays instead of Python objects.
 
     :returns: :class:`~nupic.algorithms.connections.Connections` instance
     """
@@ -213,17 +231,37 @@ class TemporalMemory(Serializable):
     self.activeCells = []
     self.winnerCells = []
 
-    segToCol = lambda segment: int(segment.cell / self.cellsPerColumn)
-    identity = lambda x: x
-
-    for columnData in groupby2(activeColumns, identity,
-                               self.activeSegments, segToCol,
-                               self.matchingSegments, segToCol):
-      (column,
-       activeColumns,
-       columnActiveSegments,
-       columnMatchingSegments) = columnData
-      if activeColumns is not None:
+    activeSegmentColumns = self._columnsForSegments(
+      self.activeSegments, self._activeSegmentColumns)
+    matchingSegmentColumns = self._columnsForSegments(
+      self.matchingSegments, self._matchingSegmentColumns)
+
+    # Inactive columns are only visited to punish their segments.
+    activeColumns = numpy.asarray(activeColumns, dtype="int64")
+    if learn:
+      columns = reduce(numpy.union1d, (activeColumns, activeSegmentColumns,
+                                       matchingSegmentColumns))
+    else:
+      columns = numpy.unique(activeColumns)
+
+    # Each column's segments are a contiguous slice of the sorted lists.
+    columnData = zip(
+      columns.tolist(),
+      numpy.in1d(columns, activeColumns).tolist(),
+      numpy.searchsorted(activeSegmentColumns, columns, "left").tolist(),
+      numpy.searchsorted(activeSegmentColumns, columns, "right").tolist(),
+      numpy.searchsorted(matchingSegmentColumns, columns, "left").tolist(),
+      numpy.searchsorted(matchingSegmentColumns, columns, "right").tolist())
+
+    for (column, isActive, activeStart, activeEnd,
+         matchingStart, matchingEnd) in columnData:
+      columnActiveSegments = (self.activeSegments[activeStart:activeEnd]
+                              if activeEnd > activeStart else None)
+      columnMatchingSegments = (
+        self.matchingSegments[matchingStart:matchingEnd]
+        if matchingEnd > matchingStart else None)
+
+      if isActive:
         if columnActiveSegments is not None:
           cellsToAdd = self.activatePredictedColumn(column,
                                                     columnActiveSegments,
@@ -245,12 +283,11 @@ class TemporalMemory(Serializable):
           self.activeCells += cellsToAdd
           self.winnerCells.append(winnerCell)
       else:
-        if learn:
-          self.punishPredictedColumn(column,
-                                     columnActiveSegments,
-                                     columnMatchingSegments,
-                                     prevActiveCells,
-                                     prevWinnerCells)
+        self.punishPredictedColumn(column,
+                                   columnActiveSegments,
+                                   columnMatchingSegments,
+                                   prevActiveCells,
+                                   prevWinnerCells)
 
 
   def activateDendrites(self, learn=True):
@@ -273,23 +310,32 @@ class TemporalMemory(Serializable):
      numActivePotential) = self.connections.computeActivity(
        self.activeCells,
        self.connectedPermanence)
+    numActiveConnected = numpy.asarray(numActiveConnected, dtype=int)
+    numActivePotential = numpy.asarray(numActivePotential, dtype=int)
+
+    activeFlatIdxs = numpy.flatnonzero(
+      numActiveConnected >= self.activationThreshold)
+    matchingFlatIdxs = numpy.flatnonzero(
+      numActivePotential >= self.minThreshold)
+
+    activeFlatIdxs = self.connections.sortSegmentFlatIdxs(activeFlatIdxs)
+    matchingFlatIdxs = self.connections.sortSegmentFlatIdxs(matchingFlatIdxs)
+
+    segmentForFlatIdx = self.connections.segmentForFlatIdx
+    self.activeSegments = [segmentForFlatIdx(i)
+                           for i in activeFlatIdxs.tolist()]
+    self.matchingSegments = [segmentForFlatIdx(i)
+                             for i in matchingFlatIdxs.tolist()]
+
+    self._activeSegmentColumns = (
+      self.activeSegments,
+      self.connections.cellsForSegmentFlatIdxs(activeFlatIdxs) //
+      self.cellsPerColumn)
+    self._matchingSegmentColumns = (
+      self.matchingSegments,
+      self.connections.cellsForSegmentFlatIdxs(matchingFlatIdxs) //
+      self.cellsPerColumn)
 
-    activeSegments = (
-      self.connections.segmentForFlatIdx(i)
-      for i in xrange(len(numActiveConnected))
-      if numActiveConnected[i] >= self.activationThreshold
-    )
-
-    matchingSegments = (
-      self.connections.segmentForFlatIdx(i)
-      for i in xrange(len(numActivePotential))
-      if numActivePotential[i] >= self.minThreshold
-    )
-
-    self.activeSegments = sorted(activeSegments,
-                                 key=self.connections.segmentPositionSortKey)
-    self.matchingSegments = sorted(matchingSegments,
-                                   key=self.connections.segmentPositionSortKey)
     self.numActiveConnectedSynapsesForSegment = numActiveConnected
     self.numActivePotentialSynapsesForSegment = numActivePotential
 
@@ -298,6 +344,48 @@ class TemporalMemory(Serializable):
         self.lastUsedIterationForSegment[segment.flatIdx] = self.iteration
       self.iteration += 1
 
+      if (self.compactionThreshold is not None and
+          self.connections.fragmentation() > self.compactionThreshold):
+        self.compact()
+
+
+  def compact(self):
+    """
+    Renumbers segments densely via
+    :meth:`~nupic.algorithms.connections.Connections.compact`, releasing the
+    flat indices freed by destroyed segments, and remaps the per-segment
+    state of this :class:`TemporalMemory` to match.
+    """
+    newFlatIdxs = self.connections.compact()
+    numSegments = self.connections.segmentFlatListLength()
+
+    self.lastUsedIterationForSegment = self._remapFlatIdxValues(
+      self.lastUsedIterationForSegment, newFlatIdxs, numSegments).tolist()
+    self.numActiveConnectedSynapsesForSegment = self._remapFlatIdxValues(
+      self.numActiveConnectedSynapsesForSegment, newFlatIdxs, numSegments)
+    self.numActivePotentialSynapsesForSegment = self._remapFlatIdxValues(
+      self.numActivePotentialSynapsesForSegment, newFlatIdxs, numSegments)
+
+
+  @staticmethod
+  def _remapFlatIdxValues(values, newFlatIdxs, numSegments):
+    """
+    Moves per-segment values to new flat indices.
+
+    :param values: (list) Values indexed by old flatIdx. May be shorter than
+           ``newFlatIdxs`` if segments were created after it was computed.
+    :param newFlatIdxs: (numpy.ndarray) New flatIdx for each old flatIdx, or
+           -1 for unused flat indices.
+    :param numSegments: (int) Number of segments after compacting.
+    :returns: (numpy.ndarray) Values indexed by new flatIdx.
+    """
+    values = numpy.asarray(values)
+    remapped = numpy.zeros(numSegments, dtype=values.dtype)
+    newFlatIdxs = newFlatIdxs[:len(values)]
+    live = newFlatIdxs >= 0
+    remapped[newFlatIdxs[live]] = values[:len(newFlatIdxs)][live]
+    return remapped
+
 
   def reset(self):
     """
@@ -308,6 +396,8 @@ class TemporalMemory(Serializable):
     self.winnerCells = []
     self.activeSegments = []
     self.matchingSegments = []
+    self._activeSegmentColumns = None
+    self._matchingSegmentColumns = None
 
 
   # ==============================
@@ -459,7 +549,7 @@ class TemporalMemory(Serializable):
     :param prevWinnerCells: (list)
     Winner cells in `t-1`.
 
-    :param numActivePotentialSynapsesForSegment: (list)
+    :param numActivePotentialSynapsesForSegment: (numpy.ndarray)
     Number of active potential synapses per segment, indexed by the segment's
     flatIdx.
 
@@ -551,7 +641,7 @@ class TemporalMemory(Serializable):
     :param cellsForColumn: (sequence)
     Range of cell indices on which to operate.
 
-    :param numActivePotentialSynapsesForSegment: (list)
+    :param numActivePotentialSynapsesForSegment: (numpy.ndarray)
     Number of active potential synapses per segment, indexed by the segment's
     flatIdx.
 
@@ -691,6 +781,10 @@ class TemporalMemory(Serializable):
     Destroy nDestroy synapses on the specified segment, but don't destroy
     synapses to the "excludeCells".
     """
+    if isinstance(connections, ArrayConnections):
+      if cls._destroyMinPermanenceSynapsesArrays(connections, segment,
+                                                 nDestroy, excludeCells):
+        return
 
     destroyCandidates = sorted(
       (synapse for synapse in connections.synapsesForSegment(segment)
@@ -714,6 +808,49 @@ class TemporalMemory(Serializable):
       destroyCandidates.remove(minSynapse)
 
 
+  @classmethod
+  def _destroyMinPermanenceSynapsesArrays(cls, connections, segment, nDestroy,
+                                          excludeCells):
+    """
+    Vectorized :meth:`_destroyMinPermanenceSynapses` for
+    :class:`~nupic.algorithms.connections.ArrayConnections`.
+
+    The scalar version repeatedly scans the candidates in creation order and
+    takes the first one whose permanence is more than EPSILON below the
+    lowest seen so far. When the distinct permanences fall into tight groups
+    (narrower than EPSILON / 2) that are more than 2 * EPSILON apart, that
+    scan always picks the oldest synapse of the lowest group, so a single sort
+    by (group, ordinal) yields the same synapses. Otherwise nothing is
+    destroyed and False is returned, so that the caller runs the scan.
+
+    :returns: (bool) True if the synapses were destroyed.
+    """
+    idxs = connections.synapseIndicesForSegment(segment)
+    presynapticCells, permanences, ordinals = connections.synapseData(idxs)
+
+    candidates = ~numpy.in1d(presynapticCells, excludeCells)
+    idxs = idxs[candidates]
+    permanences = permanences[candidates]
+    ordinals = ordinals[candidates]
+
+    if nDestroy <= 0 or len(idxs) == 0:
+      return True
+
+    values = numpy.unique(permanences)
+    groupIds = numpy.concatenate(
+      ([0], numpy.cumsum(numpy.diff(values) > 2 * EPSILON)))
+    groupStarts = numpy.flatnonzero(
+      numpy.r_[True, groupIds[1:] != groupIds[:-1]])
+    groupEnds = numpy.r_[groupStarts[1:], len(values)] - 1
+    if (values[groupEnds] - values[groupStarts] >= EPSILON / 2).any():
+      return False
+
+    groups = groupIds[numpy.searchsorted(values, permanences)]
+    order = numpy.lexsort((ordinals, groups))
+    connections.destroySynapses(idxs[order[:nDestroy]])
+    return True
+
+
   @classmethod
   def _leastUsedCell(cls, random, cells, connections):
     """
@@ -764,12 +901,19 @@ class TemporalMemory(Serializable):
     :param initialPermanence:  (float)  Initial permanence of a new synapse.
 
     """
-    candidates = list(prevWinnerCells)
+    if isinstance(connections, ArrayConnections):
+      presynapticCells, _, _ = connections.synapseData(
+        connections.synapseIndicesForSegment(segment))
+      candidates = numpy.asarray(prevWinnerCells, dtype="int64")
+      candidates = candidates[
+        ~numpy.in1d(candidates, presynapticCells)].tolist()
+    else:
+      candidates = list(prevWinnerCells)
 
-    for synapse in connections.synapsesForSegment(segment):
-      i = binSearch(candidates, synapse.presynapticCell)
-      if i != -1:
-        del candidates[i]
+      for synapse in connections.synapsesForSegment(segment):
+        i = binSearch(candidates, synapse.presynapticCell)
+        if i != -1:
+          del candidates[i]
 
     nActual = min(nDesiredNewSynapes, len(candidates))
 
@@ -802,6 +946,10 @@ class TemporalMemory(Serializable):
     :param permanenceIncrement:  (float)  Amount to increment active synapses
     :param permanenceDecrement:  (float)  Amount to decrement inactive synapses
     """
+    if isinstance(connections, ArrayConnections):
+      cls._adaptSegmentArrays(connections, segment, prevActiveCells,
+                              permanenceIncrement, permanenceDecrement)
+      return
 
     # Destroying a synapse modifies the set that we're iterating through.
     synapsesToDestroy = []
@@ -829,6 +977,76 @@ class TemporalMemory(Serializable):
       connections.destroySegment(segment)
 
 
+  @classmethod
+  def _adaptSegmentArrays(cls, connections, segment, prevActiveCells,
+                          permanenceIncrement, permanenceDecrement):
+    """
+    Vectorized :meth:`_adaptSegment` for
+    :class:`~nupic.algorithms.connections.ArrayConnections`. Updates all of
+    the segment's synapses in one pass, using a membership mask of the
+    previous active cells.
+    """
+    idxs = connections.synapseIndicesForSegment(segment)
+    presynapticCells, permanences, _ = connections.synapseData(idxs)
+
+    active = numpy.in1d(presynapticCells, prevActiveCells)
+    permanences += numpy.where(active, permanenceIncrement,
+                               -permanenceDecrement)
+
+    # Keep permanence within min/max bounds
+    numpy.clip(permanences, 0.0, 1.0, out=permanences)
+
+    connections.updateSynapsePermanences(idxs, permanences)
+    connections.destroySynapses(idxs[permanences < EPSILON])
+
+    if connections.numSynapses(segment) == 0:
+      connections.destroySegment(segment)
+
+
+  def _columnsForSegments(self, segments, cached):
+    """
+    Returns the column of each segment in a position-sorted segment list.
+
+    :param segments: (list) Segments sorted by
+           :meth:`~nupic.algorithms.connections.Connections.segmentPositionSortKey`
+    :param cached: (tuple) (``segments``, ``columns``) as computed by
+           :meth:`activateDendrites`, or None. Used if it belongs to
+           ``segments``.
+    :returns: (numpy.ndarray) Column indices, in ascending order
+    """
+    if (cached is not None and cached[0] is segments and
+        len(cached[1]) == len(segments)):
+      return cached[1]
+
+    cells = numpy.fromiter((segment.cell for segment in segments),
+                           dtype="int64", count=len(segments))
+    return cells // self.cellsPerColumn
+
+
+  def getMemoryUsage(self):
+    """
+    Estimates the memory used by this :class:`TemporalMemory`, from the sizes
+    of its structures.
+
+    :returns: (dict) Estimated bytes for ``connections`` (the breakdown of
+              :meth:`~nupic.algorithms.connections.Connections.getMemoryUsage`),
+              ``segmentActivity`` (per-segment activity counts and last used
+              iterations), ``cellActivity`` (active and winner cells, active
+              and matching segments) and their ``total``.
+    """
+    return withTotal({
+      "connections": self.connections.getMemoryUsage(),
+      "segmentActivity": (
+        listBytes(self.numActiveConnectedSynapsesForSegment, INT_BYTES) +
+        listBytes(self.numActivePotentialSynapsesForSegment, INT_BYTES) +
+        listBytes(self.lastUsedIterationForSegment, INT_BYTES)),
+      "cellActivity": (listBytes(self.activeCells, INT_BYTES) +
+                       listBytes(self.winnerCells, INT_BYTES) +
+                       listBytes(self.activeSegments) +
+                       listBytes(self.matchingSegments)),
+    })
+
+
   def columnForCell(self, cell):
     """
     Returns the index of the column that a cell belongs to.
@@ -1173,7 +1391,7 @@ class TemporalMemory(Serializable):
         protoNumActivePotential[i].cell = segment.cell
         idx = self.connections.segmentsForCell(segment.cell).index(segment)
         protoNumActivePotential[i].idxOnCell = idx
-        protoNumActivePotential[i].number = numActivePotentialSynapses
+        protoNumActivePotential[i].number = int(numActivePotentialSynapses)
 
     proto.iteration = self.iteration
 
@@ -1190,12 +1408,17 @@ class TemporalMemory(Serializable):
 
 
   @classmethod
-  def read(cls, proto):
+  def read(cls, proto, compactionThreshold=None):
     """
     Reads deserialized data from proto object.
 
     :param proto: (DynamicStructBuilder) Proto object
 
+    :param compactionThreshold: (float) The ``compactionThreshold`` of the
+           restored instance. It is not part of ``TemporalMemoryProto``, so
+           callers that rely on automatic compaction must pass it again here.
+           Default value ``None``.
+
     :returns: (:class:TemporalMemory) TemporalMemory instance
     """
     tm = object.__new__(cls)
@@ -1216,8 +1439,11 @@ class TemporalMemory(Serializable):
 
     tm.maxSegmentsPerCell = int(proto.maxSegmentsPerCell)
     tm.maxSynapsesPerSegment = int(proto.maxSynapsesPerSegment)
+    tm.compactionThreshold = compactionThreshold
 
-    tm.connections = Connections.read(proto.connections)
+    # Read into the same Connections implementation that the factory makes.
+    connectionsClass = type(cls.connectionsFactory(0))
+    tm.connections = connectionsClass.read(proto.connections)
     #pylint: disable=W0212
     tm._random = Random()
     tm._random.read(proto.random)
@@ -1227,12 +1453,16 @@ class TemporalMemory(Serializable):
     tm.winnerCells = [int(x) for x in proto.winnerCells]
 
     flatListLength = tm.connections.segmentFlatListLength()
-    tm.numActiveConnectedSynapsesForSegment = [0] * flatListLength
-    tm.numActivePotentialSynapsesForSegment = [0] * flatListLength
+    tm.numActiveConnectedSynapsesForSegment = numpy.zeros(flatListLength,
+                                                          dtype=int)
+    tm.numActivePotentialSynapsesForSegment = numpy.zeros(flatListLength,
+                                                          dtype=int)
     tm.lastUsedIterationForSegment = [0] * flatListLength
 
     tm.activeSegments = []
     tm.matchingSegments = []
+    tm._activeSegmentColumns = None
+    tm._matchingSegmentColumns = None
 
     for protoSegment in proto.activeSegments:
       tm.activeSegments.append(
@@ -1263,6 +1493,17 @@ class TemporalMemory(Serializable):
     return tm
 
 
+  def __setstate__(self, state):
+    """
+    Set the state of ourself from a serialized state, filling in attributes
+    that did not exist when older instances were pickled.
+    """
+    state.setdefault("compactionThreshold", None)
+    state.setdefault("_activeSegmentColumns", None)
+    state.setdefault("_matchingSegmentColumns", None)
+    self.__dict__.update(state)
+
+
   def __eq__(self, other):
     """
     Non-equality operator for TemporalMemory instances.
@@ -0,0 +1,355 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Steps many independent Temporal Memory models in one call. See
+:class:`TemporalMemoryBank`.
+"""
+
+from operator import mul
+
+try:
+  import capnp
+except ImportError:
+  capnp = None
+import numpy
+from nupic.bindings.math import Random
+
+from nupic.algorithms.connections import ArrayConnections
+from nupic.algorithms.temporal_memory import TemporalMemory
+if capnp:
+  from nupic.algorithms.temporal_memory_bank_capnp import (
+    TemporalMemoryBankProto)
+
+
+
+class TemporalMemoryBank(TemporalMemory):
+  """
+  A bank of ``numStreams`` independent Temporal Memory models that share one
+  set of arrays and are stepped together.
+
+  Stream ``k`` owns columns ``[k * C, (k + 1) * C)`` and cells
+  ``[k * N, (k + 1) * N)`` of one large
+  :class:`~nupic.algorithms.temporal_memory.TemporalMemory`, where ``C`` and
+  ``N`` are the number of columns and cells of a single stream. Segments and
+  synapses of all streams live in a single
+  :class:`~nupic.algorithms.connections.ArrayConnections`, so each
+  :meth:`compute` runs one dendrite activation pass for all streams instead of
+  one per model. Since no synapse ever crosses streams and each stream draws
+  from its own random number generator, every stream behaves exactly like an
+  isolated :class:`~nupic.algorithms.temporal_memory.TemporalMemory` with the
+  same parameters and seed.
+
+  Cell and column indices taken and returned by the ``...ForStream`` methods
+  and by :meth:`compute` are local to a stream. The inherited methods use the
+  bank-wide indices.
+
+  :param numStreams: (int) Number of independent models.
+
+  :param columnDimensions: (list or tuple) Dimensions of the column space of
+         a single stream. Default value ``[2048]``.
+
+  :param seed: (int) Seed for the random number generator of every stream,
+         unless ``seeds`` is given. Default value ``42``.
+
+  :param seeds: (list) Optional seed for each stream.
+
+  All other parameters are passed on to
+  :class:`~nupic.algorithms.temporal_memory.TemporalMemory` and apply to
+  every stream.
+  """
+
+  def __init__(self,
+               numStreams,
+               columnDimensions=(2048,),
+               seed=42,
+               seeds=None,
+               **kwargs):
+    if numStreams <= 0:
+      raise ValueError("Number of streams must be greater than 0")
+
+    if not len(columnDimensions):
+      raise ValueError("Number of column dimensions must be greater than 0")
+
+    if seeds is None:
+      seeds = [seed] * numStreams
+    elif len(seeds) != numStreams:
+      raise ValueError("Need exactly one seed per stream")
+
+    self.numStreams = numStreams
+    self.streamColumnDimensions = tuple(columnDimensions)
+    self.numColumnsPerStream = reduce(mul, columnDimensions, 1)
+
+    super(TemporalMemoryBank, self).__init__(
+      columnDimensions=(numStreams * self.numColumnsPerStream,),
+      seed=seed,
+      **kwargs)
+
+    self.numCellsPerStream = self.numColumnsPerStream * self.cellsPerColumn
+    self._randoms = [Random(s) for s in seeds]
+
+    self._prevActiveCellsForStream = [[]] * numStreams
+    self._prevWinnerCellsForStream = [[]] * numStreams
+
+
+  @staticmethod
+  def connectionsFactory(*args, **kwargs):
+    """
+    Create the :class:`~nupic.algorithms.connections.ArrayConnections` shared
+    by all streams.
+
+    :returns: :class:`~nupic.algorithms.connections.ArrayConnections` instance
+    """
+    return ArrayConnections(*args, **kwargs)
+
+
+  def compute(self, activeColumnsForStreams, learn=True):
+    """
+    Perform one time step of every stream.
+
+    :param activeColumnsForStreams: (list) One iterable of active column
+           indices per stream.
+
+    :param learn: (bool) Whether or not learning is enabled.
+
+    :returns: (tuple) Contains (``activeCells``, ``predictiveCells``), each a
+              list holding one list of cell indices per stream.
+    """
+    if len(activeColumnsForStreams) != self.numStreams:
+      raise ValueError("Need exactly one set of active columns per stream")
+
+    activeColumns = []
+    for stream, columns in enumerate(activeColumnsForStreams):
+      offset = stream * self.numColumnsPerStream
+      activeColumns += [offset + column for column in sorted(columns)]
+
+    self.activateCells(activeColumns, learn)
+    self.activateDendrites(learn)
+
+    return (self._splitCells(self.activeCells, local=True),
+            self._splitCells(self.getPredictiveCells(), local=True))
+
+
+  def activateCells(self, activeColumns, learn=True):
+    """
+    Calculate the active cells of all streams. See
+    :meth:`~nupic.algorithms.temporal_memory.TemporalMemory.activateCells`.
+
+    :param activeColumns: (iter) A sorted list of bank-wide active column
+           indices.
+
+    :param learn: (bool) If true, reinforce / punish / grow synapses.
+    """
+    # Active and winner cells are sorted, so each stream's cells form a slice.
+    self._prevActiveCellsForStream = self._splitCells(self.activeCells)
+    self._prevWinnerCellsForStream = self._splitCells(self.winnerCells)
+
+    super(TemporalMemoryBank, self).activateCells(activeColumns, learn)
+
+
+  def reset(self, stream=None):
+    """
+    Indicates the start of a new sequence, on one stream or on all of them.
+
+    :param stream: (int) Stream to reset, or None to reset every stream.
+    """
+    if stream is None:
+      super(TemporalMemoryBank, self).reset()
+      return
+
+    self._validateStream(stream)
+    start = stream * self.numCellsPerStream
+    end = start + self.numCellsPerStream
+    inStream = lambda cell: start <= cell < end
+
+    self.activeCells = [c for c in self.activeCells if not inStream(c)]
+    self.winnerCells = [c for c in self.winnerCells if not inStream(c)]
+    self.activeSegments = [s for s in self.activeSegments
+                           if not inStream(s.cell)]
+    self.matchingSegments = [s for s in self.matchingSegments
+                             if not inStream(s.cell)]
+
+
+  def activatePredictedColumn(self, column, columnActiveSegments,
+                              columnMatchingSegments, prevActiveCells,
+                              prevWinnerCells, learn):
+    """
+    Like :meth:`TemporalMemory.activatePredictedColumn`, using the random
+    number generator and the previous cells of the column's stream.
+    """
+    stream = column // self.numColumnsPerStream
+    return self._activatePredictedColumn(
+      self.connections, self._randoms[stream],
+      columnActiveSegments, self._prevActiveCellsForStream[stream],
+      self._prevWinnerCellsForStream[stream],
+      self.numActivePotentialSynapsesForSegment,
+      self.maxNewSynapseCount, self.initialPermanence,
+      self.permanenceIncrement, self.permanenceDecrement,
+      self.maxSynapsesPerSegment, learn)
+
+
+  def burstColumn(self, column, columnMatchingSegments, prevActiveCells,
+                  prevWinnerCells, learn):
+    """
+    Like :meth:`TemporalMemory.burstColumn`, using the random number
+    generator and the previous cells of the column's stream.
+    """
+    stream = column // self.numColumnsPerStream
+    start = self.cellsPerColumn * column
+    cellsForColumn = xrange(start, start + self.cellsPerColumn)
+
+    return self._burstColumn(
+      self.connections, self._randoms[stream],
+      self.lastUsedIterationForSegment, column, columnMatchingSegments,
+      self._prevActiveCellsForStream[stream],
+      self._prevWinnerCellsForStream[stream], cellsForColumn,
+      self.numActivePotentialSynapsesForSegment, self.iteration,
+      self.maxNewSynapseCount, self.initialPermanence, self.permanenceIncrement,
+      self.permanenceDecrement, self.maxSegmentsPerCell,
+      self.maxSynapsesPerSegment, learn)
+
+
+  def punishPredictedColumn(self, column, columnActiveSegments,
+                            columnMatchingSegments, prevActiveCells,
+                            prevWinnerCells):
+    """
+    Like :meth:`TemporalMemory.punishPredictedColumn`, using the previous
+    cells of the column's stream.
+    """
+    stream = column // self.numColumnsPerStream
+    self._punishPredictedColumn(
+      self.connections, columnMatchingSegments,
+      self._prevActiveCellsForStream[stream], self.predictedSegmentDecrement)
+
+
+  def getActiveCellsForStream(self, stream):
+    """
+    :param stream: (int) Stream index
+    :returns: (list) Stream-local indices of the stream's active cells.
+    """
+    self._validateStream(stream)
+    return self._splitCells(self.activeCells, local=True)[stream]
+
+
+  def getPredictiveCellsForStream(self, stream):
+    """
+    :param stream: (int) Stream index
+    :returns: (list) Stream-local indices of the stream's predictive cells.
+    """
+    self._validateStream(stream)
+    return self._splitCells(self.getPredictiveCells(), local=True)[stream]
+
+
+  def getWinnerCellsForStream(self, stream):
+    """
+    :param stream: (int) Stream index
+    :returns: (list) Stream-local indices of the stream's winner cells.
+    """
+    self._validateStream(stream)
+    return self._splitCells(self.winnerCells, local=True)[stream]
+
+
+  def _splitCells(self, cells, local=False):
+    """
+    Splits a sorted list of bank-wide cell indices by stream.
+
+    :param cells: (list) Sorted cell indices
+    :param local: (bool) If true, convert to stream-local indices.
+    :returns: (list) One list of cells per stream.
+    """
+    cells = numpy.asarray(cells, dtype="int64")
+    bounds = numpy.searchsorted(
+      cells, numpy.arange(self.numStreams + 1) * self.numCellsPerStream)
+
+    if local:
+      cells = cells % self.numCellsPerStream
+
+    return [cells[bounds[i]:bounds[i + 1]].tolist()
+            for i in xrange(self.numStreams)]
+
+
+  def _validateStream(self, stream):
+    """
+    Raises an error if stream index is invalid.
+
+    :param stream: (int) Stream index
+    """
+    if stream >= self.numStreams or stream < 0:
+      raise IndexError("Invalid stream")
+
+
+  @classmethod
+  def getSchema(cls):
+    return TemporalMemoryBankProto
+
+
+  def write(self, proto):
+    """
+    Writes serialized data to proto object.
+
+    :param proto: (DynamicStructBuilder) TemporalMemoryBankProto object
+    """
+    super(TemporalMemoryBank, self).write(proto.baseTM)
+    proto.numStreams = self.numStreams
+    proto.streamColumnDimensions = list(self.streamColumnDimensions)
+
+    protoRandoms = proto.init("randoms", self.numStreams)
+    for i, random in enumerate(self._randoms):
+      random.write(protoRandoms[i])
+
+    proto.prevActiveCellsForStream = [
+      list(cells) for cells in self._prevActiveCellsForStream]
+    proto.prevWinnerCellsForStream = [
+      list(cells) for cells in self._prevWinnerCellsForStream]
+
+
+  @classmethod
+  def read(cls, proto, compactionThreshold=None):
+    """
+    Reads deserialized data from proto object.
+
+    :param proto: (DynamicStructBuilder) TemporalMemoryBankProto object
+
+    :param compactionThreshold: (float) See
+           :meth:`~nupic.algorithms.temporal_memory.TemporalMemory.read`.
+
+    :returns: (:class:TemporalMemoryBank) TemporalMemoryBank instance
+    """
+    bank = super(TemporalMemoryBank, cls).read(proto.baseTM,
+                                               compactionThreshold)
+
+    bank.numStreams = int(proto.numStreams)
+    bank.streamColumnDimensions = tuple(proto.streamColumnDimensions)
+    bank.numColumnsPerStream = reduce(mul, bank.streamColumnDimensions, 1)
+    bank.numCellsPerStream = bank.numColumnsPerStream * bank.cellsPerColumn
+
+    bank._randoms = []
+    for protoRandom in proto.randoms:
+      random = Random()
+      random.read(protoRandom)
+      bank._randoms.append(random)
+
+    bank._prevActiveCellsForStream = [
+      [int(cell) for cell in cells] for cells in proto.prevActiveCellsForStream]
+    bank._prevWinnerCellsForStream = [
+      [int(cell) for cell in cells] for cells in proto.prevWinnerCellsForStream]
+
+    return bank
@@ -43,6 +43,7 @@ from nupic.data.field_meta import FieldMetaSpecial, FieldMetaInfo
 from nupic.encoders import MultiEncoder, DeltaEncoder
 from nupic.engine import Network
 from nupic.support.fs_helpers import makeDirectoryFromAbsolutePath
+from nupic.support.memory_usage import withTotal
 from nupic.frameworks.opf.opf_utils import (InferenceType,
                                             InferenceElement,
                                             SensorInput,
@@ -975,10 +976,12 @@ class HTMPredictionModel(Model):
 
   def getRuntimeStats(self):
     """
-    Only returns data for a stat called ``numRunCalls``.
+    Returns data for a stat called ``numRunCalls``, the temporal network
+    stats, and the ``memoryUsage`` breakdown of :meth:`getMemoryUsage`.
     :return:
     """
-    ret = {"numRunCalls" : self.__numRunCalls}
+    ret = {"numRunCalls" : self.__numRunCalls,
+           "memoryUsage" : self.getMemoryUsage()}
 
     #--------------------------------------------------
     # Query temporal network stats
@@ -994,6 +997,28 @@ class HTMPredictionModel(Model):
     return ret
 
 
+  def getMemoryUsage(self):
+    """
+    Estimates the memory used by the model's algorithms, using their
+    ``getMemoryUsage()`` methods. Algorithms without one, like the C++
+    implementations, are left out.
+
+    :returns: (dict) The breakdown of each algorithm, keyed by region name
+              (``SP``, ``TM`` and ``Classifier``), and their ``total``.
+    """
+    usage = {}
+    for name, region in (("SP", self._getSPRegion()),
+                         ("TM", self._getTPRegion()),
+                         ("Classifier", self._getClassifierRegion())):
+      if region is None:
+        continue
+      algorithm = region.getSelf().getAlgorithmInstance()
+      if hasattr(algorithm, "getMemoryUsage"):
+        usage[name] = algorithm.getMemoryUsage()
+
+    return withTotal(usage)
+
+
   def getFieldInfo(self, includeClassifierOnlyField=False):
     encoder = self._getEncoder()
 
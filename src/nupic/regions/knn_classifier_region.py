@@ -73,6 +73,7 @@ class KNNClassifierRegion(PyRegion):
   :param cellsPerCol: (int)
   :param maxStoredPatterns: (int)
   :param minSparsity: (float)
+  :param maxDeletedFraction: (float)
   """
 
   __VERSION__ = 1
@@ -335,6 +336,17 @@ class KNNClassifierRegion(PyRegion):
             defaultValue=0.0,
             accessMode='ReadWrite'),
 
+          maxDeletedFraction=dict(
+            description="Removed prototypes are only marked as deleted until"
+                        " more than this fraction of the stored prototypes"
+                        " are deleted, and the memory is compacted. A value"
+                        " of 0.0 compacts on every removal",
+            dataType='Real32',
+            count=1,
+            constraints='',
+            defaultValue=0.25,
+            accessMode='Create'),
+
           sparseThreshold=dict(
             description='If sparse memory is used, input variables '
                         'whose absolute value is less than this '
@@ -515,7 +527,8 @@ class KNNClassifierRegion(PyRegion):
                replaceDuplicates=False,
                cellsPerCol=0,
                maxStoredPatterns=-1,
-               minSparsity=0.0
+               minSparsity=0.0,
+               maxDeletedFraction=0.25
                ):
     self.version = KNNClassifierRegion.__VERSION__
 
@@ -557,7 +570,8 @@ class KNNClassifierRegion(PyRegion):
         replaceDuplicates=replaceDuplicates,
         cellsPerCol=cellsPerCol,
         maxStoredPatterns=maxStoredPatterns,
-        minSparsity=minSparsity
+        minSparsity=minSparsity,
+        maxDeletedFraction=maxDeletedFraction
     )
 
     # Initialize internal structures
@@ -675,6 +689,9 @@ class KNNClassifierRegion(PyRegion):
 
   def _getPatternMatrix(self):
 
+    # Rows of removed patterns stay in memory until it is compacted, so the
+    # exposed rows only line up with the pattern indices once it is
+    self._knn.compactMemory()
     if self._knn._M is not None:
       return self._knn._M
     else:
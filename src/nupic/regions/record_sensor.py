@@ -33,6 +33,34 @@ if capnp:
 
 
 
+class _EncodingPlan(object):
+  """
+  Everything :meth:`RecordSensor.compute` needs to encode a record in a single
+  pass over the encoders, worked out once per encoder configuration.
+
+  :param key: (tuple) Identifies the configuration the plan was built for.
+  :param fields: (list) ``(name, encoder, offset)`` for each field of the
+         sensor's :class:`~nupic.encoders.multi.MultiEncoder`.
+  :param sourceBounds: (list) ``(start, stop)`` of each sub-encoder's bits in
+         the sensor output, for ``sourceEncodings``.
+  :param predictedEncoder: Encoder of the predicted field, or None.
+  :param predictedFieldIdx: (int) Index in ``fields`` of the predicted field,
+         or None if its encoder is not one of them (e.g. it is disabled).
+  """
+
+  __slots__ = ["key", "fields", "sourceBounds", "predictedEncoder",
+               "predictedFieldIdx"]
+
+  def __init__(self, key, fields, sourceBounds, predictedEncoder,
+               predictedFieldIdx):
+    self.key = key
+    self.fields = fields
+    self.sourceBounds = sourceBounds
+    self.predictedEncoder = predictedEncoder
+    self.predictedFieldIdx = predictedFieldIdx
+
+
+
 class RecordSensor(PyRegion):
   """
   A Record Sensor (RS) retrieves an information "record" and encodes
@@ -243,6 +271,9 @@ class RecordSensor(PyRegion):
     # lastRecord is the last record returned. Used for debugging only
     self.lastRecord = None
 
+    # Compiled by _getEncodingPlan()
+    self._encodingPlan = None
+
 
   def __setstate__(self, state):
     # Default value for older versions being deserialized.
@@ -250,6 +281,7 @@ class RecordSensor(PyRegion):
     self.__dict__.update(state)
     if not hasattr(self, "numCategories"):
       self.numCategories = 1
+    self._encodingPlan = None
 
 
   def initialize(self):
@@ -259,6 +291,58 @@ class RecordSensor(PyRegion):
     if self.dataSource is None:
       raise Exception("Unable to initialize RecordSensor "
                       "-- dataSource has not been set")
+    self._getEncodingPlan()
+
+
+  def _getEncodingPlan(self):
+    """
+    Returns the encoding plan, compiling it again if the encoders or the
+    predicted field changed since it was last compiled. Only a
+    :class:`~nupic.encoders.multi.MultiEncoder` encodes each field on its own,
+    so other encoders get no plan and encode whole records themselves.
+
+    :returns: (:class:`_EncodingPlan`) or None if the encoder is not a
+              :class:`~nupic.encoders.multi.MultiEncoder`.
+    """
+    if not isinstance(self.encoder, MultiEncoder):
+      return None
+
+    encoders = self.encoder.encoders
+    key = (id(self.encoder), id(self.disabledEncoder), self.predictedField,
+           id(encoders), len(encoders) if encoders is not None else 0)
+    if self._encodingPlan is None or self._encodingPlan.key != key:
+      self._encodingPlan = self._compileEncodingPlan(key)
+    return self._encodingPlan
+
+
+  def _compileEncodingPlan(self, key):
+    fields = list(self.encoder.encoders)
+
+    sourceBounds = []
+    prevOffset = 0
+    for encoder in self.encoder.getEncoderList():
+      nextOffset = prevOffset + encoder.getWidth()
+      sourceBounds.append((prevOffset, nextOffset))
+      prevOffset = nextOffset
+
+    # Use the first encoder named after the predicted field, looking at the
+    # disabled encoders last.
+    predictedEncoder = None
+    predictedFieldIdx = None
+    if self.predictedField is not None:
+      for i, (name, encoder, _) in enumerate(fields):
+        if name == self.predictedField:
+          predictedEncoder = encoder
+          predictedFieldIdx = i
+          break
+      if predictedEncoder is None and self.disabledEncoder is not None:
+        for name, encoder, _ in self.disabledEncoder.encoders:
+          if name == self.predictedField:
+            predictedEncoder = encoder
+            break
+
+    return _EncodingPlan(key, fields, sourceBounds, predictedEncoder,
+                         predictedFieldIdx)
 
 
   def rewind(self):
@@ -373,52 +457,17 @@ class RecordSensor(PyRegion):
       sequenceId = data["_sequenceId"]
       categories = data["_category"]
 
-      # Encode the processed records; populate outputs["dataOut"] in place
-      self.encoder.encodeIntoArray(data, outputs["dataOut"])
-
       # If there is a field to predict, set bucketIdxOut and actValueOut.
       # There is a special case where a predicted field might be a vector, as in
       # the CoordinateEncoder. Since this encoder does not provide bucket
       # indices for prediction, we will ignore it.
-      if self.predictedField is not None and self.predictedField != "vector":
-        allEncoders = list(self.encoder.encoders)
-        if self.disabledEncoder is not None:
-          allEncoders.extend(self.disabledEncoder.encoders)
-        encoders = [e for e in allEncoders
-                    if e[0] == self.predictedField]
-        if len(encoders) == 0:
-          raise ValueError("There is no encoder for set for the predicted "
-                           "field: %s" % self.predictedField)
-        # TODO: Figure out why there are sometimes multiple encoders with the
-        # same name.
-        #elif len(encoders) > 1:
-        #  raise ValueError("There cant' be more than 1 encoder for the "
-        #                   "predicted field: %s" % self.predictedField)
-        else:
-          encoder = encoders[0][1]
-
-        actualValue = data[self.predictedField]
-        outputs["bucketIdxOut"][:] = encoder.getBucketIndices(actualValue)
-        if isinstance(actualValue, str):
-          outputs["actValueOut"][:] = encoder.getBucketIndices(actualValue)
-        else:
-          outputs["actValueOut"][:] = actualValue
-
-      # Write out the scalar values obtained from they data source.
-      outputs["sourceOut"][:] = self.encoder.getScalars(data)
-      self._outputValues["sourceOut"] = self.encoder.getEncodedValues(data)
-
-      # -----------------------------------------------------------------------
-      # Get the encoded bit arrays for each field
-      encoders = self.encoder.getEncoderList()
-      prevOffset = 0
-      sourceEncodings = []
-      bitData = outputs["dataOut"]
-      for encoder in encoders:
-        nextOffset = prevOffset + encoder.getWidth()
-        sourceEncodings.append(bitData[prevOffset:nextOffset])
-        prevOffset = nextOffset
-      self._outputValues['sourceEncodings'] = sourceEncodings
+      predictBucket = (self.predictedField is not None and
+                       self.predictedField != "vector")
+      plan = self._getEncodingPlan()
+      if plan is None:
+        self._encodeRecord(data, outputs, predictBucket)
+      else:
+        self._encodeRecordWithPlan(plan, data, outputs, predictBucket)
 
       # Execute post-encoding filters, if any
       for filter in self.postEncodingFilters:
@@ -504,6 +553,110 @@ class RecordSensor(PyRegion):
         "size")
 
 
+  def _encodeRecord(self, data, outputs, predictBucket):
+    """
+    Encodes a record with the sensor's encoder as a whole, populating
+    dataOut, sourceOut and sourceEncodings, and bucketIdxOut and actValueOut
+    if predictBucket is set.
+
+    :param data: (dict) The record to encode.
+    :param outputs: (dict) The outputs passed to :meth:`compute`.
+    :param predictBucket: (bool) Whether to populate the predicted field
+           outputs.
+    """
+    # Encode the processed records; populate outputs["dataOut"] in place
+    self.encoder.encodeIntoArray(data, outputs["dataOut"])
+
+    if predictBucket:
+      allEncoders = list(self.encoder.encoders)
+      if self.disabledEncoder is not None:
+        allEncoders.extend(self.disabledEncoder.encoders)
+      encoders = [e for e in allEncoders
+                  if e[0] == self.predictedField]
+      if len(encoders) == 0:
+        raise ValueError("There is no encoder for set for the predicted "
+                         "field: %s" % self.predictedField)
+      self._populateBucketOut(encoders[0][1], data, outputs)
+
+    # Write out the scalar values obtained from they data source.
+    outputs["sourceOut"][:] = self.encoder.getScalars(data)
+    self._outputValues["sourceOut"] = self.encoder.getEncodedValues(data)
+
+    # Get the encoded bit arrays for each field
+    encoders = self.encoder.getEncoderList()
+    prevOffset = 0
+    sourceEncodings = []
+    bitData = outputs["dataOut"]
+    for encoder in encoders:
+      nextOffset = prevOffset + encoder.getWidth()
+      sourceEncodings.append(bitData[prevOffset:nextOffset])
+      prevOffset = nextOffset
+    self._outputValues['sourceEncodings'] = sourceEncodings
+
+
+  def _encodeRecordWithPlan(self, plan, data, outputs, predictBucket):
+    """
+    Same as :meth:`_encodeRecord` for a
+    :class:`~nupic.encoders.multi.MultiEncoder`, in one pass over its fields.
+
+    :param plan: (:class:`_EncodingPlan`) The plan of the sensor's encoder.
+    :param data: (dict) The record to encode.
+    :param outputs: (dict) The outputs passed to :meth:`compute`.
+    :param predictBucket: (bool) Whether to populate the predicted field
+           outputs.
+    """
+    if predictBucket and plan.predictedEncoder is None:
+      raise ValueError("There is no encoder for set for the predicted "
+                       "field: %s" % self.predictedField)
+
+    # Encode the processed records in one pass over the fields, populating
+    # outputs["dataOut"] in place and collecting the scalar and encoded
+    # values from the data source.
+    bitData = outputs["dataOut"]
+    scalars = [numpy.array([])]
+    encodedValues = []
+    for i, (name, encoder, offset) in enumerate(plan.fields):
+      value = self.encoder._getInputValue(data, name)
+      encoder.encodeIntoArray(value, bitData[offset:])
+
+      if predictBucket and i == plan.predictedFieldIdx:
+        self._populateBucketOut(plan.predictedEncoder, data, outputs)
+
+      scalars.append(encoder.getScalars(value))
+      values = encoder.getEncodedValues(value)
+      if type(values) in (list, tuple):
+        encodedValues.extend(values)
+      else:
+        encodedValues.append(values)
+
+    if predictBucket and plan.predictedFieldIdx is None:
+      self._populateBucketOut(plan.predictedEncoder, data, outputs)
+
+    outputs["sourceOut"][:] = numpy.hstack(scalars)
+    self._outputValues["sourceOut"] = tuple(encodedValues)
+
+    # Get the encoded bit arrays for each field
+    self._outputValues['sourceEncodings'] = [
+      bitData[start:stop] for start, stop in plan.sourceBounds]
+
+
+  def _populateBucketOut(self, encoder, data, outputs):
+    """
+    Sets bucketIdxOut and actValueOut for the predicted field.
+
+    :param encoder: Encoder of the predicted field.
+    :param data: (dict) The record being encoded.
+    :param outputs: (dict) The outputs passed to :meth:`compute`.
+    """
+    actualValue = data[self.predictedField]
+    bucketIndices = encoder.getBucketIndices(actualValue)
+    outputs["bucketIdxOut"][:] = bucketIndices
+    if isinstance(actualValue, str):
+      outputs["actValueOut"][:] = bucketIndices
+    else:
+      outputs["actValueOut"][:] = actualValue
+
+
   def _convertNonNumericData(self, spatialOutput, temporalOutput, output):
     """
     Converts all of the non-numeric fields from spatialOutput and temporalOutput
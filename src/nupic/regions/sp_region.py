@@ -879,6 +879,8 @@ class SPRegion(PyRegion):
     proto.inferenceMode = 1 if self.inferenceMode else 0
     proto.anomalyMode = 1 if self.anomalyMode else 0
     proto.topDownMode = 1 if self.topDownMode else 0
+    if self.spatialImp == 'py':
+      proto.compactPermanences = self._sfdr.getCompactPermanences()
 
     self._sfdr.write(proto.spatialPooler)
 
@@ -901,7 +903,11 @@ class SPRegion(PyRegion):
     instance.topDownMode = proto.topDownMode
 
     spatialImp = proto.spatialImp
-    instance._sfdr = getSPClass(spatialImp).read(proto.spatialPooler)
+    if proto.compactPermanences:
+      instance._sfdr = getSPClass(spatialImp).read(proto.spatialPooler,
+                                                   compactPermanences=True)
+    else:
+      instance._sfdr = getSPClass(spatialImp).read(proto.spatialPooler)
 
     return instance
 
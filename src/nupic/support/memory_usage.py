@@ -0,0 +1,106 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""
+Helpers for the ``getMemoryUsage()`` methods of the algorithms and models.
+
+The estimates are computed from sizes and counts that the data structures
+already track, so they never walk the elements of a structure. Numpy arrays
+are counted exactly. Python containers are counted as their own size plus a
+fixed size per element, and sparse matrices as a fixed size per row and per
+non-zero.
+"""
+
+import sys
+
+import numpy
+
+
+# Size of a Python int or float that is not shared with other containers.
+INT_BYTES = sys.getsizeof(2 ** 40)
+FLOAT_BYTES = sys.getsizeof(0.0)
+
+# Size of a numpy array object, without its data.
+ARRAY_OBJECT_BYTES = sys.getsizeof(numpy.zeros(0))
+
+# Size of a pointer in a Python container.
+POINTER_BYTES = numpy.dtype(numpy.intp).itemsize
+
+# Amortized size of one entry of a Python set or dict: the hash table keeps
+# room for about twice as many entries as it holds.
+HASH_ENTRY_BYTES = 2 * (numpy.dtype(numpy.intp).itemsize + POINTER_BYTES)
+
+# Per-row bookkeeping of the nupic.bindings sparse matrices.
+SPARSE_ROW_BYTES = 3 * POINTER_BYTES + 8
+SPARSE_INDEX_BYTES = 4
+
+
+
+def arrayBytes(*arrays):
+  """
+  :param arrays: numpy arrays, or None
+  :returns: (int) Total size of the arrays' data in bytes.
+  """
+  return sum(int(array.nbytes) for array in arrays if array is not None)
+
+
+
+def listBytes(values, itemBytes=0):
+  """
+  Estimates the size of a list or other sized container, or of a numpy array.
+
+  :param values: The container
+  :param itemBytes: (int) Size of each element that is owned by the
+         container, e.g. :data:`INT_BYTES` for a list of distinct ints. Zero if
+         the elements are shared with other structures.
+  :returns: (int) Estimated size in bytes.
+  """
+  if isinstance(values, numpy.ndarray):
+    return int(values.nbytes)
+  return sys.getsizeof(values) + len(values) * itemBytes
+
+
+
+def sparseMatrixBytes(matrix, valueBytes=4):
+  """
+  Estimates the size of a ``SparseMatrix`` or ``SparseBinaryMatrix`` from
+  ``nupic.bindings.math``.
+
+  :param matrix: The sparse matrix
+  :param valueBytes: (int) Size of each stored value, 0 for a binary matrix.
+  :returns: (int) Estimated size in bytes.
+  """
+  return (matrix.nRows() * SPARSE_ROW_BYTES +
+          matrix.nNonZeros() * (SPARSE_INDEX_BYTES + valueBytes))
+
+
+
+def withTotal(usage):
+  """
+  Adds a ``total`` entry to a memory usage breakdown. Nested breakdowns
+  contribute their own ``total``.
+
+  :param usage: (dict) Bytes per structure, or nested breakdowns.
+  :returns: (dict) ``usage``, with the ``total`` entry added.
+  """
+  usage["total"] = sum(value["total"] if isinstance(value, dict) else value
+                       for key, value in usage.iteritems() if key != "total")
+  return usage
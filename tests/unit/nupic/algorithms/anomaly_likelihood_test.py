@@ -287,6 +287,44 @@ class AnomalyLikelihoodClassTest(TestCaseBase):
       self.assertEqual(l.anomalyProbability(10, 0.1, timestamp=6), 0.9)
 
 
+  def testIncrementalEstimation(self):
+    rng = numpy.random.RandomState(42)
+    scores = rng.beta(2, 8, size=500)
+    values = rng.normal(10, 2, size=500).tolist()
+    # A categorical value, then a stretch of flat metric values longer than
+    # the window
+    values[60] = "on"
+    values[250:420] = [5.0] * 170
+
+    batch = an.AnomalyLikelihood(learningPeriod=20,
+                                 estimationSamples=30,
+                                 historicWindowSize=100,
+                                 reestimationPeriod=7)
+    incremental = an.AnomalyLikelihood(learningPeriod=20,
+                                       estimationSamples=30,
+                                       historicWindowSize=100,
+                                       reestimationPeriod=7,
+                                       incrementalEstimation=True)
+
+    for i in xrange(len(scores)):
+      expected = batch.anomalyProbability(values[i], scores[i], timestamp=i)
+      actual = incremental.anomalyProbability(values[i], scores[i],
+                                              timestamp=i)
+      self.assertAlmostEqual(expected, actual, places=9)
+      if batch._distribution is not None:
+        for key in ("mean", "variance", "stdev"):
+          self.assertAlmostEqual(
+            batch._distribution["distribution"][key],
+            incremental._distribution["distribution"][key], places=9)
+
+    # The statistics rebuilt from the historical scores give the same estimate
+    expected = incremental._estimateIncrementally()["distribution"]
+    incremental._resetIncrementalStatistics()
+    actual = incremental._estimateIncrementally()["distribution"]
+    for key in ("mean", "variance", "stdev"):
+      self.assertAlmostEqual(expected[key], actual[key], places=9)
+
+
   def testEquals(self):
     l = an.AnomalyLikelihood(claLearningPeriod=2, estimationSamples=2)
     l2 = an.AnomalyLikelihood(claLearningPeriod=2, estimationSamples=2)
@@ -21,6 +21,8 @@
 import tempfile
 import unittest
 
+import numpy
+
 try:
   import capnp
 except ImportError:
@@ -28,13 +30,16 @@ except ImportError:
 if capnp:
   from nupic.proto import ConnectionsProto_capnp
 
-from nupic.algorithms.connections import Connections
+from nupic.algorithms.connections import ArrayConnections, Connections
 
 
 class ConnectionsTest(unittest.TestCase):
 
+  connectionsClass = Connections
+
+
   def testCreateSegment(self):
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
 
     segment1 = connections.createSegment(10)
     self.assertEqual(segment1.cell, 10)
@@ -50,7 +55,7 @@ class ConnectionsTest(unittest.TestCase):
     """ Creates a segment, destroys it, and makes sure it got destroyed along
         with all of its synapses.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
 
     connections.createSegment(10)
     segment2 = connections.createSegment(20)
@@ -80,7 +85,7 @@ class ConnectionsTest(unittest.TestCase):
     """ Creates a segment, creates a number of synapses on it, destroys a
         synapse, and makes sure it got destroyed.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
 
     segment = connections.createSegment(20)
     synapse1 = connections.createSynapse(segment, 80, .85)
@@ -106,7 +111,7 @@ class ConnectionsTest(unittest.TestCase):
         either side of them and verifies that existing Segment and Synapse
         instances still point to the same segment / synapse as before.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
     segment1 = connections.createSegment(11)
     connections.createSegment(12)
     segment3 = connections.createSegment(13)
@@ -138,7 +143,7 @@ class ConnectionsTest(unittest.TestCase):
     """ Destroy a segment that has a destroyed synapse and a non-destroyed
         synapse. Make sure nothing gets double-destroyed.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
 
     segment1 = connections.createSegment(11)
     segment2 = connections.createSegment(12)
@@ -165,7 +170,7 @@ class ConnectionsTest(unittest.TestCase):
         synapse. Create a new segment in the same place. Make sure its synapse
         count is correct.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
 
     segment = connections.createSegment(11)
 
@@ -188,7 +193,7 @@ class ConnectionsTest(unittest.TestCase):
     """ Creates a synapse and updates its permanence, and makes sure that its
         data was correctly updated.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
     segment = connections.createSegment(10)
     synapse = connections.createSynapse(segment, 50, .34)
 
@@ -203,7 +208,7 @@ class ConnectionsTest(unittest.TestCase):
         activity for a collection of cells with no activity returns the right
         activity data.
     """
-    connections = Connections(1024)
+    connections = self.connectionsClass(1024)
 
     # Cell with 1 segment.
     # Segment with:
@@ -234,10 +239,110 @@ class ConnectionsTest(unittest.TestCase):
     self.assertEqual(3, numActivePotential[segment2a.flatIdx])
 
 
+  def testCompact(self):
+    """ Compacting renumbers segments densely in cell order and keeps their
+        synapses, ordinals and activity.
+    """
+    connections = self.connectionsClass(1024)
+
+    segment1 = connections.createSegment(30)
+    segment2 = connections.createSegment(10)
+    segment3 = connections.createSegment(20)
+    segment4 = connections.createSegment(10)
+
+    connections.createSynapse(segment1, 80, .85)
+    connections.createSynapse(segment2, 81, .85)
+    connections.createSynapse(segment3, 80, .85)
+    synapse = connections.createSynapse(segment4, 80, .15)
+    connections.createSynapse(segment4, 81, .85)
+    connections.createSynapse(segment4, 82, .85)
+    connections.destroySynapse(synapse)
+    connections.destroySegment(segment3)
+
+    self.assertGreater(connections.fragmentation(), 0)
+    oldFlatIdxs = [segment.flatIdx for segment in
+                   (segment1, segment2, segment3, segment4)]
+
+    newFlatIdxs = connections.compact()
+
+    self.assertEqual(0, connections.fragmentation())
+    self.assertEqual(3, connections.segmentFlatListLength())
+    self.assertEqual([2, 0, -1, 1], [newFlatIdxs[i] for i in oldFlatIdxs])
+    self.assertEqual([2, 0, 1], [segment1.flatIdx, segment2.flatIdx,
+                                 segment4.flatIdx])
+    self.assertIs(segment4, connections.segmentForFlatIdx(1))
+    self.assertEqual([segment2, segment4],
+                     list(connections.segmentsForCell(10)))
+    self.assertLess(connections.segmentPositionSortKey(segment2),
+                    connections.segmentPositionSortKey(segment4))
+
+    self.assertEqual(3, connections.numSegments())
+    self.assertEqual(4, connections.numSynapses())
+    self.assertEqual(set([(81, .85), (82, .85)]),
+                     set((s.presynapticCell, s.permanence) for s in
+                         connections.synapsesForSegment(segment4)))
+
+    (numActiveConnected,
+     numActivePotential) = connections.computeActivity([80, 81, 82], .5)
+    self.assertEqual([1, 2, 1], list(numActiveConnected))
+    self.assertEqual([1, 2, 1], list(numActivePotential))
+
+    segment5 = connections.createSegment(20)
+    connections.createSynapse(segment5, 80, .85)
+    self.assertEqual(3, segment5.flatIdx)
+    (numActiveConnected,
+     numActivePotential) = connections.computeActivity([80], .5)
+    self.assertEqual([0, 0, 1, 1], list(numActiveConnected))
+
+
+  def testSortSegmentFlatIdxs(self):
+    """ Flat indices sort like segmentPositionSortKey, also when flat indices
+        are recycled or compacted.
+    """
+    connections = self.connectionsClass(16)
+    segments = [connections.createSegment(cell) for cell in [9, 3, 9, 3, 12]]
+    connections.destroySegment(segments[1])
+    segments[1] = connections.createSegment(9)
+
+    flatIdxs = numpy.array([segment.flatIdx for segment in segments])
+    expected = sorted(segments, key=connections.segmentPositionSortKey)
+
+    sortedFlatIdxs = connections.sortSegmentFlatIdxs(flatIdxs)
+    self.assertEqual([segment.flatIdx for segment in expected],
+                     sortedFlatIdxs.tolist())
+    self.assertEqual([segment.cell for segment in expected],
+                     connections.cellsForSegmentFlatIdxs(
+                       sortedFlatIdxs).tolist())
+
+    connections.compact()
+    flatIdxs = numpy.array([segment.flatIdx for segment in segments])
+    self.assertEqual([segment.flatIdx for segment in expected],
+                     connections.sortSegmentFlatIdxs(flatIdxs).tolist())
+    self.assertEqual([segment.cell for segment in segments],
+                     connections.cellsForSegmentFlatIdxs(flatIdxs).tolist())
+
+
+  def testGetMemoryUsage(self):
+    connections = self.connectionsClass(1024)
+    usage = connections.getMemoryUsage()
+
+    segment = connections.createSegment(10)
+    for presynapticCell in xrange(100):
+      connections.createSynapse(segment, presynapticCell, .5)
+    grownUsage = connections.getMemoryUsage()
+
+    self.assertGreater(grownUsage["segments"], usage["segments"])
+    self.assertGreater(grownUsage["synapses"], usage["synapses"])
+    self.assertGreater(grownUsage["presynapticIndex"],
+                       usage["presynapticIndex"])
+    self.assertEqual(grownUsage["segments"] + grownUsage["synapses"] +
+                     grownUsage["presynapticIndex"], grownUsage["total"])
+
+
   @unittest.skipUnless(
     capnp, "pycapnp is not installed, skipping serialization test.")
   def testWriteRead(self):
-    c1 = Connections(1024)
+    c1 = self.connectionsClass(1024)
 
     # Add data before serializing
     s1 = c1.createSegment(0)
@@ -267,11 +372,111 @@ class ConnectionsTest(unittest.TestCase):
       proto2 = ConnectionsProto_capnp.ConnectionsProto.read(f)
 
     # Load the deserialized proto
-    c2 = Connections.read(proto2)
+    c2 = self.connectionsClass.read(proto2)
 
     # Check that the two connections objects are functionally equal
     self.assertEqual(c1, c2)
 
 
+
+class ArrayConnectionsTest(ConnectionsTest):
+
+  connectionsClass = ArrayConnections
+
+
+  def testSynapseIndicesReused(self):
+    """ Destroyed synapses and segments are recycled instead of growing the
+        arrays.
+    """
+    connections = self.connectionsClass(1024)
+
+    segment1 = connections.createSegment(10)
+    connections.createSynapse(segment1, 80, .85)
+    connections.createSynapse(segment1, 81, .85)
+    connections.destroySegment(segment1)
+
+    segment2 = connections.createSegment(20)
+    self.assertEqual(segment1.flatIdx, segment2.flatIdx)
+    synapse3 = connections.createSynapse(segment2, 82, .15)
+    connections.createSynapse(segment2, 83, .15)
+    self.assertEqual(2, connections._nextSynapseIdx)
+    self.assertIn(synapse3._idx, (0, 1))
+
+    connections.destroySynapse(synapse3)
+    synapse5 = connections.createSynapse(segment2, 84, .85)
+    self.assertEqual(synapse3._idx, synapse5._idx)
+    self.assertEqual([83, 84],
+                     [connections.dataForSynapse(s).presynapticCell
+                      for s in sorted(connections.synapsesForSegment(segment2),
+                                      key=lambda s: s._ordinal)])
+    self.assertEqual(2, connections.numSynapses())
+    self.assertEqual(1, connections.numSegments())
+
+
+  def testComputeActivityExternalInput(self):
+    """ Presynaptic cells may lie outside the collection of cells. """
+    connections = self.connectionsClass(16)
+
+    segment = connections.createSegment(3)
+    connections.createSynapse(segment, 40, .85)
+    connections.createSynapse(segment, 41, .15)
+
+    (numActiveConnected,
+     numActivePotential) = connections.computeActivity([40, 41, 100], .5)
+
+    self.assertEqual(1, numActiveConnected[segment.flatIdx])
+    self.assertEqual(2, numActivePotential[segment.flatIdx])
+
+
+  def testPresynapticIndexMatchesConnections(self):
+    """ After heavy synapse churn the presynaptic index, which is moved and
+        repacked as it grows, still agrees with the object-based Connections.
+    """
+    random = numpy.random.RandomState(42)
+    connections = self.connectionsClass(64)
+    reference = Connections(64)
+    segments = []
+
+    for _ in xrange(5000):
+      if len(segments) == 0 or random.rand() < 0.05:
+        cell = random.randint(64)
+        segments.append((connections.createSegment(cell),
+                         reference.createSegment(cell)))
+      elif random.rand() < 0.3:
+        segment, referenceSegment = segments[random.randint(len(segments))]
+        if connections.numSynapses(segment) > 0:
+          ordinal = lambda s: s._ordinal
+          synapses = sorted(connections.synapsesForSegment(segment),
+                            key=ordinal)
+          referenceSynapses = sorted(
+            reference.synapsesForSegment(referenceSegment), key=ordinal)
+          i = random.randint(len(synapses))
+          connections.destroySynapse(synapses[i])
+          reference.destroySynapse(referenceSynapses[i])
+      else:
+        segment, referenceSegment = segments[random.randint(len(segments))]
+        presynapticCell = random.randint(96)
+        permanence = random.rand()
+        connections.createSynapse(segment, presynapticCell, permanence)
+        reference.createSynapse(referenceSegment, presynapticCell, permanence)
+
+    activeCells = sorted(random.choice(96, 30, replace=False))
+    (numActiveConnected,
+     numActivePotential) = connections.computeActivity(activeCells, .5)
+    (expectedActiveConnected,
+     expectedActivePotential) = reference.computeActivity(activeCells, .5)
+
+    for segment, referenceSegment in segments:
+      self.assertEqual(expectedActiveConnected[referenceSegment.flatIdx],
+                       numActiveConnected[segment.flatIdx])
+      self.assertEqual(expectedActivePotential[referenceSegment.flatIdx],
+                       numActivePotential[segment.flatIdx])
+
+    for presynapticCell in xrange(96):
+      self.assertEqual(
+        len(reference.synapsesForPresynapticCell(presynapticCell)),
+        len(connections.synapsesForPresynapticCell(presynapticCell)))
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -20,6 +20,7 @@
 # ----------------------------------------------------------------------
 
 import numpy as np
+import pickle
 import tempfile
 import unittest
 
@@ -506,6 +507,433 @@ class KNNClassifierTest(unittest.TestCase):
     self.assertEquals(cat, 1)
 
 
+  def testInvertedIndexDistances(self):
+    dimensionality = 200
+    rng = np.random.RandomState(42)
+    patterns = [np.sort(rng.choice(dimensionality, 10, replace=False))
+                for _ in xrange(60)]
+    inputs = []
+    for _ in xrange(10):
+      dense = np.zeros(dimensionality)
+      dense[rng.choice(dimensionality, 12, replace=False)] = 1.0
+      inputs.append(dense)
+
+    for distanceMethod in ("rawOverlap", "pctOverlapOfInput",
+                           "pctOverlapOfProto", "pctOverlapOfLarger"):
+      knn = KNNClassifier(distanceMethod=distanceMethod, k=3)
+      indexed = KNNClassifier(distanceMethod=distanceMethod, k=3,
+                              useInvertedIndex=True)
+      for i, pattern in enumerate(patterns):
+        knn.learn(pattern, i % 4, isSparse=dimensionality, partitionId=i % 5)
+        indexed.learn(pattern, i % 4, isSparse=dimensionality,
+                      partitionId=i % 5)
+
+      knn.removeCategory(2)
+      indexed.removeCategory(2)
+
+      for dense in inputs:
+        expected = knn.infer(dense, partitionId=1)
+        actual = indexed.infer(dense, partitionId=1)
+        self.assertEqual(expected[0], actual[0])
+        self.assertTrue(np.array_equal(expected[1], actual[1]))
+        self.assertTrue(np.array_equal(expected[2], actual[2]))
+        self.assertTrue(np.array_equal(expected[3], actual[3]))
+        self.assertTrue(np.array_equal(knn.getOverlaps(dense)[0],
+                                       indexed.getOverlaps(dense)[0]))
+
+
+  def testInvertedIndexFixedCapacity(self):
+    dimensionality = 50
+    knn = KNNClassifier(distanceMethod="rawOverlap", maxStoredPatterns=3)
+    indexed = KNNClassifier(distanceMethod="rawOverlap", maxStoredPatterns=3,
+                            useInvertedIndex=True)
+    patterns = [[0, 1, 2], [2, 3, 4], [4, 5, 6], [6, 7, 8], [8, 9, 10]]
+    for i, pattern in enumerate(patterns):
+      knn.learn(pattern, i, isSparse=dimensionality, rowID=i)
+      indexed.learn(pattern, i, isSparse=dimensionality, rowID=i)
+
+    self.assertEqual(3, indexed._numPatterns)
+    self.assertEqual({4: [0], 5: [0], 6: [0, 1], 7: [1], 8: [1, 2], 9: [2],
+                      10: [2]},
+                     indexed._invertedIndex)
+
+    indexed.removeIds([3])
+    knn.removeIds([3])
+    dense = np.zeros(dimensionality)
+    dense[[4, 8, 9]] = 1.0
+    self.assertTrue(np.array_equal(knn.getOverlaps(dense)[0],
+                                   indexed.getOverlaps(dense)[0]))
+
+
+  def testApproximateInference(self):
+    dimensionality = 500
+    rng = np.random.RandomState(42)
+    patterns = [np.sort(rng.choice(dimensionality, 20, replace=False))
+                for _ in xrange(40)]
+
+    knn = KNNClassifier(distanceMethod="pctOverlapOfInput", k=1)
+    approximate = KNNClassifier(distanceMethod="pctOverlapOfInput", k=1,
+                                numLSHBands=20, numLSHRowsPerBand=2)
+    for i, pattern in enumerate(patterns):
+      knn.learn(pattern, i % 3, isSparse=dimensionality, partitionId=i)
+      approximate.learn(pattern, i % 3, isSparse=dimensionality,
+                        partitionId=i)
+
+    for i, pattern in enumerate(patterns):
+      # Drop one bit, so that the stored pattern is the nearest neighbor.
+      dense = np.zeros(dimensionality)
+      dense[pattern[1:]] = 1.0
+      expected = knn.infer(dense)
+      actual = approximate.infer(dense)
+      self.assertEqual(expected[0], actual[0])
+
+      # Candidates have exact distances, all other patterns are infinitely
+      # far away.
+      dist = actual[2]
+      candidates = np.isfinite(dist)
+      self.assertTrue(candidates[i])
+      self.assertTrue(np.array_equal(expected[2][candidates],
+                                     dist[candidates]))
+      self.assertLess(candidates.sum(), len(patterns) / 2)
+
+      # Partition exclusion still applies to candidates.
+      dist = approximate.infer(dense, partitionId=i)[2]
+      self.assertEqual(np.inf, dist[i])
+
+    winner, dist, _ = approximate.getClosest(dense, topKCategories=1)
+    self.assertEqual(39 % 3, winner)
+    self.assertEqual(0.0, dist[39])
+
+    approximate.removeCategory(0)
+    knn.removeCategory(0)
+    dense = np.zeros(dimensionality)
+    dense[patterns[1]] = 1.0
+    self.assertEqual(0.0, approximate.infer(dense)[2][0])
+
+
+  def testApproximateInferenceWithoutCandidates(self):
+    dimensionality = 500
+    rng = np.random.RandomState(42)
+    knn = KNNClassifier(distanceMethod="pctOverlapOfInput", k=1)
+    approximate = KNNClassifier(distanceMethod="pctOverlapOfInput", k=1,
+                                numLSHBands=20, numLSHRowsPerBand=2)
+    for i in xrange(10):
+      pattern = np.sort(rng.choice(dimensionality - 20, 20, replace=False))
+      knn.learn(pattern, i % 3, isSparse=dimensionality)
+      approximate.learn(pattern, i % 3, isSparse=dimensionality)
+
+    # No stored pattern shares a bit with the input, so none is a candidate
+    # and the exact distances are used instead.
+    dense = np.zeros(dimensionality)
+    dense[-20:] = 1.0
+    self.assertEqual(0, len(approximate._lsh.query(np.flatnonzero(dense))))
+    expected = knn.infer(dense)
+    actual = approximate.infer(dense)
+    self.assertEqual(expected[0], actual[0])
+    self.assertTrue(np.array_equal(expected[2], actual[2]))
+
+
+  def testApproximateInferenceRequiresOverlap(self):
+    with self.assertRaises(AssertionError):
+      KNNClassifier(distanceMethod="norm", numLSHBands=4)
+
+
+  def testDeletedRowsAreSkipped(self):
+    dimensionality = 100
+    rng = np.random.RandomState(42)
+    patterns = [np.sort(rng.choice(dimensionality, 10, replace=False))
+                for _ in xrange(20)]
+
+    for distanceMethod in ("rawOverlap", "norm"):
+      knn = KNNClassifier(distanceMethod=distanceMethod, k=3,
+                          maxStoredPatterns=100, maxDeletedFraction=0.0)
+      lazy = KNNClassifier(distanceMethod=distanceMethod, k=3,
+                           maxStoredPatterns=100, maxDeletedFraction=0.5)
+      for i, pattern in enumerate(patterns):
+        knn.learn(pattern, i % 4, isSparse=dimensionality, rowID=i,
+                  partitionId=i % 3)
+        lazy.learn(pattern, i % 4, isSparse=dimensionality, rowID=i,
+                   partitionId=i % 3)
+
+      for classifier in (knn, lazy):
+        classifier.removeIds([0, 5, 6])
+        classifier.removeCategory(3)
+        classifier.learn(patterns[0], 1, isSparse=dimensionality, rowID=20)
+
+      # Eight of 21 rows are deleted, which is below the compaction threshold.
+      self.assertEqual(8, len(lazy._deletedRows))
+      self.assertEqual(13, lazy._numPatterns)
+      self.assertEqual(21, len(lazy._rowCategories))
+      self.assertEqual(knn._categoryList, lazy._categoryList)
+      self.assertEqual(knn._categoryRecencyList, lazy._categoryRecencyList)
+      self.assertEqual(knn.getPartitionIdList(), lazy.getPartitionIdList())
+
+      for i in xrange(lazy._numPatterns):
+        self.assertTrue(np.array_equal(knn.getPattern(i),
+                                       lazy.getPattern(i)))
+
+      for pattern in patterns[:5]:
+        dense = np.zeros(dimensionality)
+        dense[pattern] = 1.0
+        expected = knn.infer(dense, partitionId=2)
+        actual = lazy.infer(dense, partitionId=2)
+        self.assertEqual(expected[0], actual[0])
+        self.assertTrue(np.array_equal(expected[1], actual[1]))
+        self.assertTrue(np.array_equal(expected[2], actual[2]))
+        self.assertTrue(np.array_equal(expected[3], actual[3]))
+        self.assertTrue(np.array_equal(
+          knn.closestTrainingPattern(dense, 1),
+          lazy.closestTrainingPattern(dense, 1)))
+
+      # Deleting more rows passes the threshold and compacts the memory.
+      knn.removeCategory(0)
+      lazy.removeCategory(0)
+      self.assertEqual([], lazy._deletedRows.tolist())
+      self.assertEqual(lazy._numPatterns, lazy._Memory.nRows())
+      self.assertEqual(lazy._numPatterns, len(lazy._rowCategories))
+      self.assertTrue(np.array_equal(knn.infer(dense)[2],
+                                     lazy.infer(dense)[2]))
+
+
+  def testDeletedRowsDenseMemory(self):
+    knn = KNNClassifier(distanceMethod="norm", useSparseMemory=False,
+                        maxDeletedFraction=0.5)
+    patterns = np.eye(6)
+    for i, pattern in enumerate(patterns):
+      knn.learn(pattern, i)
+
+    knn.removeCategory(1)
+    self.assertEqual([1], knn._deletedRows.tolist())
+    knn.learn(patterns[1], 7)
+    self.assertEqual(6, knn._numPatterns)
+    self.assertEqual([0, 2, 3, 4, 5, 7], knn._categoryList)
+    self.assertTrue(np.array_equal(patterns[1], knn.getPattern(5)))
+    self.assertEqual(5, knn.infer(patterns[1])[2].argmin())
+
+    knn.compactMemory()
+    self.assertEqual([], knn._deletedRows.tolist())
+    self.assertTrue(np.array_equal(patterns[[0, 2, 3, 4, 5, 1]], knn._M))
+    self.assertEqual(5, knn.infer(patterns[1])[2].argmin())
+
+
+  def testInferBatch(self):
+    dimensionality = 100
+    rng = np.random.RandomState(42)
+    patterns = [np.sort(rng.choice(dimensionality, 10, replace=False))
+                for _ in xrange(20)]
+    inputs = np.zeros((8, dimensionality))
+    for i in xrange(len(inputs)):
+      inputs[i, rng.choice(dimensionality, 12, replace=False)] = 1.0
+    inputs[1, :] = 0
+    inputs[2, patterns[3]] = 1.0
+    partitionIds = [None, 0, 1, 2, None, 1, 0, 2]
+
+    for distanceMethod in ("rawOverlap", "pctOverlapOfInput",
+                           "pctOverlapOfProto", "pctOverlapOfLarger", "norm"):
+      knn = KNNClassifier(distanceMethod=distanceMethod, k=3,
+                          maxStoredPatterns=100, maxDeletedFraction=0.5,
+                          minSparsity=0.05)
+      for i, pattern in enumerate(patterns):
+        knn.learn(pattern, i % 4, isSparse=dimensionality, rowID=i,
+                  partitionId=i % 3)
+      knn.removeIds([4, 7])
+
+      expected = [knn.infer(pattern, partitionId=partitionId)
+                  for pattern, partitionId in zip(inputs, partitionIds)]
+      for numProcesses in (None, 2):
+        actual = knn.inferBatch(inputs, partitionIds=partitionIds,
+                                numProcesses=numProcesses)
+        self.assertEqual(len(expected), len(actual))
+        for expectedResult, actualResult in zip(expected, actual):
+          self.assertEqual(expectedResult[0], actualResult[0])
+          for expectedValue, actualValue in zip(expectedResult[1:],
+                                                actualResult[1:]):
+            self.assertTrue(np.array_equal(expectedValue, actualValue))
+
+
+  def testInferBatchNoCategories(self):
+    knn = KNNClassifier(distanceMethod="rawOverlap")
+    for winner, inferenceResult, dist, categoryDist in knn.inferBatch(
+        np.eye(4)):
+      self.assertIsNone(winner)
+      self.assertTrue(np.array_equal(np.zeros(1), inferenceResult))
+      self.assertTrue(np.array_equal(np.ones(1), dist))
+      self.assertTrue(np.array_equal(np.ones(1), categoryDist))
+
+
+  def testIncrementalSVD(self):
+    # Patterns in a 3 dimensional subspace, which 3 components capture exactly
+    rng = np.random.RandomState(42)
+    basis = rng.randn(3, 20)
+    patterns = np.dot(rng.randn(50, 3), basis) + rng.randn(20)
+    categories = np.arange(50) % 5
+
+    for lazy in (False, True):
+      knn = KNNClassifier(k=1, numSVDDims=3, svdBatchSize=10,
+                          lazySVDReprojection=lazy, useSparseMemory=False)
+      for pattern, category in zip(patterns, categories):
+        knn.learn(pattern, category)
+
+      self.assertEqual([], knn._svdBatch)
+      self.assertEqual(50, knn._svdSamplesSeen)
+      self.assertEqual((3, 20), knn._vt.shape)
+      self.assertEqual(lazy, knn._memoryVt is not None)
+      np.testing.assert_allclose(patterns.mean(axis=0), knn._mean)
+
+      centered = patterns - knn._mean
+      np.testing.assert_allclose(
+        np.dot(np.dot(centered, knn._vt.T), knn._vt), centered, atol=1e-8)
+
+      # The stored patterns follow the updated components
+      for i in xrange(len(patterns)):
+        np.testing.assert_allclose(
+          np.dot(knn.getPattern(i), knn._vt) + knn._mean, patterns[i],
+          atol=1e-8)
+        self.assertEqual(categories[i], knn.infer(patterns[i])[0])
+      self.assertIsNone(knn._memoryVt)
+
+
+  def testIncrementalSVDPartialFirstBatch(self):
+    rng = np.random.RandomState(42)
+    knn = KNNClassifier(k=1, numSVDDims=3, svdBatchSize=10,
+                        useSparseMemory=False)
+    for i in xrange(2):
+      knn.learn(rng.randn(20), i)
+
+    # Fewer inputs than components stay buffered instead of lowering numSVDDims
+    knn.finishLearning()
+    self.assertIsNone(knn._vt)
+    self.assertEqual(2, len(knn._svdBatch))
+    self.assertEqual(3, knn.numSVDDims)
+
+    knn.learn(rng.randn(20), 2)
+    knn.finishLearning()
+    self.assertEqual((3, 20), knn._vt.shape)
+    self.assertEqual([], knn._svdBatch)
+    self.assertEqual(3, knn.numSVDDims)
+
+
+  @unittest.skipUnless(__debug__, "Only applicable when asserts are enabled")
+  def testIncrementalSVDBadParams(self):
+    with self.assertRaises(AssertionError):
+      KNNClassifier(numSVDDims="adaptive", svdBatchSize=10)
+    with self.assertRaises(AssertionError):
+      KNNClassifier(numSVDDims=20, svdBatchSize=10)
+
+
+  def testEvictionPolicyLRU(self):
+    dimensionality = 100
+    patterns = [np.arange(10 * i, 10 * i + 10) for i in xrange(4)]
+    dense = np.zeros((4, dimensionality))
+    for i, pattern in enumerate(patterns):
+      dense[i, pattern] = 1.0
+
+    for useInvertedIndex, numLSHBands in ((False, 0), (True, 0), (False, 8)):
+      knn = KNNClassifier(k=1, distanceMethod="rawOverlap",
+                          maxStoredPatterns=3, evictionPolicy="lru",
+                          useInvertedIndex=useInvertedIndex,
+                          numLSHBands=numLSHBands)
+      for i in xrange(3):
+        knn.learn(patterns[i], i, isSparse=dimensionality, rowID=i)
+
+      # Matching the first pattern makes the second the least recently used
+      self.assertEqual(0, knn.infer(dense[0])[0])
+      knn.learn(patterns[3], 3, isSparse=dimensionality, rowID=3)
+
+      self.assertEqual(3, knn._numPatterns)
+      self.assertEqual(3, knn._Memory.nRows())
+      self.assertEqual([0, 3, 2], knn._categoryList)
+      self.assertEqual([0, 3, 2], knn._categoryRecencyList)
+      self.assertTrue(np.array_equal(patterns[3],
+                                     knn.getPattern(1, sparseBinaryForm=True)))
+      self.assertEqual(3, knn.infer(dense[3])[0])
+
+      invertedIndex = knn._invertedIndex
+      buckets = knn._lsh._buckets if knn._lsh is not None else None
+      knn._rebuildIndexes()
+      self.assertEqual(knn._invertedIndex, invertedIndex)
+      if buckets is not None:
+        self.assertEqual(knn._lsh._buckets, buckets)
+
+
+  def testEvictionPolicyReservoir(self):
+    dimensionality = 100
+    rng = np.random.RandomState(42)
+    patterns = [np.sort(rng.choice(dimensionality, 10, replace=False))
+                for _ in xrange(200)]
+
+    for useSparseMemory in (True, False):
+      knn = KNNClassifier(k=1, useSparseMemory=useSparseMemory,
+                          maxStoredPatterns=10, evictionPolicy="reservoir")
+      for i, pattern in enumerate(patterns):
+        knn.learn(pattern, i, isSparse=dimensionality, rowID=i)
+
+      self.assertEqual(10, knn._numPatterns)
+      self.assertEqual(200, knn._numOfferedPatterns)
+      if useSparseMemory:
+        self.assertEqual(10, knn._Memory.nRows())
+      else:
+        self.assertEqual(10, knn._Memory.shape[0])
+
+      # The sample spans the whole stream
+      self.assertGreater(max(knn._categoryList), 100)
+      for idx, category in enumerate(knn._categoryList):
+        self.assertEqual(category, knn._categoryRecencyList[idx])
+        self.assertTrue(np.array_equal(
+          patterns[category], knn.getPattern(idx).nonzero()[0]))
+
+
+  def testEvictionPolicyQuota(self):
+    dimensionality = 100
+    rng = np.random.RandomState(42)
+    knn = KNNClassifier(k=1, distanceMethod="rawOverlap", maxStoredPatterns=6,
+                        evictionPolicy="quota")
+    for i in xrange(13):
+      pattern = np.sort(rng.choice(dimensionality, 10, replace=False))
+      knn.learn(pattern, int(i >= 10), isSparse=dimensionality, rowID=i)
+
+    # Category 1 took its share of the capacity from category 0
+    self.assertEqual(3, knn._categoryList.count(0))
+    self.assertEqual(3, knn._categoryList.count(1))
+    self.assertEqual([7, 8, 9], sorted(
+      rowID for rowID, category in zip(knn._categoryRecencyList,
+                                       knn._categoryList) if category == 0))
+
+    # Removing patterns keeps the eviction order of the others
+    removedRow = knn._rowRecencies.index(7)
+    evictionOrder = [knn._rowRecencies[row]
+                     for row in knn._evictionOrder[0] if row != removedRow]
+    knn.removeIds([7])
+    self.assertEqual(5, knn._numPatterns)
+    self.assertEqual(knn._storedRow(np.arange(5)).tolist(),
+                     sorted(knn._evictionGroups))
+    knn.compactMemory()
+    self.assertEqual(range(5), sorted(knn._evictionGroups))
+    self.assertEqual(evictionOrder, [knn._rowRecencies[row]
+                                     for row in knn._evictionOrder[0]])
+
+
+  def testStoredRowLookup(self):
+    knn = KNNClassifier(distanceMethod="rawOverlap", maxStoredPatterns=100,
+                        maxDeletedFraction=0.9)
+    for i in xrange(10):
+      knn.learn([i], i, isSparse=10, rowID=i, partitionId=i % 2)
+
+    knn.removeIds([0, 3, 4, 9])
+    self.assertEqual([0, 3, 4, 9], knn._deletedRows.tolist())
+    self.assertEqual([1, 2, 5, 6, 7, 8],
+                     knn._storedRow(np.arange(6)).tolist())
+    self.assertEqual(5, knn._storedRow(2))
+    self.assertEqual(2, knn._patternIndex(5))
+    self.assertEqual([1, 2, 5, 6, 7, 8], knn._categoryList)
+    self.assertEqual([1, 2, 5, 6, 7, 8], knn._categoryRecencyList)
+    self.assertEqual([1, 0, 1, 0, 1, 0], knn.getPartitionIdList())
+    self.assertItemsEqual([1, 3, 5], knn.getPatternIndicesWithPartitionId(0))
+    self.assertEqual(1, knn.getPartitionId(4))
+    self.assertTrue(np.array_equal([5], knn.getPattern(2,
+                                                       sparseBinaryForm=True)))
+
+
   @unittest.skipUnless(
       capnp, "pycapnp is not installed, skipping serialization test.")
   def testWriteRead(self):
@@ -549,5 +977,127 @@ class KNNClassifierTest(unittest.TestCase):
 
 
 
+
+  @unittest.skipUnless(
+      capnp, "pycapnp is not installed, skipping serialization test.")
+  def testWriteDoesNotChangeClassifier(self):
+    dimensionality = 40
+    rng = np.random.RandomState(42)
+    sparse = KNNClassifier(distanceMethod="rawOverlap", k=3,
+                           maxDeletedFraction=0.5)
+    for i in xrange(10):
+      pattern = np.sort(rng.choice(dimensionality, 8, replace=False))
+      sparse.learn(pattern, i % 3, isSparse=dimensionality,
+                   partitionId=i % 2)
+    sparse.removeCategory(1)
+
+    dense = KNNClassifier(k=1, numSVDDims=3, svdBatchSize=10,
+                          lazySVDReprojection=True, useSparseMemory=False)
+    for i in xrange(20):
+      dense.learn(rng.randn(dimensionality), i % 3)
+
+    for knn in (sparse, dense):
+      deletedRows = knn._deletedRows.tolist()
+      memoryVt = knn._memoryVt
+      proto = KNNClassifierProto.new_message()
+      knn.write(proto)
+      self.assertEqual(deletedRows, knn._deletedRows.tolist())
+      self.assertIs(memoryVt, knn._memoryVt)
+
+      with tempfile.TemporaryFile() as f:
+        proto.write(f)
+        f.seek(0)
+        protoDeserialized = KNNClassifierProto.read(f)
+      knnDeserialized = KNNClassifier.read(protoDeserialized)
+
+      self.assertEqual(deletedRows, knnDeserialized._deletedRows.tolist())
+      self.assertEqual(knn._categoryList, knnDeserialized._categoryList)
+      self.assertEqual(knn.getPartitionIdList(),
+                       knnDeserialized.getPartitionIdList())
+      for i in xrange(knn._numPatterns):
+        np.testing.assert_allclose(knn.getPattern(i),
+                                   knnDeserialized.getPattern(i), atol=1e-5)
+
+
+  @unittest.skipUnless(
+      capnp, "pycapnp is not installed, skipping serialization test.")
+  def testWriteReadKeepsSettings(self):
+    dimensionality = 40
+    rng = np.random.RandomState(42)
+    patterns = [np.sort(rng.choice(dimensionality, 8, replace=False))
+                for _ in xrange(4)]
+    lru = KNNClassifier(k=1, distanceMethod="rawOverlap", maxStoredPatterns=3,
+                        evictionPolicy="lru", useInvertedIndex=True,
+                        maxDeletedFraction=0.5)
+    for i in xrange(3):
+      lru.learn(patterns[i], i, isSparse=dimensionality)
+    # Matching the first pattern makes the second one the least recently used
+    lru.infer(lru.getPattern(0))
+
+    lsh = KNNClassifier(distanceMethod="rawOverlap", numLSHBands=8,
+                        numLSHRowsPerBand=2)
+    lsh.learn(patterns[0], 0, isSparse=dimensionality)
+
+    svd = KNNClassifier(k=1, numSVDDims=3, svdBatchSize=10,
+                        lazySVDReprojection=True, useSparseMemory=False)
+    for i in xrange(15):
+      svd.learn(rng.randn(dimensionality), i % 3)
+
+    deserialized = []
+    for knn in (lru, lsh, svd):
+      proto = KNNClassifierProto.new_message()
+      knn.write(proto)
+      with tempfile.TemporaryFile() as f:
+        proto.write(f)
+        f.seek(0)
+        protoDeserialized = KNNClassifierProto.read(f)
+      knnDeserialized = KNNClassifier.read(protoDeserialized)
+      for name in ("useInvertedIndex", "numLSHBands", "numLSHRowsPerBand",
+                   "maxDeletedFraction", "svdBatchSize", "lazySVDReprojection",
+                   "evictionPolicy"):
+        self.assertEqual(getattr(knn, name), getattr(knnDeserialized, name))
+      deserialized.append(knnDeserialized)
+    lruDeserialized, lshDeserialized, svdDeserialized = deserialized
+
+    self.assertEqual(lru._rowRecencies, lruDeserialized._rowRecencies)
+    for knn in (lru, lruDeserialized):
+      knn.learn(patterns[3], 3, isSparse=dimensionality)
+    self.assertEqual([0, 3, 2], lru._categoryList)
+    self.assertEqual(lru._categoryList, lruDeserialized._categoryList)
+
+    self.assertIsNotNone(lshDeserialized._lsh)
+
+    self.assertEqual(10, svdDeserialized._svdSamplesSeen)
+    self.assertEqual(5, len(svdDeserialized._svdBatch))
+
+
+  @unittest.skipUnless(
+      capnp, "pycapnp is not installed, skipping serialization test.")
+  def testDenseEvictionAfterWriteRead(self):
+    rng = np.random.RandomState(42)
+    patterns = rng.rand(4, 10)
+    knn = KNNClassifier(k=1, maxStoredPatterns=3, evictionPolicy="lru",
+                        useSparseMemory=False)
+    for i in xrange(3):
+      knn.learn(patterns[i], i)
+
+    proto = KNNClassifierProto.new_message()
+    knn.write(proto)
+    with tempfile.TemporaryFile() as f:
+      proto.write(f)
+      f.seek(0)
+      protoDeserialized = KNNClassifierProto.read(f)
+
+    for restored in (KNNClassifier.read(protoDeserialized),
+                     pickle.loads(pickle.dumps(knn))):
+      # The full memory evicts the least recently used pattern in place, and
+      # inference sees the new pattern
+      restored.learn(patterns[3], 3)
+      self.assertEqual([3, 1, 2], restored._categoryList)
+      winner, _, dist, _ = restored.infer(patterns[3])
+      self.assertEqual(3, winner)
+      self.assertEqual(0.0, dist[0])
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,100 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+"""Unit tests for MinHashLSH."""
+
+import unittest
+
+import numpy
+
+from nupic.algorithms.minhash_lsh import MinHashLSH
+
+
+
+class MinHashLSHTest(unittest.TestCase):
+
+
+  def testInvalidParams(self):
+    with self.assertRaises(ValueError):
+      MinHashLSH(0, 4)
+    with self.assertRaises(ValueError):
+      MinHashLSH(4, 0)
+
+
+  def testSignatureDependsOnlyOnTheSet(self):
+    lsh = MinHashLSH(8, 4)
+    self.assertEqual(32, len(lsh.signature([1, 5, 9])))
+    numpy.testing.assert_array_equal(lsh.signature([1, 5, 9]),
+                                     lsh.signature([9, 1, 5, 5]))
+    self.assertFalse(numpy.array_equal(lsh.signature([1, 5, 9]),
+                                       lsh.signature([1, 5, 10])))
+
+
+  def testQueryFindsSimilarPatterns(self):
+    lsh = MinHashLSH(20, 2)
+    rng = numpy.random.RandomState(42)
+    patterns = [rng.choice(1000, 40, replace=False) for _ in xrange(50)]
+    for i, pattern in enumerate(patterns):
+      self.assertEqual(i, lsh.add(pattern))
+
+    # A pattern always finds itself, and with 20 bands of 2 rows, a copy
+    # with 38 of its 40 bits is almost certainly found too.
+    for i, pattern in enumerate(patterns):
+      self.assertIn(i, lsh.query(pattern))
+      self.assertIn(i, lsh.query(pattern[:38]))
+
+    # Unrelated patterns are rarely candidates.
+    unrelated = [len(lsh.query(rng.choice(1000, 40, replace=False)))
+                 for _ in xrange(20)]
+    self.assertLess(sum(unrelated), 50)
+
+
+  def testReplaceRow(self):
+    lsh = MinHashLSH(4, 2)
+    lsh.add([1, 2, 3])
+    lsh.add([4, 5, 6])
+
+    lsh.replaceRow(0, [1, 2, 3], [7, 8, 9])
+    self.assertEqual(2, lsh.numRows)
+    self.assertEqual([0], lsh.query([7, 8, 9]).tolist())
+    self.assertEqual([1], lsh.query([4, 5, 6]).tolist())
+    self.assertEqual([], lsh.query([1, 2, 3]).tolist())
+
+
+  def testRemoveRows(self):
+    lsh = MinHashLSH(4, 2)
+    patterns = [[1, 2, 3], [4, 5, 6], [1, 2, 3], [7, 8, 9]]
+    for pattern in patterns:
+      lsh.add(pattern)
+
+    lsh.removeRows([0, 1])
+    self.assertEqual(2, lsh.numRows)
+    self.assertEqual([0], lsh.query([1, 2, 3]).tolist())
+    self.assertEqual([1], lsh.query([7, 8, 9]).tolist())
+    self.assertEqual([], lsh.query([4, 5, 6]).tolist())
+
+    self.assertEqual(2, lsh.add([4, 5, 6]))
+    self.assertEqual([2], lsh.query([4, 5, 6]).tolist())
+
+
+
+if __name__ == "__main__":
+  unittest.main()
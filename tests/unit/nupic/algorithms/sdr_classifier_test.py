@@ -22,6 +22,7 @@
 """Unit tests for SDRClassifier module."""
 
 
+from collections import namedtuple
 import cPickle as pickle
 import random
 import tempfile
@@ -874,10 +875,151 @@ class SDRClassifierTest(unittest.TestCase):
     self.assertEqual(len(pretty.split(" ")), 12)
 
 
+  def testWeightMatrixGrowsGeometrically(self):
+    classifier = self._classifier(steps=[1], alpha=0.1)
+    bufferShapes = set()
+    for i in xrange(1, 100):
+      self._compute(classifier, i, [i, 2 * i], i // 3, i)
+      self.assertEqual((2 * i + 1, i // 3 + 1),
+                       classifier._weightMatrix[1].shape)
+      bufferShapes.add(classifier._weightBuffers[1].shape)
+
+    # Growing one row or column at a time only reallocates a logarithmic
+    # number of times.
+    self.assertLessEqual(len(bufferShapes), 16)
+    self.assertEqual(198, classifier._maxInputIdx)
+    self.assertEqual(33, classifier._maxBucketIdx)
+
+    # The spare capacity is never written to.
+    weights = classifier._weightBuffers[1].copy()
+    weights[:199, :34] = 0
+    self.assertEqual(0, numpy.count_nonzero(weights))
+
+    result = classifier.infer([20, 40], None)
+    self.assertEqual(34, len(result[1]))
+    self.assertAlmostEqual(1.0, result[1].sum())
+
+
+  def testPickleStoresLogicalWeights(self):
+    c1 = self._classifier(steps=[1], alpha=0.1)
+    for i in xrange(1, 20):
+      self._compute(c1, i, [i, 2 * i], i // 3, i)
+
+    c2 = pickle.loads(pickle.dumps(c1))
+    self.assertEqual(c1._weightMatrix[1].shape,
+                     c2._weightBuffers[1].shape)
+    numpy.testing.assert_array_equal(c1._weightMatrix[1],
+                                     c2._weightMatrix[1])
+
+    # Both copies keep learning identically after growing further.
+    for i in xrange(20, 40):
+      r1 = self._compute(c1, i, [i, 2 * i], i // 3, i)
+      r2 = self._compute(c2, i, [i, 2 * i], i // 3, i)
+      numpy.testing.assert_array_equal(r1[1], r2[1])
+    numpy.testing.assert_array_equal(c1._weightMatrix[1],
+                                     c2._weightMatrix[1])
+
+
+  def testLearningMatchesPerBitUpdate(self):
+    classifier = self._classifier(steps=[1, 2], alpha=0.1)
+    self._compute(classifier, 0, [99], 4, 4)
+    rng = random.Random(42)
+
+    for recordNum in xrange(1, 50):
+      # Patterns may contain the same bit twice.
+      pattern = [rng.randrange(100) for _ in xrange(10)]
+      bucketIdx = rng.randrange(5)
+
+      expected = dict((step, weights.copy())
+                      for step, weights in classifier._weightMatrix.items())
+      history = list(classifier._patternNZHistory) + [(recordNum, pattern)]
+      targetDist = numpy.zeros(5)
+      targetDist[bucketIdx] = 1.0
+      for learnRecordNum, learnPattern in history[-3:]:
+        nSteps = recordNum - learnRecordNum
+        if nSteps in classifier.steps:
+          error = targetDist - classifier.inferSingleStep(learnPattern,
+                                                          expected[nSteps])
+          for bit in learnPattern:
+            expected[nSteps][bit, :] += 0.1 * error
+
+      self._compute(classifier, recordNum, pattern, bucketIdx, bucketIdx)
+      for step in classifier.steps:
+        numpy.testing.assert_array_equal(expected[step],
+                                         classifier._weightMatrix[step])
+
+
+  def testInferBatch(self):
+    classifier = self._classifier(steps=[1, 2], alpha=0.5)
+    self._compute(classifier, 0, [49], 7, 1.5)
+    rng = random.Random(42)
+    for recordNum in xrange(1, 30):
+      pattern = rng.sample(xrange(50), 5)
+      self._compute(classifier, recordNum, pattern, rng.randrange(8), 1.5)
+
+    patterns = [rng.sample(xrange(50), 5) for _ in xrange(10)] + [[]]
+    result = classifier.inferBatch(patterns)
+
+    for i, pattern in enumerate(patterns):
+      expected = classifier.infer(pattern, None)
+      for step in (1, 2):
+        self.assertEqual((len(patterns), 8), result[step].shape)
+        numpy.testing.assert_allclose(expected[step], result[step][i])
+    self.assertEqual(classifier.infer(patterns[0], None)["actualValues"],
+                     result["actualValues"])
+
+    # CSR input gives the same result.
+    indptr = numpy.cumsum([0] + [len(pattern) for pattern in patterns])
+    indices = [bit for pattern in patterns for bit in pattern]
+    csr = namedtuple("CSR", "indptr indices")(indptr, indices)
+    csrResult = classifier.inferBatch(csr)
+    numpy.testing.assert_array_equal(result[1], csrResult[1])
+
+    bucketIdx, likelihoods = classifier.inferBatch(patterns, topK=3)[1]
+    self.assertEqual((len(patterns), 3), bucketIdx.shape)
+    # The last, empty, pattern predicts all buckets equally.
+    for i in xrange(len(patterns) - 1):
+      self.assertEqual(set(numpy.argsort(-result[1][i])[:3]),
+                       set(bucketIdx[i]))
+      self.assertTrue(numpy.all(numpy.diff(likelihoods[i]) <= 0))
+      numpy.testing.assert_array_equal(result[1][i][bucketIdx[i]],
+                                       likelihoods[i])
+
+    bucketIdx, _ = classifier.inferBatch(patterns, topK=20)[1]
+    self.assertEqual((len(patterns), 8), bucketIdx.shape)
+
+    with self.assertRaises(ValueError):
+      classifier.inferBatch(patterns, topK=0)
+
+
+  def testInferBatchLargeActivation(self):
+    classifier = self._classifier(steps=[1], alpha=0.1)
+    self._compute(classifier, 0, [1, 2], 1, 1)
+    classifier._weightMatrix[1][1, 0] = 1000.0
+
+    result = classifier.inferBatch([[1, 2]])[1]
+    self.assertTrue(numpy.all(numpy.isfinite(result)))
+    self.assertAlmostEqual(1.0, result[0, 0])
+
+
   def _checkValue(self, retval, index, value):
     self.assertEqual(retval["actualValues"][index], value)
 
 
+  def testGetMemoryUsage(self):
+    classifier = self._classifier(steps=[1, 2], alpha=1.0)
+    self._compute(classifier, 0, [1, 5], 0, 10)
+    usage = classifier.getMemoryUsage()
+    self._compute(classifier, 1, [1, 500], 40, 20)
+    grownUsage = classifier.getMemoryUsage()
+
+    self.assertEqual(2 * 501 * 41 * 8, grownUsage["weights"])
+    self.assertGreater(grownUsage["actualValues"], usage["actualValues"])
+    self.assertEqual(sum(value for key, value in grownUsage.iteritems()
+                         if key != "total"),
+                     grownUsage["total"])
+
+
   @staticmethod
   def _compute(classifier, recordNum, pattern, bucket, value):
     classification = {"bucketIdx": bucket, "actValue": value}
@@ -22,6 +22,7 @@
 # Disable since test code accesses private members in the class to be tested
 # pylint: disable=W0212
 
+import cPickle as pickle
 import numbers
 import numpy
 import tempfile
@@ -32,7 +33,9 @@ from nupic.bindings.math import GetNTAReal, Random
 
 from nupic.algorithms.spatial_pooler import (BinaryCorticalColumns,
                                              CorticalColumns,
-                                             SpatialPooler)
+                                             InvalidSPParamValueError,
+                                             SpatialPooler,
+                                             SpatialPoolerSnapshot)
 from nupic.support.unittesthelpers.algorithm_test_helpers import (
   getNumpyRandomGenerator, getSeed)
 
@@ -970,6 +973,42 @@ class SpatialPoolerTest(unittest.TestCase):
       self.assertAlmostEqual(actual, expected)
 
 
+  def testLocalNeighborhoodUpdatesMatchPerColumn(self):
+    """Checks the vectorized local boost factors and minimum duty cycles
+    against a computation done one column neighborhood at a time"""
+    randomState = getNumpyRandomGenerator()
+    sp = SpatialPooler(inputDimensions=[20, 17],
+                       columnDimensions=[20, 17],
+                       potentialRadius=3,
+                       boostStrength=3.0,
+                       seed=getSeed())
+    for wrapAround in (True, False):
+      sp._wrapAround = wrapAround
+      for inhibitionRadius in (1, 3, 9):
+        sp._inhibitionRadius = inhibitionRadius
+        sp.setActiveDutyCycles(randomState.rand(sp._numColumns) ** 3)
+        sp.setOverlapDutyCycles(randomState.rand(sp._numColumns) ** 3)
+
+        targetDensity = numpy.zeros(sp._numColumns, dtype=realDType)
+        minOverlapDutyCycles = numpy.zeros(sp._numColumns, dtype=realDType)
+        for column in xrange(sp._numColumns):
+          neighborhood = sp._getColumnNeighborhood(column)
+          targetDensity[column] = numpy.mean(
+            sp._activeDutyCycles[neighborhood])
+          minOverlapDutyCycles[column] = (
+            sp._overlapDutyCycles[neighborhood].max() *
+            sp._minPctOverlapDutyCycles)
+
+        sp._updateBoostFactorsLocal()
+        sp._updateMinDutyCyclesLocal()
+        numpy.testing.assert_array_equal(
+          numpy.exp((targetDensity - sp._activeDutyCycles) *
+                    sp._boostStrength),
+          sp._boostFactors)
+        numpy.testing.assert_array_equal(minOverlapDutyCycles,
+                                         sp._minOverlapDutyCycles)
+
+
   def testUpdateMinDutyCyclesGlobal(self):
     sp = self._sp
     sp._minPctOverlapDutyCycles = 0.01
@@ -1394,6 +1433,34 @@ class SpatialPoolerTest(unittest.TestCase):
     self.assertListEqual(trueActive, sorted(active))
 
 
+  def testSelectGlobalWinners(self):
+    """Checks that selecting the global winners with a partial sort gives the
+    same columns, in the same order, as the stable sort"""
+    sp = self._sp
+    randomState = getNumpyRandomGenerator()
+    for numColumns in (5, 2048, 16384):
+      sp._numColumns = numColumns
+      for numActive in (0, 1, min(40, numColumns), numColumns):
+        overlaps = randomState.randint(0, 8, numColumns).astype(realDType)
+        sp._stimulusThreshold = 3
+
+        sortedWinnerIndices = numpy.argsort(overlaps, kind='mergesort')
+        sortedWinnerIndices = sortedWinnerIndices[numColumns - numActive:]
+        expected = [i for i in sortedWinnerIndices[::-1]
+                    if overlaps[i] >= sp._stimulusThreshold]
+
+        winners = sp._selectGlobalWinners(overlaps, numActive)
+        self.assertListEqual(expected, list(winners))
+
+    sp._numColumns = 2048
+    density = 0.02
+    overlaps = randomState.randint(0, 8, 2048).astype(realDType)
+    sp._selectGlobalWinners = Mock(return_value=numpy.array([1]))
+    self.assertListEqual([1], list(sp._inhibitColumnsGlobal(overlaps,
+                                                            density)))
+    sp._selectGlobalWinners.assert_called_once_with(overlaps, 40)
+
+
   def testInhibitColumnsLocal(self):
     sp = self._sp
     density = 0.5
@@ -1451,6 +1518,58 @@ class SpatialPoolerTest(unittest.TestCase):
     self.assertListEqual(trueActive, sorted(active))
 
 
+  def testInhibitColumnsLocalMatchesSequential(self):
+    """Checks the vectorized local inhibition against a column by column
+    implementation, on a 2D topology with many tied overlaps"""
+
+    def inhibitSequentially(sp, overlaps, density):
+      activeArray = numpy.zeros(sp._numColumns, dtype="bool")
+      for column, overlap in enumerate(overlaps):
+        if overlap >= sp._stimulusThreshold:
+          neighborhood = sp._getColumnNeighborhood(column)
+          neighborhoodOverlaps = overlaps[neighborhood]
+          numBigger = numpy.count_nonzero(neighborhoodOverlaps > overlap)
+          ties = numpy.where(neighborhoodOverlaps == overlap)
+          numTiesLost = numpy.count_nonzero(activeArray[neighborhood[ties]])
+          numActive = int(0.5 + density * len(neighborhood))
+          if numBigger + numTiesLost < numActive:
+            activeArray[column] = True
+      return activeArray.nonzero()[0]
+
+    randomState = getNumpyRandomGenerator()
+    sp = SpatialPooler(inputDimensions=[16, 16],
+                       columnDimensions=[12, 10],
+                       potentialRadius=4,
+                       stimulusThreshold=1,
+                       seed=getSeed())
+    for wrapAround in (True, False):
+      sp._wrapAround = wrapAround
+      for inhibitionRadius in (1, 2, 4):
+        sp._inhibitionRadius = inhibitionRadius
+        for density in (0.1, 0.2, 0.5):
+          overlaps = randomState.randint(0, 4, 120).astype(realDType)
+          numpy.testing.assert_array_equal(
+            inhibitSequentially(sp, overlaps, density),
+            sp._inhibitColumnsLocal(overlaps, density))
+
+
+  def testColumnNeighborhoodsCache(self):
+    sp = self._sp
+    sp._inhibitionRadius = 1
+    neighborhoods, sizes = sp._getColumnNeighborhoods()
+    self.assertIs(neighborhoods, sp._getColumnNeighborhoods()[0])
+    for column in xrange(sp._numColumns):
+      self.assertSetEqual(set(sp._getColumnNeighborhood(column)),
+                          set(neighborhoods[column, :sizes[column]]))
+      self.assertTrue((neighborhoods[column, sizes[column]:] ==
+                       sp._numColumns).all())
+
+    sp._inhibitionRadius = 2
+    neighborhoods, sizes = sp._getColumnNeighborhoods()
+    self.assertEqual(5, sizes.max())
+    self.assertIsNone(pickle.loads(pickle.dumps(sp))._columnNeighborhoods)
+
+
   @unittest.skipUnless(
       capnp, "pycapnp is not installed, skipping serialization test.")
   def testWriteRead(self):
@@ -1489,7 +1608,8 @@ class SpatialPoolerTest(unittest.TestCase):
     # Load the deserialized proto
     sp2 = SpatialPooler.read(proto2)
 
-    ephemeral = set(["_boostedOverlaps", "_overlaps"])
+    ephemeral = set(["_boostedOverlaps", "_overlaps", "_columnNeighborhoods",
+                     "_columnNeighborhoodsKey"])
 
     # Check that the two spatial poolers have the same attributes
     self.assertSetEqual(set(sp1.__dict__.keys()), set(sp2.__dict__.keys()))
@@ -1521,6 +1641,139 @@ class SpatialPoolerTest(unittest.TestCase):
     self.assertSetEqual(indices1, indices2)
 
 
+  def testCompactPermanences(self):
+    """Checks that compact permanences are stored as multiples of 1/255, and
+    that the connected synapses agree with the stored values"""
+    params = dict(self._params, inputDimensions=[30], columnDimensions=[12],
+                  potentialRadius=10, compactPermanences=True)
+    sp = SpatialPooler(**params)
+    self.assertTrue(sp.getCompactPermanences())
+    randomState = getNumpyRandomGenerator()
+    activeArray = numpy.zeros(12, dtype=uintDType)
+    for _ in xrange(30):
+      inputVector = (randomState.rand(30) > 0.6).astype(uintDType)
+      sp.compute(inputVector, True, activeArray)
+
+    permanences = sp._permanences.toDense()
+    steps = permanences * 255
+    numpy.testing.assert_allclose(steps, numpy.round(steps), atol=1e-4)
+    for columnIndex in xrange(12):
+      potential = numpy.zeros(30, dtype=uintDType)
+      sp.getPotential(columnIndex, potential)
+      self.assertFalse(permanences[columnIndex][potential == 0].any())
+      connected = numpy.zeros(30, dtype=uintDType)
+      sp.getConnectedSynapses(columnIndex, connected)
+      numpy.testing.assert_array_equal(
+        connected, permanences[columnIndex] >= sp._synPermConnected - 1e-6)
+
+    # Changing the potential pool keeps the permanences of the inputs that
+    # remain in it
+    potential = numpy.zeros(30, dtype=uintDType)
+    sp.getPotential(0, potential)
+    kept = potential.nonzero()[0][::2]
+    potential[:] = 0
+    potential[kept] = 1
+    sp.setPotential(0, potential)
+    expected = numpy.zeros(30, dtype=realDType)
+    expected[kept] = permanences[0][kept]
+    numpy.testing.assert_array_equal(expected, sp._permanences[0])
+
+    sp2 = pickle.loads(pickle.dumps(sp))
+    self.assertIs(sp2._potentialPools, sp2._permanences._potentialPools)
+    numpy.testing.assert_array_equal(sp._permanences.toDense(),
+                                     sp2._permanences.toDense())
+
+    with self.assertRaises(InvalidSPParamValueError):
+      SpatialPooler(**dict(params, synPermInactiveDec=0.001))
+    with self.assertRaises(InvalidSPParamValueError):
+      SpatialPooler(**dict(params, synPermConnected=0.01))
+
+
+  def testGetMemoryUsage(self):
+    params = dict(self._params, inputDimensions=[30], columnDimensions=[12],
+                  potentialRadius=10)
+    usage = SpatialPooler(**params).getMemoryUsage()
+    compactUsage = SpatialPooler(
+      **dict(params, compactPermanences=True)).getMemoryUsage()
+
+    self.assertEqual(3 * 12 * numpy.dtype(realDType).itemsize,
+                     usage["dutyCycles"])
+    self.assertLess(compactUsage["permanences"], usage["permanences"])
+    self.assertEqual(usage["potentialPools"], compactUsage["potentialPools"])
+    self.assertEqual(sum(value for key, value in usage.iteritems()
+                         if key != "total"),
+                     usage["total"])
+
+
+  @unittest.skipUnless(
+      capnp, "pycapnp is not installed, skipping serialization test.")
+  def testWriteReadCompactPermanences(self):
+    sp1 = SpatialPooler(**dict(self._params, compactPermanences=True))
+    inputVector = numpy.array([1, 0, 1, 0, 1])
+    activeArray1 = numpy.zeros(5)
+    sp1.compute(inputVector, True, activeArray1)
+
+    proto1 = SpatialPoolerProto_capnp.SpatialPoolerProto.new_message()
+    sp1.write(proto1)
+    with tempfile.TemporaryFile() as f:
+      proto1.write(f)
+      f.seek(0)
+      proto2 = SpatialPoolerProto_capnp.SpatialPoolerProto.read(f)
+
+    sp2 = SpatialPooler.read(proto2, compactPermanences=True)
+    self.assertTrue(sp2.getCompactPermanences())
+    numpy.testing.assert_array_equal(sp1._permanences.toDense(),
+                                     sp2._permanences.toDense())
+
+    # Without the flag the same values are read into the float matrix
+    sp3 = SpatialPooler.read(proto2)
+    self.assertFalse(sp3.getCompactPermanences())
+    numpy.testing.assert_array_almost_equal(sp1._permanences.toDense(),
+                                            sp3._permanences.toDense())
+
+    activeArray2 = numpy.zeros(5)
+    sp1.compute(inputVector, True, activeArray1)
+    sp2.compute(inputVector, True, activeArray2)
+    numpy.testing.assert_array_equal(activeArray1, activeArray2)
+
+
+  def testSnapshotMatchesCompute(self):
+    """Checks that a snapshot of a trained SP computes the same active
+    columns as the SP itself with learning off"""
+    randomState = getNumpyRandomGenerator()
+    for globalInhibition in (True, False):
+      sp = SpatialPooler(inputDimensions=[10, 10],
+                         columnDimensions=[8, 8],
+                         potentialRadius=3,
+                         globalInhibition=globalInhibition,
+                         numActiveColumnsPerInhArea=4,
+                         stimulusThreshold=1,
+                         seed=getSeed())
+      activeArray = numpy.zeros(64, dtype=uintDType)
+      for _ in xrange(20):
+        inputVector = (randomState.rand(100) > 0.8).astype(uintDType)
+        sp.compute(inputVector, True, activeArray)
+
+      with tempfile.NamedTemporaryFile() as f:
+        sp.writeSnapshot(f.name)
+        snapshot = SpatialPoolerSnapshot(f.name)
+
+      self.assertEqual(64, snapshot.getNumColumns())
+      self.assertEqual(100, snapshot.getNumInputs())
+      inputMatrix = (randomState.rand(30, 100) > 0.8).astype(uintDType)
+      expected = numpy.zeros((30, 64), dtype=uintDType)
+      snapshotArray = numpy.zeros(64, dtype=uintDType)
+      for i in xrange(30):
+        sp.compute(inputMatrix[i], False, expected[i])
+        snapshot.compute(inputMatrix[i], False, snapshotArray)
+        numpy.testing.assert_array_equal(expected[i], snapshotArray)
+      numpy.testing.assert_array_equal(expected,
+                                       snapshot.computeBatch(inputMatrix))
+
+      with self.assertRaises(ValueError):
+        snapshot.compute(inputMatrix[0], True, snapshotArray)
+
+
   def testRandomSPDoesNotLearn(self):
 
     sp = SpatialPooler(inputDimensions=[5],
@@ -1543,6 +1796,94 @@ class SpatialPoolerTest(unittest.TestCase):
     self.assertEqual(sp._permanences, initialPerms)
 
 
+  def testComputeSparseMatchesCompute(self):
+    """Checks that computeSparse, given the indices of the active input bits,
+    learns and outputs exactly what compute does with the dense input"""
+    randomState = getNumpyRandomGenerator()
+    for globalInhibition in (True, False):
+      params = dict(self._params,
+                    inputDimensions=[40],
+                    columnDimensions=[20],
+                    potentialRadius=10,
+                    globalInhibition=globalInhibition,
+                    stimulusThreshold=1)
+      sp1 = SpatialPooler(**params)
+      sp2 = SpatialPooler(**params)
+      activeArray1 = numpy.zeros(20, dtype=uintDType)
+      activeArray2 = numpy.zeros(20, dtype=uintDType)
+
+      for _ in xrange(60):
+        inputVector = (randomState.rand(40) > 0.7).astype(uintDType)
+        sp1.compute(inputVector, True, activeArray1)
+        sp2.computeSparse(inputVector.nonzero()[0], True, activeArray2)
+        numpy.testing.assert_array_equal(activeArray1, activeArray2)
+        numpy.testing.assert_array_equal(sp1.getOverlaps(),
+                                         sp2.getOverlaps())
+
+      numpy.testing.assert_array_equal(sp1._permanences.toDense(),
+                                       sp2._permanences.toDense())
+      numpy.testing.assert_array_equal(sp1._activeDutyCycles,
+                                       sp2._activeDutyCycles)
+      self.assertFalse(sp2._sparseInputBuffer.any())
+
+    with self.assertRaises(ValueError):
+      sp2.computeSparse([3, 40], False, activeArray2)
+    with self.assertRaises(ValueError):
+      sp2.computeSparse([40, 3], False, activeArray2)
+    with self.assertRaises(ValueError):
+      sp2.computeSparse([-1, 3], False, activeArray2)
+
+
+  def testComputeBatchMatchesCompute(self):
+    """Checks that computeBatch without learning picks the same active columns
+    as feeding the records one by one through compute"""
+    randomState = getNumpyRandomGenerator()
+    for globalInhibition in (True, False):
+      sp = SpatialPooler(inputDimensions=[100],
+                         columnDimensions=[64],
+                         potentialRadius=20,
+                         globalInhibition=globalInhibition,
+                         numActiveColumnsPerInhArea=5,
+                         stimulusThreshold=2,
+                         seed=getSeed())
+      inputMatrix = (randomState.rand(30, 100) > 0.8).astype(uintDType)
+      inputMatrix[0] = 0
+
+      expected = numpy.zeros((30, 64), dtype=uintDType)
+      for i in xrange(30):
+        sp.compute(inputMatrix[i], False, expected[i])
+      self.assertEqual(sp.getIterationNum(), 30)
+
+      activeMatrix = sp.computeBatch(inputMatrix)
+      numpy.testing.assert_array_equal(expected, activeMatrix)
+      self.assertEqual(sp.getIterationNum(), 60)
+      self.assertEqual(sp.getIterationLearnNum(), 0)
+
+      activeInputs = [row.nonzero()[0] for row in inputMatrix]
+      numpy.testing.assert_array_equal(expected,
+                                       sp.computeBatch(activeInputs))
+
+
+  def testComputeBatchLearn(self):
+    """Checks that computeBatch with learning behaves like compute"""
+    randomState = getNumpyRandomGenerator()
+    params = dict(self._params, inputDimensions=[20], columnDimensions=[10])
+    sp1 = SpatialPooler(**params)
+    sp2 = SpatialPooler(**params)
+    inputMatrix = (randomState.rand(15, 20) > 0.5).astype(uintDType)
+
+    expected = numpy.zeros((15, 10), dtype=uintDType)
+    for i in xrange(15):
+      sp1.compute(inputMatrix[i], True, expected[i])
+
+    numpy.testing.assert_array_equal(expected,
+                                     sp2.computeBatch(inputMatrix, True))
+    self.assertEqual(sp1.getIterationLearnNum(), sp2.getIterationLearnNum())
+    for i in xrange(10):
+      numpy.testing.assert_array_equal(sp1._permanences[i],
+                                       sp2._permanences[i])
+
+
   @unittest.skip("Ported from the removed FlatSpatialPooler but fails. \
                   See: https://github.com/numenta/nupic/issues/1897")
   def testActiveColumnsEqualNumActive(self):
@@ -0,0 +1,153 @@
+# ----------------------------------------------------------------------
+# Numenta Platform for Intelligent Computing (NuPIC)
+# Copyright (C) 2017, Numenta, Inc.  Unless you have an agreement
+# with Numenta, Inc., for a separate license for this software code, the
+# following terms and conditions apply:
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero Public License version 3 as
+# published by the Free Software Foundation.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero Public License for more details.
+#
+# You should have received a copy of the GNU Affero Public License
+# along with this program.  If not, see http://www.gnu.org/licenses.
+#
+# http://numenta.org/licenses/
+# ----------------------------------------------------------------------
+
+import tempfile
+import unittest
+
+try:
+  import capnp
+except ImportError:
+  capnp = None
+
+from nupic.algorithms.temporal_memory import TemporalMemory
+from nupic.algorithms.temporal_memory_bank import TemporalMemoryBank
+from nupic.data.generators.pattern_machine import PatternMachine
+if capnp:
+  from nupic.algorithms.temporal_memory_bank_capnp import (
+    TemporalMemoryBankProto)
+
+
+
+class TemporalMemoryBankTest(unittest.TestCase):
+
+  PARAMS = dict(columnDimensions=[64],
+                cellsPerColumn=4,
+                activationThreshold=3,
+                initialPermanence=.21,
+                connectedPermanence=.50,
+                minThreshold=2,
+                maxNewSynapseCount=6,
+                permanenceIncrement=.10,
+                permanenceDecrement=.05,
+                predictedSegmentDecrement=.02,
+                maxSegmentsPerCell=3,
+                maxSynapsesPerSegment=8)
+
+
+  def testInitInvalidParams(self):
+    self.assertRaises(ValueError, TemporalMemoryBank, 0)
+    self.assertRaises(ValueError, TemporalMemoryBank, 2, seeds=[1, 2, 3])
+
+
+  def testStreamsMatchIsolatedModels(self):
+    """ Every stream behaves exactly like a TemporalMemory with its seed.
+    """
+    seeds = [42, 7, 1956]
+    bank = TemporalMemoryBank(len(seeds), seeds=seeds, **self.PARAMS)
+    models = [TemporalMemory(seed=seed, **self.PARAMS) for seed in seeds]
+
+    sequences = []
+    for i, seed in enumerate(seeds):
+      patternMachine = PatternMachine(64, 6, num=8, seed=seed)
+      period = 5 + i
+      sequences.append([patternMachine.get(t % period) for t in xrange(120)])
+
+    for t in xrange(120):
+      activeColumns = [sequence[t] for sequence in sequences]
+      learn = t < 100
+      activeCells, predictiveCells = bank.compute(activeColumns, learn)
+
+      for stream, model in enumerate(models):
+        model.compute(activeColumns[stream], learn)
+        self.assertEqual(model.getActiveCells(), activeCells[stream])
+        self.assertEqual(model.getPredictiveCells(), predictiveCells[stream])
+        self.assertEqual(model.getWinnerCells(),
+                         bank.getWinnerCellsForStream(stream))
+
+      if t == 60:
+        bank.reset(1)
+        models[1].reset()
+
+    offset = 0
+    for model in models:
+      for cell in xrange(model.numberOfCells()):
+        self.assertEqual(
+          len(model.connections.segmentsForCell(cell)),
+          len(bank.connections.segmentsForCell(offset + cell)))
+      offset += bank.numCellsPerStream
+
+
+  def testEmptyStreams(self):
+    bank = TemporalMemoryBank(2, **self.PARAMS)
+    activeCells, predictiveCells = bank.compute([[], [0]])
+
+    self.assertEqual([[], [0, 1, 2, 3]], activeCells)
+    self.assertEqual([[], []], predictiveCells)
+    self.assertEqual([0, 1, 2, 3], bank.getActiveCellsForStream(1))
+    self.assertEqual([], bank.getPredictiveCellsForStream(0))
+    self.assertRaises(IndexError, bank.getActiveCellsForStream, 2)
+    self.assertRaises(ValueError, bank.compute, [[0]])
+
+
+  @unittest.skipUnless(
+      capnp, "pycapnp is not installed, skipping serialization test.")
+  def testWriteRead(self):
+    seeds = [42, 7]
+    bank1 = TemporalMemoryBank(len(seeds), seeds=seeds, **self.PARAMS)
+    sequences = []
+    for seed in seeds:
+      patternMachine = PatternMachine(64, 6, num=8, seed=seed)
+      sequences.append([patternMachine.get(t % 5) for t in xrange(60)])
+
+    for t in xrange(40):
+      bank1.compute([sequence[t] for sequence in sequences])
+
+    proto1 = TemporalMemoryBankProto.new_message()
+    bank1.write(proto1)
+    with tempfile.TemporaryFile() as f:
+      proto1.write(f)
+      f.seek(0)
+      proto2 = TemporalMemoryBankProto.read(f)
+    bank2 = TemporalMemoryBank.read(proto2)
+
+    self.assertEqual(bank1.numStreams, bank2.numStreams)
+    self.assertEqual(bank1.streamColumnDimensions,
+                     bank2.streamColumnDimensions)
+    self.assertEqual(bank1.numCellsPerStream, bank2.numCellsPerStream)
+    self.assertEqual(bank1._prevActiveCellsForStream,
+                     bank2._prevActiveCellsForStream)
+    self.assertEqual(bank1._prevWinnerCellsForStream,
+                     bank2._prevWinnerCellsForStream)
+
+    # Both banks keep learning the same way, including the random choices of
+    # each stream
+    for t in xrange(40, 60):
+      activeColumns = [sequence[t] for sequence in sequences]
+      self.assertEqual(bank1.compute(activeColumns),
+                       bank2.compute(activeColumns))
+    for stream in xrange(len(seeds)):
+      self.assertEqual(bank1.getWinnerCellsForStream(stream),
+                       bank2.getWinnerCellsForStream(stream))
+
+
+
+if __name__ == '__main__':
+  unittest.main()
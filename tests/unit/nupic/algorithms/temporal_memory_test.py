@@ -20,9 +20,13 @@
 # ----------------------------------------------------------------------
 
 import copy
+import pickle
 import tempfile
 import unittest
 
+import numpy
+
+from nupic.algorithms.connections import ArrayConnections, Connections
 from nupic.algorithms.temporal_memory import TemporalMemory
 from nupic.data.generators.pattern_machine import PatternMachine
 from nupic.data.generators.sequence_machine import SequenceMachine
@@ -966,6 +970,171 @@ class TemporalMemoryTest(unittest.TestCase):
     self.assertEqual(2, tm.connections.numSegments())
 
 
+  def testArrayConnectionsMatchConnections(self):
+    """ A TM backed by ArrayConnections learns exactly like the default one.
+    """
+    class ArrayConnectionsTM(TemporalMemory):
+      @staticmethod
+      def connectionsFactory(*args, **kwargs):
+        return ArrayConnections(*args, **kwargs)
+
+    params = dict(columnDimensions=[64],
+                  cellsPerColumn=4,
+                  activationThreshold=3,
+                  initialPermanence=.21,
+                  connectedPermanence=.50,
+                  minThreshold=2,
+                  maxNewSynapseCount=6,
+                  permanenceIncrement=.10,
+                  permanenceDecrement=.05,
+                  predictedSegmentDecrement=.02,
+                  maxSegmentsPerCell=3,
+                  maxSynapsesPerSegment=8,
+                  seed=42)
+    tm1 = TemporalMemory(**params)
+    tm2 = ArrayConnectionsTM(**params)
+    self.assertIsInstance(tm2.connections, ArrayConnections)
+
+    patternMachine = PatternMachine(64, 6, num=8, seed=42)
+    sequence = [patternMachine.get(i % 8) for i in xrange(100)]
+
+    for pattern in sequence:
+      tm1.compute(pattern)
+      tm2.compute(pattern)
+      self.assertEqual(tm1.getActiveCells(), tm2.getActiveCells())
+      self.assertEqual(tm1.getWinnerCells(), tm2.getWinnerCells())
+      self.assertEqual(tm1.getPredictiveCells(), tm2.getPredictiveCells())
+
+    self.assertEqual(tm1.connections.numSegments(),
+                     tm2.connections.numSegments())
+    self.assertEqual(tm1.connections.numSynapses(),
+                     tm2.connections.numSynapses())
+    for cell in xrange(tm1.numberOfCells()):
+      segments1 = tm1.connections.segmentsForCell(cell)
+      segments2 = tm2.connections.segmentsForCell(cell)
+      self.assertEqual(len(segments1), len(segments2))
+      for segment1, segment2 in zip(segments1, segments2):
+        self.assertEqual(
+          sorted((s.presynapticCell, s.permanence) for s in
+                 tm1.connections.synapsesForSegment(segment1)),
+          sorted((s.presynapticCell, s.permanence) for s in
+                 tm2.connections.synapsesForSegment(segment2)))
+
+
+  def testArrayConnectionsDestroyMinPermanenceSynapses(self):
+    """ The vectorized eviction destroys the same synapses as the scan, both
+    for well separated permanences and for permanences within EPSILON.
+    """
+    permanenceSets = [
+      [.30, .11, .20, .11, .60, .20],
+      [.30, .11, .11 + 1e-7, .11 - 1e-7, .60, .20],
+      [.30, .11, .11 + 6e-6, .11 - 6e-6, .60, .20],
+    ]
+    for permanences in permanenceSets:
+      remaining = []
+      for connections in (Connections(32), ArrayConnections(32)):
+        segment = connections.createSegment(0)
+        for cell, permanence in enumerate(permanences):
+          connections.createSynapse(segment, cell + 1, permanence)
+
+        TemporalMemory._destroyMinPermanenceSynapses(
+          connections, None, segment, 3, [2])
+
+        remaining.append(sorted(
+          (s.presynapticCell, s.permanence)
+          for s in connections.synapsesForSegment(segment)))
+
+      self.assertEqual(3, len(remaining[0]))
+      self.assertEqual(remaining[0], remaining[1])
+
+
+  def testCompactionDoesNotChangeLearning(self):
+    """ A TM that compacts its connections whenever any index is unused
+        computes the same as one that never compacts.
+    """
+    class ArrayConnectionsTM(TemporalMemory):
+      @staticmethod
+      def connectionsFactory(*args, **kwargs):
+        return ArrayConnections(*args, **kwargs)
+
+    params = dict(columnDimensions=[32],
+                  cellsPerColumn=2,
+                  activationThreshold=3,
+                  initialPermanence=.21,
+                  connectedPermanence=.50,
+                  minThreshold=2,
+                  maxNewSynapseCount=4,
+                  permanenceIncrement=.10,
+                  permanenceDecrement=.10,
+                  predictedSegmentDecrement=.08,
+                  maxSegmentsPerCell=2,
+                  maxSynapsesPerSegment=6,
+                  seed=42)
+
+    for tmClass in (TemporalMemory, ArrayConnectionsTM):
+      tm1 = tmClass(**params)
+      tm2 = tmClass(compactionThreshold=0.0, **params)
+
+      patternMachine = PatternMachine(32, 4, num=10, seed=42)
+      sequence = [patternMachine.get((i * 7) % 10) for i in xrange(150)]
+
+      for pattern in sequence:
+        tm1.compute(pattern)
+        tm2.compute(pattern)
+        self.assertEqual(tm1.getActiveCells(), tm2.getActiveCells())
+        self.assertEqual(tm1.getWinnerCells(), tm2.getWinnerCells())
+        self.assertEqual(tm1.getPredictiveCells(), tm2.getPredictiveCells())
+        self.assertEqual(0, tm2.connections.fragmentation())
+        self.assertEqual(tm2.connections.numSegments(),
+                         tm2.connections.segmentFlatListLength())
+
+      self.assertEqual(tm1.connections, tm2.connections)
+
+
+  def testSegmentActivityCountsAreArrays(self):
+    tm = TemporalMemory(columnDimensions=[32], cellsPerColumn=4,
+                        compactionThreshold=0.0)
+    for counts in (tm.numActiveConnectedSynapsesForSegment,
+                   tm.numActivePotentialSynapsesForSegment):
+      self.assertIsInstance(counts, numpy.ndarray)
+
+    for pattern in ([0, 1, 2], [3, 4, 5], [0, 1, 2]):
+      tm.compute(pattern)
+      for counts in (tm.numActiveConnectedSynapsesForSegment,
+                     tm.numActivePotentialSynapsesForSegment):
+        self.assertIsInstance(counts, numpy.ndarray)
+        self.assertEqual(tm.connections.segmentFlatListLength(), len(counts))
+
+
+  def testUnpickleStateWithoutCompaction(self):
+    """ Instances pickled before compaction existed still load and run. """
+    tm = TemporalMemory(columnDimensions=[32], cellsPerColumn=4)
+    tm.compute([0, 1, 2])
+    state = tm.__dict__.copy()
+    for key in ("compactionThreshold", "_activeSegmentColumns",
+                "_matchingSegmentColumns"):
+      del state[key]
+
+    tm2 = TemporalMemory.__new__(TemporalMemory)
+    tm2.__setstate__(state)
+
+    self.assertIsNone(tm2.compactionThreshold)
+    tm2.compute([0, 1, 2])
+    tm3 = pickle.loads(pickle.dumps(tm2))
+    self.assertEqual(tm2, tm3)
+
+
+  def testGetMemoryUsage(self):
+    tm = TemporalMemory(columnDimensions=[32], cellsPerColumn=4)
+    tm.compute([0, 1, 2])
+    usage = tm.getMemoryUsage()
+
+    self.assertEqual(tm.connections.getMemoryUsage(), usage["connections"])
+    self.assertEqual(usage["connections"]["total"] +
+                     usage["segmentActivity"] + usage["cellActivity"],
+                     usage["total"])
+
+
   def testColumnForCell1D(self):
     tm = TemporalMemory(
       columnDimensions=[2048],
@@ -1210,8 +1379,14 @@ class TemporalMemoryTest(unittest.TestCase):
     tm2 = TemporalMemory.read(proto2)
 
     self.assertEqual(tm1, tm2)
+    self.assertIsNone(tm2.compactionThreshold)
+    self.assertIsInstance(tm2.numActivePotentialSynapsesForSegment,
+                          numpy.ndarray)
     self.serializationTestVerify(tm2)
 
+    tm3 = TemporalMemory.read(proto2, compactionThreshold=0.5)
+    self.assertEqual(0.5, tm3.compactionThreshold)
+
 
   @unittest.skip("Manually enable this when you want to use it.")
   def testWriteTestFile(self):
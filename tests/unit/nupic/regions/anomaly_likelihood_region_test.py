@@ -125,6 +125,31 @@ class AnomalyLikelihoodRegionTest(unittest.TestCase):
       score2 = outputs['anomalyLikelihood'][0]
       self.assertEqual(score1, score2)
 
+  @unittest.skipUnless(
+    capnp, "pycapnp is not installed, skipping serialization test.")
+  def testSerializationKeepsIncrementalEstimation(self):
+    anomalyLikelihoodRegion1 = AnomalyLikelihoodRegion()
+    anomalyLikelihoodRegion1.anomalyLikelihood = AnomalyLikelihood(
+      learningPeriod=10, estimationSamples=10, incrementalEstimation=True)
+    inputs = AnomalyLikelihoodRegion.getSpec()['inputs']
+    outputs = AnomalyLikelihoodRegion.getSpec()['outputs']
+    for _ in xrange(30):
+      inputs['rawAnomalyScore'] = numpy.array([random.random()])
+      inputs['metricValue'] = numpy.array([random.random()])
+      anomalyLikelihoodRegion1.compute(inputs, outputs)
+
+    proto1 = AnomalyLikelihoodRegionProto.new_message()
+    anomalyLikelihoodRegion1.write(proto1)
+    with tempfile.TemporaryFile() as f:
+      proto1.write(f)
+      f.seek(0)
+      proto2 = AnomalyLikelihoodRegionProto.read(f)
+
+    anomalyLikelihoodRegion2 = AnomalyLikelihoodRegion.read(proto2)
+    self.assertTrue(
+      anomalyLikelihoodRegion2.anomalyLikelihood._incrementalEstimation)
+    self.assertEqual(anomalyLikelihoodRegion1, anomalyLikelihoodRegion2)
+
 
 if __name__ == "__main__":
   unittest.main()
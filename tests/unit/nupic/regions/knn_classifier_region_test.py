@@ -44,7 +44,8 @@ class KNNClassifierRegionTest(unittest.TestCase):
   def testWriteRead(self):
     knn = KNNClassifierRegion(distanceMethod="norm", SVDDimCount=2,
                               SVDSampleCount=2, useSparseMemory=True,
-                              minSparsity=0.1, distThreshold=0.1)
+                              minSparsity=0.1, distThreshold=0.1,
+                              maxDeletedFraction=0.5)
 
     a = np.zeros(40)
     a[[1, 3, 7, 11, 13, 17, 19, 23, 29]] = 1
@@ -101,6 +102,8 @@ class KNNClassifierRegionTest(unittest.TestCase):
       protoDeserialized = KNNClassifierRegionProto.read(f)
 
     knnDeserialized = KNNClassifierRegion.readFromProto(protoDeserialized)
+    self.assertAlmostEqual(
+      0.5, knnDeserialized.knnParams["maxDeletedFraction"])
     expected = {
       "categoriesOut": np.zeros((1,)),
       "bestPrototypeIndices": np.zeros((1,)),
@@ -123,5 +126,24 @@ class KNNClassifierRegionTest(unittest.TestCase):
 
 
 
+  def testPatternMatrixSkipsRemovedPatterns(self):
+    knn = KNNClassifierRegion(distanceMethod="norm", useSparseMemory=False,
+                              maxDeletedFraction=0.5)
+    knn.setParameter('learningMode', None, True)
+    outputs = {
+      "categoriesOut": np.zeros((1,)),
+      "bestPrototypeIndices": np.zeros((1,)),
+      "categoryProbabilitiesOut": np.zeros((1,))
+    }
+    patterns = np.eye(4, 10)
+    for category, pattern in enumerate(patterns):
+      knn.compute({'categoryIn': [category], 'bottomUpIn': pattern}, outputs)
+
+    knn._knn.removeCategory(1)
+    patternMatrix = knn.getParameter('patternMatrix')
+    self.assertEqual([0, 2, 3], knn._knn._categoryList)
+    np.testing.assert_array_equal(patterns[[0, 2, 3]], patternMatrix)
+
+
 if __name__ == "__main__":
   unittest.main()
@@ -120,6 +120,42 @@ class RecordSensorRegionTest(unittest.TestCase):
     self.assertEquals(round(actValueOut, 1), 21.2)  # only 1 precision digit
 
 
+  def testSourceOut(self):
+    network = _createNetwork()
+    network.run(1)
+    sensor = network.regions['sensor'].getSelf()
+    sourceOut = network.regions['sensor'].getOutputData('sourceOut')
+    self.assertEquals(round(sourceOut[0], 1), 21.2)
+    self.assertEquals(round(sensor.getOutputValues('sourceOut')[0], 1), 21.2)
+    self.assertIsInstance(sensor.getOutputValues('sourceOut'), tuple)
+
+    encoding = network.regions['sensor'].getOutputData('dataOut')
+    sourceEncodings = sensor.getOutputValues('sourceEncodings')
+    self.assertEquals(1, len(sourceEncodings))
+    numpy.testing.assert_array_equal(encoding, sourceEncodings[0])
+
+
+  def testEncodingPlanFollowsEncoderChanges(self):
+    network = _createNetwork()
+    network.run(1)
+    sensor = network.regions['sensor'].getSelf()
+    plan = sensor._getEncodingPlan()
+    self.assertIs(plan, sensor._getEncodingPlan())
+
+    sensor.encoder.addEncoder(
+      'consumption2', sensor.encoder.encoders[0][1])
+    plan2 = sensor._getEncodingPlan()
+    self.assertIsNot(plan, plan2)
+    self.assertEquals(2, len(plan2.fields))
+
+    network.regions['sensor'].setParameter('predictedField', 'missing')
+    self.assertIsNone(sensor._getEncodingPlan().predictedEncoder)
+
+    # Only a MultiEncoder gets a plan, other encoders encode whole records
+    sensor.encoder = sensor.encoder.encoders[0][1]
+    self.assertIsNone(sensor._getEncodingPlan())
+
+
 
 if __name__ == "__main__":
   unittest.main()